@@ -0,0 +1,224 @@
+"""
+Incremental training of the classifier across the rounds of active learning.
+
+Instead of retraining from scratch on the whole labelled set every round,
+the model and the optimizer are kept in memory. Every round fine-tunes on the
+crops labelled since the previous round, mixed with a random replay subset of
+the crops seen before, and stops as soon as the loss on a fixed validation
+set stops improving. The work of a round grows with the query size rather
+than with the size of the labelled set.
+
+When no validation set is given, the validation crops are split from the
+first labelled crops. They are held out of the first round only: once it has
+stopped early, they join the training crops and are replayed in the next
+rounds like the others, so no labelled crop is lost for training. From the
+second round on, the validation loss and accuracy are therefore measured
+partly on crops the model has seen; pass a held-out validation set for an
+unbiased accuracy.
+
+The training crops are augmented with their rotations by 90, 180 and 270
+degrees, computed for the whole stack at once.
+"""
+import copy
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.model_selection import train_test_split
+
+from n_networks.neural_net import ChatGPT, normalize_crops
+from src.crop_store import crop_keys
+
+
+def rotations(images, labels):
+    """ Augment a stack of crops with its rotations by 90, 180 and 270 degrees. """
+    images = np.concatenate([np.rot90(images, k, axes=(1, 2)) for k in range(4)])
+    return images, np.tile(labels, 4)
+
+
+def weights_init(m):
+    if isinstance(m, (nn.Conv2d, nn.Linear)):
+        torch.nn.init.xavier_uniform_(m.weight)
+        m.bias.data.fill_(0.01)
+
+
+class ActiveLearningTrainer:
+    """ Keep a classifier in memory and fine-tune it after every query.
+
+    attributes
+    ----------
+    model: torch.nn.Module
+        classifier returning the bacillus probability of every crop
+    optimizer: torch.optim.Optimizer
+        optimizer kept across the rounds
+    validation_images, validation_labels: numpy array
+        fixed validation set, used for early stopping and the reported accuracy
+
+    methods
+    -------
+    fit(dataset)
+        fine-tune on the new crops of the labelled dataset and return the validation accuracy
+    predict(images)
+        bacillus probability of every crop
+    features(images)
+        output of the first fully connected layer, after the relu, for every crop
+    """
+    def __init__(self, model_class=ChatGPT, validation=None, validation_size=0.2, lr=0.001, batch_size=64,
+                 max_epochs=100, patience=5, replay_size=512, seed=42, device=None):
+        """
+        parameters
+        ----------
+        model_class: type
+            class of the classifier
+        validation: pandas dataframe
+            held-out validation set with 'image' and 'label' columns. If None, it is split
+            from the first labelled dataset and folded back into training after the first round
+        validation_size: float
+            fraction of the first labelled dataset used for validation if validation is None
+        lr: float
+            learning rate of Adam
+        batch_size: int
+            number of crops per step
+        max_epochs: int
+            maximum number of epochs per round
+        patience: int
+            number of epochs without improvement of the validation loss before stopping
+        replay_size: int
+            number of previously seen crops mixed with the new ones every round
+        seed: int
+            seed of the splits, the replay subsets and the shuffling
+        device: torch.device
+            device used for training, the GPU if available when None
+        """
+        self.device = device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.model = model_class()
+        self.model.apply(weights_init)
+        self.model.to(self.device)
+        self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
+        self.criterion = nn.BCELoss()
+        self.validation_size = validation_size
+        self.batch_size = batch_size
+        self.max_epochs = max_epochs
+        self.patience = patience
+        self.replay_size = replay_size
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.validation_images, self.validation_labels = None, None
+        if validation is not None:
+            self.validation_images = np.stack(validation['image'].to_numpy())
+            self.validation_labels = validation['label'].to_numpy(dtype=np.float32)
+        # keys of the crops that were already used for training or validation
+        self.seen = set()
+        self.train_images = np.zeros((0, 50, 50), dtype=np.float32)
+        self.train_labels = np.zeros(0, dtype=np.float32)
+
+    def _new_crops(self, dataset):
+        """ Crops and labels of the dataset that were not seen in a previous round. """
+        images = np.stack(dataset['image'].to_numpy())
+        labels = dataset['label'].to_numpy(dtype=np.float32)
+        keys = crop_keys(images)
+        new = np.array([key not in self.seen for key in keys.tolist()], dtype=bool)
+        self.seen.update(keys[new].tolist())
+        return images[new], labels[new]
+
+    def _tensors(self, images, labels):
+        return (torch.from_numpy(normalize_crops(images)).to(self.device),
+                torch.from_numpy(np.asarray(labels, dtype=np.float32)).to(self.device))
+
+    def _validation_loss(self, images, labels):
+        self.model.eval()
+        with torch.inference_mode():
+            outputs = torch.cat([self.model(images[start:start + 1024]).reshape(-1)
+                                 for start in range(0, images.shape[0], 1024)])
+        return self.criterion(outputs, labels).item(), (outputs > 0.5).float().eq(labels).float().mean().item()
+
+    def fit(self, dataset):
+        """ Fine-tune on the new crops of the labelled dataset, mixed with a replay subset.
+
+        parameters
+        ----------
+        dataset: pandas dataframe
+            all the labelled crops so far, with 'image' and 'label' columns
+
+        returns
+        -------
+        float
+            accuracy on the validation set, in percent
+        """
+        new_images, new_labels = self._new_crops(dataset)
+        split = self.validation_images is None
+        if split:
+            new_images, self.validation_images, new_labels, self.validation_labels = train_test_split(
+                new_images, new_labels, test_size=self.validation_size, random_state=self.seed)
+
+        # replay a random subset of the crops of the previous rounds
+        replay = self.rng.choice(self.train_labels.shape[0], min(self.replay_size, self.train_labels.shape[0]),
+                                 replace=False)
+        images = np.concatenate((new_images, self.train_images[replay]))
+        labels = np.concatenate((new_labels, self.train_labels[replay]))
+        self.train_images = np.concatenate((self.train_images, new_images))
+        self.train_labels = np.concatenate((self.train_labels, new_labels))
+
+        images, labels = self._tensors(*rotations(images, labels))
+        validation_images, validation_labels = self._tensors(self.validation_images, self.validation_labels)
+        generator = torch.Generator().manual_seed(int(self.rng.integers(2 ** 31)))
+
+        best_loss, best_state, best_optimizer, epochs_without_improvement = np.inf, None, None, 0
+        for ep in range(self.max_epochs):
+            self.model.train()
+            permutation = torch.randperm(labels.shape[0], generator=generator).to(self.device)
+            for start in range(0, labels.shape[0], self.batch_size):
+                batch = permutation[start:start + self.batch_size]
+                self.optimizer.zero_grad()
+                loss = self.criterion(self.model(images[batch]).reshape(-1), labels[batch])
+                loss.backward()
+                self.optimizer.step()
+
+            validation_loss, _ = self._validation_loss(validation_images, validation_labels)
+            if validation_loss < best_loss:
+                best_loss, epochs_without_improvement = validation_loss, 0
+                best_state = copy.deepcopy(self.model.state_dict())
+                best_optimizer = copy.deepcopy(self.optimizer.state_dict())
+            else:
+                epochs_without_improvement += 1
+                if epochs_without_improvement >= self.patience:
+                    break
+        print('Epochs: ', ep + 1, ' validation loss: ', best_loss)
+
+        # keep the weights with the lowest validation loss
+        self.model.load_state_dict(best_state)
+        self.optimizer.load_state_dict(best_optimizer)
+        _, accuracy = self._validation_loss(validation_images, validation_labels)
+        if split:
+            # the crops split for validation are trained on from the next round on
+            self.train_images = np.concatenate((self.train_images, self.validation_images))
+            self.train_labels = np.concatenate((self.train_labels, self.validation_labels))
+        return 100 * accuracy
+
+    def predict(self, images, batch_size=1024):
+        """ Bacillus probability of every crop of shape (n, 50, 50). """
+        self.model.eval()
+        outputs = []
+        with torch.inference_mode():
+            for start in range(0, len(images), batch_size):
+                batch = torch.from_numpy(normalize_crops(images[start:start + batch_size])).to(self.device)
+                outputs.append(self.model(batch).reshape(-1).cpu())
+        return torch.cat(outputs).numpy()
+
+    def features(self, images, batch_size=1024):
+        """ Output of fc1 after the relu for every crop of shape (n, 50, 50), used as feature vector.
+
+        fc1 runs once per forward pass, unlike relu3 that BacilliNet also applies after fc2.
+        """
+        outputs = []
+        hook = self.model.fc1.register_forward_hook(
+            lambda module, inputs, output: outputs.append(torch.relu(output).cpu()))
+        try:
+            self.model.eval()
+            with torch.inference_mode():
+                for start in range(0, len(images), batch_size):
+                    self.model(torch.from_numpy(normalize_crops(images[start:start + batch_size])).to(self.device))
+        finally:
+            hook.remove()
+        return torch.cat(outputs).numpy()
@@ -1,106 +1,128 @@
-import pandas as pd
-import torch
-from geomloss import SamplesLoss
 import numpy as np
+import pandas as pd
+from active_learning.knn_index import KnnIndex
+from active_learning.ot_distances import sinkhorn_cross_distances
+from src.crop_store import CropStore
+
+
+def rescale(images):
+    """ Rescale every image of a stack to [0, 1], constant images are left unchanged. """
+    images = np.asarray(images, dtype=np.float32)
+    minimum = images.min(axis=(1, 2), keepdims=True)
+    value_range = images.max(axis=(1, 2), keepdims=True) - minimum
+    constant = value_range == 0
+    return np.where(constant, images, (images - minimum) / np.where(constant, 1, value_range))
 
-def rescale(image):
-    if np.max(image) == np.min(image):
-        return image
-    else:
-        return (image - np.min(image)) / (np.max(image) - np.min(image))
 
 class LabelPropagation:
-    def __init__(self, labelled_dataset, unlabelled_dataset, k):
+    """ Propagate the labels of labelled crops to their nearest unlabelled crops.
+
+    Every labelled crop gives its label to its k nearest unlabelled crops.
+    An unlabelled crop that is among the nearest crops of several labelled
+    crops gets the label of the nearest of them.
+
+    Attributes:
+    ----------
+    labelled_dataset: CropStore
+        labelled crops
+    unlabelled_dataset: CropStore
+        unlabelled crops
+    k: int
+        number of unlabelled crops that receive the label of every labelled crop
+    block_size: int
+        number of labelled crops whose distances are computed at once
+
+    Methods:
+    -------
+    propagate(metric)
+        Propagate the labels with the l2 or ot metric.
+    l2_propagation()
+        Propagate the labels with the L2 distance between the crops.
+    ot_propagation()
+        Propagate the labels with the Sinkhorn distance between the rescaled crops.
+    """
+    def __init__(self, labelled_dataset, unlabelled_dataset, k, block_size=256):
+        """
+        parameters:
+        ----------
+        labelled_dataset: CropStore or pandas dataframe
+            labelled crops, with an 'image' and a 'label' column for a dataframe
+        unlabelled_dataset: CropStore or pandas dataframe
+            unlabelled crops, with an 'image' column for a dataframe
+        k: int
+            number of unlabelled crops that receive the label of every labelled crop
+        block_size: int
+            number of labelled crops whose distances are computed at once
+        """
+        if isinstance(labelled_dataset, pd.DataFrame):
+            labelled_dataset = CropStore.from_dataframe(labelled_dataset)
+        if isinstance(unlabelled_dataset, pd.DataFrame):
+            unlabelled_dataset = CropStore.from_dataframe(unlabelled_dataset)
         self.labelled_dataset = labelled_dataset
         self.unlabelled_dataset = unlabelled_dataset
         self.k = k
+        self.block_size = block_size
+
+    def propagate(self, metric='l2'):
+        """ Propagate the labels to the nearest unlabelled crops.
+
+        parameters
+        ----------
+        metric: str
+            l2 for the L2 distance between the crops, ot for the Sinkhorn
+            distance between the rescaled crops
+
+        returns
+        -------
+        CropStore
+            unlabelled crops that received a label, with their ids in the unlabelled dataset
+        """
+        if metric not in ('l2', 'ot'):
+            raise ValueError(f"Unknown metric {metric}, choose l2 or ot")
+
+        n = len(self.labelled_dataset)
+        k = min(self.k, len(self.unlabelled_dataset))
+        if n == 0 or k == 0:
+            return self.unlabelled_dataset.subset(np.zeros(0, dtype=np.int64))
+        if metric == 'l2':
+            # k nearest unlabelled crops of every labelled crop, with an index of the flattened unlabelled crops.
+            # the distances are computed in float64, the raw crops have values up to 16000,
+            # and the search stays exact whatever the size of the pool
+            unlabelled = self.unlabelled_dataset.images
+            index = KnnIndex(int(np.prod(unlabelled.shape[1:])), exact_size=None, block_size=self.block_size,
+                             dtype=np.float64)
+            index.add(unlabelled)
+            nearest_distances, nearest = index.search(self.labelled_dataset.images, k)
+        else:
+            labelled = rescale(self.labelled_dataset.images)
+            unlabelled = rescale(self.unlabelled_dataset.images)
+            # k nearest unlabelled crops of every labelled crop, one block of labelled crops at a time
+            nearest = np.zeros((n, k), dtype=np.int64)
+            nearest_distances = np.zeros((n, k))
+            for start in range(0, n, self.block_size):
+                # same Sinkhorn parameters as the original per-pair loss
+                block = np.asarray(sinkhorn_cross_distances(labelled[start:start + self.block_size], unlabelled,
+                                                            p=2, blur=.05, scaling=.95))
+                block_nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+                nearest[start:start + block.shape[0]] = block_nearest
+                nearest_distances[start:start + block.shape[0]] = np.take_along_axis(block, block_nearest, axis=1)
+
+        # every unlabelled crop keeps the label of its nearest labelled crop
+        rows = np.repeat(np.arange(n), k)
+        cols = nearest.ravel()
+        order = np.lexsort((nearest_distances.ravel(), cols))
+        first = np.ones(order.shape[0], dtype=bool)
+        first[1:] = cols[order[1:]] != cols[order[:-1]]
+        chosen = order[first]
+
+        propagated = self.unlabelled_dataset.subset(cols[chosen])
+        propagated.labels = self.labelled_dataset.labels[rows[chosen]]
+        return propagated
 
     def ot_propagation(self):
-        loss = SamplesLoss("sinkhorn", p=2, blur=.05, scaling=.95)
-        # get those images that have prediction 1
-        bacilli = self.labelled_dataset[self.labelled_dataset['label'] == 1]
-        # get those images that have prediction 0
-        non_bacilli = self.labelled_dataset[self.labelled_dataset['label'] == 0]
-
-
-        # distance from bacilli
-        bacilli_distance = np.zeros((bacilli.shape[0], self.unlabelled_dataset.shape[0]))
-        for i in range(bacilli.shape[0]):
-            print(i)
-            for j in range(self.unlabelled_dataset.shape[0]):
-                if i != j:
-                    bacilli_distance[i, j] = loss(torch.from_numpy(rescale(bacilli.iloc[i]['image'])),
-                                              torch.from_numpy(rescale(self.unlabelled_dataset.iloc[j]['image'])))
-
-        non_bacilli_distance = np.zeros((non_bacilli.shape[0], self.unlabelled_dataset.shape[0]))
-        for i in range(non_bacilli.shape[0]):
-            for j in range(self.unlabelled_dataset.shape[0]):
-                if i != j:
-                    non_bacilli_distance[i, j] = loss(torch.from_numpy(rescale(non_bacilli.iloc[i]['image'])),
-                                              torch.from_numpy(rescale(self.unlabelled_dataset.iloc[j]['image'])))
-        # get k biggest numbers of a matrix
-
-        bacilli_index = np.argpartition(bacilli_distance.ravel(), -self.k)[-self.k:]
-        non_bacilli_index = np.argpartition(non_bacilli_distance.ravel(), -self.k)[-self.k:]
-        bacilli_index = np.unravel_index(bacilli_index, bacilli_distance.shape)[1]
-        non_bacilli_index = np.unravel_index(non_bacilli_index, non_bacilli_distance.shape)[1]
-
-        bacilli_dataset = pd.DataFrame()
-        for index in bacilli_index:
-            d = {'image': [self.unlabelled_dataset.iloc[index]['image']], 'label': [1]}
-            df = pd.DataFrame(d)
-            bacilli_dataset = pd.concat([bacilli_dataset, df], ignore_index=True)
-        non_bacilli_dataset = pd.DataFrame()
-
-        for index in non_bacilli_index:
-            d = {'image': [self.unlabelled_dataset.iloc[index]['image']], 'label' : [0]}
-            df = pd.DataFrame(d)
-            non_bacilli_dataset = pd.concat([non_bacilli_dataset, df], ignore_index=True)
-        new_dataset = pd.concat([bacilli_dataset, non_bacilli_dataset], ignore_index=True)
-
-        return new_dataset
+        """ Propagate the labels with the Sinkhorn distance between the rescaled crops. """
+        return self.propagate('ot')
 
     def l2_propagation(self):
-
-        # get those images that have prediction 1
-        bacilli = self.labelled_dataset[self.labelled_dataset['label'] == 1]
-        # get those images that have prediction 0
-        non_bacilli = self.labelled_dataset[self.labelled_dataset['label'] == 0]
-
-        # distance from bacilli
-        bacilli_distance = np.zeros((bacilli.shape[0], self.unlabelled_dataset.shape[0]))
-        for i in range(bacilli.shape[0]):
-            print(i)
-            for j in range(self.unlabelled_dataset.shape[0]):
-                if i != j:
-                    bacilli_distance[i, j] = np.linalg.norm(bacilli.iloc[i]['image'] - self.unlabelled_dataset.iloc[j]['image'])
-
-        non_bacilli_distance = np.zeros((non_bacilli.shape[0], self.unlabelled_dataset.shape[0]))
-        for i in range(non_bacilli.shape[0]):
-            for j in range(self.unlabelled_dataset.shape[0]):
-                if i != j:
-                    non_bacilli_distance[i, j] = np.linalg.norm(non_bacilli.iloc[i]['image'] - self.unlabelled_dataset.iloc[j]['image'])
-
-        bacilli_index = np.argpartition(bacilli_distance.ravel(), -self.k)[-self.k:]
-        non_bacilli_index = np.argpartition(non_bacilli_distance.ravel(), -self.k)[-self.k:]
-        bacilli_index = np.unravel_index(bacilli_index, bacilli_distance.shape)[1]
-        non_bacilli_index = np.unravel_index(non_bacilli_index, non_bacilli_distance.shape)[1]
-
-        bacilli_dataset = pd.DataFrame()
-        for index in bacilli_index:
-            d = {'image': [self.unlabelled_dataset.iloc[index]['image']], 'label': [1]}
-            df = pd.DataFrame(d)
-            bacilli_dataset = pd.concat([bacilli_dataset, df], ignore_index=True)
-        non_bacilli_dataset = pd.DataFrame()
-
-        for index in non_bacilli_index:
-            d = {'image': [self.unlabelled_dataset.iloc[index]['image']], 'label': [0]}
-            df = pd.DataFrame(d)
-            non_bacilli_dataset = pd.concat([non_bacilli_dataset, df], ignore_index=True)
-        new_dataset = pd.concat([bacilli_dataset, non_bacilli_dataset], ignore_index=True)
-
-        return new_dataset
-
-
-
-
+        """ Propagate the labels with the L2 distance between the crops. """
+        return self.propagate('l2')
@@ -1,99 +1,222 @@
+"""
+Train the ConvVAE used for the feature vectors of the coreset selection.
 
-import torch.optim as optim
-import matplotlib
-from torch.utils.data import DataLoader
-from torchvision.utils import make_grid
-import pandas as pd
-from vae import *
-from plot_reconstruct import *
-from sklearn.model_selection import train_test_split
+The crops of all the datasets are preprocessed once (contrast change, range
+0-1 and central 32x32 crop) into a contiguous float32 cache, which is saved
+next to the checkpoint and reused as long as the datasets do not change.
+Every epoch then only shuffles indexes into that cache and trains on large
+batches, without a DataLoader or per-crop preprocessing.
+
+The training state is checkpointed every few epochs and can be resumed, and
+training stops when the validation loss has not improved for a number of
+epochs. The weights with the lowest validation loss are saved as a state dict.
+
+The script can be run from the command line as follows:
+   python -m active_learning.base_models.train_vae D:/images --output models/vae.pth
+"""
+import argparse
+import glob
+import hashlib
 import os
 import time
 
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+import torch.optim as optim
 
-matplotlib.style.use('ggplot')
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-# initialize the model
-model = ConvVAE().to(device)
-# set the learning parameters
-lr = 0.001
-epochs = 500
-batch_size = 10
-optimizer = optim.Adam(model.parameters(), lr=lr)
-criterion = nn.BCELoss(reduction='sum')
-# a list to save all the reconstructed images in PyTorch grid format
-grid_images = []
-
-transform = transforms.Compose([
-    transforms.Resize((32, 32)),
-    transforms.ToTensor(),
-])
-# load pandas dataframe, saved as pkl
-my_df = pd.read_pickle('D:/images/smear_2156_17_30.pkl')
-for i in range(1, 1345):
-    #check if file exists
-    if os.path.isfile('D:/images/smear_2156_17_3' + str(i) + '.pkl'):
-        my_df = my_df.append(pd.read_pickle('D:/images/smear_2156_17_3' + str(i) + '.pkl'))
-#print head
-print(my_df.shape, "dd")
-# show one image
-# create new dataframe
-
-cdf = my_df.iloc[2200:2400:10]
-#for i in range(0, 10):
-   # plt.imshow(cdf.iloc[i], cmap='gray')
-  #  plt.show()
-
-#remove all the images but 2200
-
-print(cdf.shape)
-
-dataset = MyDatasetV(cdf)
-#trainset, testset = train_test_split(dataset, test_size=0.2)
-trainloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
-testloader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
-"""
-# training set and train data loader
-trainset = torchvision.datasets.MNIST(
-    root='../input', train=True, download=True, transform=transform
-)
-
-trainloader = DataLoader(
-    trainset, batch_size=batch_size, shuffle=True
-)
-
- #validation set and validation data loader
-testset = torchvision.datasets.MNIST(
-    root='../input', train=False, download=True, transform=transform
-)
-testloader = DataLoader(
-    testset, batch_size=batch_size, shuffle=False
-)
-"""
-train_loss = []
-valid_loss = []
-for epoch in range(epochs):
-    print(f"Epoch {epoch+1} of {epochs}")
-    train_epoch_loss = train(
-        model, trainloader, dataset, device, optimizer, criterion
-    )
-    valid_epoch_loss, recon_images = validate(
-        model, testloader, dataset, device, criterion
-    )
-    train_loss.append(train_epoch_loss)
-    valid_loss.append(valid_epoch_loss)
-    # save the reconstructed images from the validation loop
-    save_reconstructed_images(recon_images, epoch+1)
-    # convert the reconstructed images to PyTorch image grid format
-    image_grid = make_grid(recon_images.detach().cpu())
-    grid_images.append(image_grid)
-    print(f"Train Loss: {train_epoch_loss:.4f}")
-    print(f"Val Loss: {valid_epoch_loss:.4f}")
-
-# save the reconstructions as a .gif file
-image_to_vid(grid_images)
-# save the loss plots to disk
-save_loss_plot(train_loss, valid_loss)
-# save the model
-torch.save(model.state_dict(), '../active_learning/base_models/vae_model.pth')
-print('TRAINING COMPLETE')
+from active_learning.base_models.vae import ConvVAE, final_loss, preprocess_images
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Train the VAE')
+    parser.add_argument('datasets', nargs='+', help='.pkl datasets with an image column, or folders of them')
+    parser.add_argument('--output', type=str, default='models/vae.pth', help='path of the trained state dict')
+    parser.add_argument('--epochs', type=int, default=500, help='maximum number of epochs')
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--patience', type=int, default=10,
+                        help='epochs without improvement of the validation loss before stopping')
+    parser.add_argument('--validation_size', type=float, default=0.2, help='fraction of the crops used for validation')
+    parser.add_argument('--checkpoint_every', type=int, default=10, help='epochs between two training checkpoints')
+    parser.add_argument('--resume', action='store_true', help='resume from the last training checkpoint')
+    parser.add_argument('--threads', type=int, default=None, help='number of CPU threads for torch')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def dataset_paths(datasets):
+    """ Sorted .pkl files given as files or folders. """
+    paths = []
+    for dataset in datasets:
+        paths.extend(glob.glob(os.path.join(dataset, '*.pkl')) if os.path.isdir(dataset) else [dataset])
+    return sorted(paths)
+
+
+def input_cache(paths, folder):
+    """ Preprocessed VAE inputs of all the crops of the datasets, cached on disk.
+
+    parameters
+    ----------
+    paths: list
+        .pkl datasets with an 'image' column
+    folder: str
+        folder of the cache, named after the paths, sizes and modification times of the datasets
+
+    returns
+    -------
+    inputs: numpy array
+        float32 inputs of shape (n, 1, 32, 32)
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(f'{os.path.abspath(path)}:{os.path.getsize(path)}:{os.path.getmtime(path)}'.encode())
+    cache = os.path.join(folder, 'vae_inputs_' + digest.hexdigest() + '.npy')
+    if os.path.exists(cache):
+        print('Inputs loaded from: ', cache)
+        return np.load(cache)
+
+    # read all the datasets before concatenating them once
+    images = np.concatenate([np.stack(pd.read_pickle(path)['image'].to_numpy()) for path in paths])
+    inputs = np.concatenate([preprocess_images(images[start:start + 4096]) for start in range(0, len(images), 4096)])
+    os.makedirs(folder, exist_ok=True)
+    np.save(cache, inputs)
+    print('Inputs saved in: ', cache)
+    return inputs
+
+
+def evaluate(model, inputs, criterion, batch_size):
+    """ Mean loss per crop of the model on the inputs. """
+    model.eval()
+    total = 0.0
+    with torch.inference_mode():
+        for start in range(0, inputs.shape[0], batch_size):
+            batch = inputs[start:start + batch_size]
+            reconstruction, mu, log_var = model(batch)
+            total += final_loss(criterion(reconstruction, batch), mu, log_var).item()
+    return total / max(inputs.shape[0], 1)
+
+
+def fit_vae(inputs, output='models/vae.pth', epochs=500, batch_size=512, lr=0.001, patience=10, validation_size=0.2,
+            checkpoint_every=10, resume=False, seed=0, device=None):
+    """ Train a ConvVAE on preprocessed inputs and save the best weights.
+
+    parameters
+    ----------
+    inputs: numpy array
+        float32 inputs of shape (n, 1, 32, 32), see preprocess_images
+    output: str
+        path of the trained state dict, the training checkpoint is saved next to it
+    epochs: int
+        maximum number of epochs
+    batch_size: int
+        number of crops per step
+    lr: float
+        learning rate of Adam
+    patience: int
+        number of epochs without improvement of the validation loss before stopping, None to never stop early
+    validation_size: float
+        fraction of the crops used for validation
+    checkpoint_every: int
+        number of epochs between two training checkpoints
+    resume: bool
+        whether to resume from the training checkpoint if it exists
+    seed: int
+        seed of the split and of the shuffling
+    device: torch.device
+        device used for training, the GPU if available when None
+
+    returns
+    -------
+    train_loss, valid_loss: list
+        mean loss per crop of every epoch
+    """
+    device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(inputs.shape[0])
+    n_validation = int(round(inputs.shape[0] * validation_size))
+    inputs = torch.from_numpy(np.ascontiguousarray(inputs, dtype=np.float32))
+    train_inputs = inputs[np.sort(order[n_validation:])].to(device)
+    validation_inputs = inputs[np.sort(order[:n_validation])].to(device) if n_validation else train_inputs
+
+    model = ConvVAE().to(device)
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+    criterion = nn.BCELoss(reduction='sum')
+    checkpoint_path = os.path.splitext(output)[0] + '_checkpoint.pth'
+    state = {'epoch': 0, 'best_loss': np.inf, 'best_state': None, 'epochs_without_improvement': 0,
+             'train_loss': [], 'valid_loss': []}
+    if resume and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        model.load_state_dict(checkpoint.pop('model'))
+        optimizer.load_state_dict(checkpoint.pop('optimizer'))
+        rng.bit_generator.state = checkpoint.pop('rng')
+        state = checkpoint
+        print('Resumed from epoch ', state['epoch'])
+
+    def save_checkpoint():
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        torch.save(dict(state, model=model.state_dict(), optimizer=optimizer.state_dict(),
+                        rng=rng.bit_generator.state), checkpoint_path)
+
+    while state['epoch'] < epochs:
+        start_time = time.perf_counter()
+        model.train()
+        running_loss = 0.0
+        permutation = torch.from_numpy(rng.permutation(train_inputs.shape[0])).to(device)
+        for start in range(0, train_inputs.shape[0], batch_size):
+            batch = train_inputs[permutation[start:start + batch_size]]
+            optimizer.zero_grad()
+            reconstruction, mu, log_var = model(batch)
+            loss = final_loss(criterion(reconstruction, batch), mu, log_var)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+
+        state['epoch'] += 1
+        state['train_loss'].append(running_loss / train_inputs.shape[0])
+        state['valid_loss'].append(evaluate(model, validation_inputs, criterion, 4 * batch_size))
+        print(f"Epoch {state['epoch']} of {epochs}: train loss {state['train_loss'][-1]:.4f}, "
+              f"validation loss {state['valid_loss'][-1]:.4f}, {time.perf_counter() - start_time:.1f} s")
+
+        if state['valid_loss'][-1] < state['best_loss']:
+            state['best_loss'], state['epochs_without_improvement'] = state['valid_loss'][-1], 0
+            state['best_state'] = {key: value.detach().cpu().clone() for key, value in model.state_dict().items()}
+        else:
+            state['epochs_without_improvement'] += 1
+        stop = patience is not None and state['epochs_without_improvement'] >= patience
+        if stop or state['epoch'] % checkpoint_every == 0 or state['epoch'] == epochs:
+            save_checkpoint()
+        if stop:
+            print('Early stopping, best validation loss: ', state['best_loss'])
+            break
+
+    if state['best_state'] is not None:
+        model.load_state_dict(state['best_state'])
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    torch.save(model.state_dict(), output)
+    print('Model saved in: ', output)
+    return state['train_loss'], state['valid_loss']
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    if pars_arg.threads:
+        torch.set_num_threads(pars_arg.threads)
+
+    paths = dataset_paths(pars_arg.datasets)
+    if not paths:
+        raise FileNotFoundError(f"No .pkl datasets found in {pars_arg.datasets}")
+    inputs = input_cache(paths, os.path.join(os.path.dirname(pars_arg.output) or '.', 'cache'))
+    print('Crops: ', inputs.shape[0])
+    fit_vae(inputs, pars_arg.output, pars_arg.epochs, pars_arg.batch_size, pars_arg.lr, pars_arg.patience,
+            pars_arg.validation_size, pars_arg.checkpoint_every, pars_arg.resume, pars_arg.seed)
+
+
+if __name__ == '__main__':
+    main()
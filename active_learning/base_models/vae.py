@@ -5,55 +5,39 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 import cv2 as cv
-from PIL import Image
+
+from src.contrast import change_contrast
 
 class MyDatasetV(Dataset):
-    def __init__(self, data):
+    def __init__(self, data, batch_size=4096):
         self.data = data
+        # preprocess all the crops once, in batches, instead of at every epoch
+        images = np.stack(data['image'].to_numpy()) if len(data) else np.zeros((0, 50, 50))
+        self.images = torch.from_numpy(np.concatenate(
+            [preprocess_images(images[start:start + batch_size]) for start in range(0, len(images), batch_size)]
+            or [np.zeros((0, 1, 32, 32), dtype=np.float32)]))
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, index):
-        img = self.data.iloc[index]['image']
-        img = self.change_contrast(img, 100)
-        img = np.array(img)
-        # change image values to be in 0,1 range instead of 0, 16000
-        if img.max() >0:
-            img = img / img.max()
-        # reshape image to be 32x32
+        return self.images[index]
 
 
-        img = img[9:41, 9:41]
-        return torch.unsqueeze(torch.tensor(img, dtype=torch.float32), 0)
+def preprocess_images(images, level=100):
+    """
+    Preprocess a stack of crops for the VAE: contrast change, range 0-1 and central 32x32 crop
 
-    def change_contrast(self, image, level):
-        """
-        Change the contrast of an image
+    param images: crops of shape (n, 50, 50)
+          level: level of contrast change
+    return: float32 array of shape (n, 1, 32, 32)
+    """
+    contrasted = change_contrast(images, level).astype(np.float32)
+    # change image values to be in 0,1 range
+    maximum = contrasted.max(axis=(1, 2), keepdims=True)
+    contrasted /= np.where(maximum > 0, maximum, 1)
+    return np.ascontiguousarray(contrasted[:, None, 9:41, 9:41])
 
-        param image: image to be changed
-              level: level of contrast change
-        return: image with changed contrast
-        """
-        # rescale image
-        image = np.uint8(self.rescale_image(image))
-        # create image object
-        image = Image.fromarray(image)
-        # define contrast level
-        factor = (259 * (level + 255)) / (255 * (259 - level))
-
-        # function that applies the contrast change
-        def contrast(c):
-            return 128 + factor * (c - 128)
-
-        return image.point(contrast)
-
-    def rescale_image(self, image):
-        if image.max() > 0:
-            image = image - np.min(image)
-            image = image / np.max(image)
-            image = image * 255
-        return image
 
 def final_loss(bce_loss, mu, logvar):
     """
@@ -172,28 +156,11 @@ class ConvVAE(nn.Module):
 
     def forward(self, x):
         # encoding
-
-        x = F.relu(self.enc1(x))
-        x = F.relu(self.enc2(x))
-        x = F.relu(self.enc3(x))
-        x = F.relu(self.enc4(x))
-
-        batch, _, _, _ = x.shape
-        x = F.adaptive_avg_pool2d(x, 1).reshape(batch, -1)
-        hidden = self.fc1(x)
-        # get `mu` and `log_var`
-        mu = self.fc_mu(hidden)
-        log_var = self.fc_log_var(hidden)
+        mu, log_var = self.encode(x)
         # get the latent vector through reparameterization
         z = self.reparameterize(mu, log_var)
-        z = self.fc2(z)
-        z = z.view(-1, 64, 1, 1)
-
         # decoding
-        x = F.relu(self.dec1(z))
-        x = F.relu(self.dec2(x))
-        x = F.relu(self.dec3(x))
-        reconstruction = torch.sigmoid(self.dec4(x))
+        reconstruction = self.generate_image(z)
         return reconstruction, mu, log_var
 
     def generate_image(self, z):
@@ -206,7 +173,11 @@ class ConvVAE(nn.Module):
         reconstruction = torch.sigmoid(self.dec4(x))
         return reconstruction
 
-    def generate_feature_vector(self, image):
+    def encode(self, image):
+        """
+        :param image: batch of preprocessed images of shape (n, 1, 32, 32)
+        :return: `mu` and `log_var` of the latent space
+        """
         x = F.relu(self.enc1(image))
         x = F.relu(self.enc2(x))
         x = F.relu(self.enc3(x))
@@ -218,6 +189,53 @@ class ConvVAE(nn.Module):
         # get `mu` and `log_var`
         mu = self.fc_mu(hidden)
         log_var = self.fc_log_var(hidden)
+        return mu, log_var
+
+    def embed(self, images, batch_size=1024):
+        """
+        Deterministic feature vectors of preprocessed images, computed in batches without gradients
+
+        :param images: numpy array or tensor of preprocessed images of shape (n, 1, 32, 32)
+        :param batch_size: number of images encoded at once
+        :return: float32 numpy array of shape (n, latent_dim) with `mu` of every image
+        """
+        device = next(self.parameters()).device
+        vectors = np.zeros((len(images), latent_dim), dtype=np.float32)
+        training = self.training
+        self.eval()
+        with torch.inference_mode():
+            for start in range(0, len(images), batch_size):
+                batch = torch.as_tensor(images[start:start + batch_size], dtype=torch.float32, device=device)
+                vectors[start:start + batch.shape[0]] = self.encode(batch)[0].cpu().numpy()
+        self.train(training)
+        return vectors
+
+    def generate_feature_vector(self, image):
+        """
+        Random feature vector sampled from the latent distribution, see embed for deterministic ones
+        """
+        mu, log_var = self.encode(image)
         # get the latent vector through reparameterization
         z = self.reparameterize(mu, log_var)
-        return z
\ No newline at end of file
+        return z
+
+
+def embed_crop_store(model, store, path, batch_size=1024):
+    """
+    Embed all the crops of a store in chunks and write the feature vectors to a memory-mapped matrix
+
+    Only one chunk of crops is preprocessed and held in memory at a time, so the store
+    can be memory-mapped itself (CropStore.load) and larger than the memory.
+
+    :param model: ConvVAE
+    :param store: CropStore with crops of shape (n, 50, 50)
+    :param path: path of the .npy file with the feature vectors
+    :param batch_size: number of crops preprocessed and encoded at once
+    :return: float32 memory-mapped array of shape (n, latent_dim), row i is the feature vector of crop i
+    """
+    vectors = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(store), latent_dim))
+    for start in range(0, len(store), batch_size):
+        images = np.asarray(store.images[start:start + batch_size])
+        vectors[start:start + images.shape[0]] = model.embed(preprocess_images(images), batch_size)
+    vectors.flush()
+    return vectors
@@ -1,10 +1,75 @@
-import cvxpy as cp
 import numpy as np
 import matplotlib.pyplot as plt
-import gurobipy as gp
-from geomloss import SamplesLoss
 import kmedoids
 import torch
+from active_learning.k_center import PairwiseDistances, robust_k_center_mip
+from active_learning.knn_index import KnnIndex
+from active_learning.ot_distances import sinkhorn_distance_matrix
+
+# time limit in seconds of every feasibility program of the robust k-center bisection
+MIP_TIME_LIMIT = 60
+
+
+def greedy_k_center(vectors, number_of_centers, centers=None):
+    """ Select centers with the greedy farthest-point heuristic for k-center.
+
+    The distance of every vector to its nearest center is kept in a running
+    vector, so each new center costs a single vectorized distance computation
+    against all the vectors, O(n * number_of_centers) overall.
+
+    parameters
+    ----------
+    vectors: numpy array or torch tensor
+        vectors of shape (n, d) to choose the centers from
+    number_of_centers: int
+        number of centers to add
+    centers: numpy array, torch tensor or KnnIndex
+        centers that are already selected, of shape (m, d), can be empty or None. The distance
+        of every vector to its nearest center is found with an exact KnnIndex of the centers,
+        a KnnIndex that is passed should be exact too (exact_size=None)
+
+    returns
+    -------
+    indexes: numpy array
+        indexes of the new centers in vectors, in the order they were selected
+    min_distances: numpy array
+        distance of every vector to its nearest center, the new ones included
+    """
+    if isinstance(vectors, torch.Tensor):
+        vectors = vectors if vectors.is_floating_point() else vectors.double()
+        minimum = torch.minimum
+    else:
+        vectors = vectors if np.issubdtype(vectors.dtype, np.floating) else vectors.astype(np.float64)
+        minimum = np.minimum
+
+    def squared_distances(center):
+        difference = vectors - center
+        return (difference * difference).sum(1)
+
+    no_centers = centers is None or len(centers) == 0
+    if not no_centers:
+        # distance of every vector to its nearest center, with one search of the centers
+        if not isinstance(centers, KnnIndex):
+            # exact search whatever the number of centers, an approximate nearest center would change the selection
+            centers = KnnIndex(vectors.shape[1], exact_size=None, dtype=np.float64).add(np.asarray(centers))
+        nearest = centers.search(np.asarray(vectors), 1)[0][:, 0] ** 2
+        min_distances = torch.from_numpy(nearest).to(vectors.dtype) if isinstance(vectors, torch.Tensor) \
+            else nearest.astype(vectors.dtype)
+    else:
+        # start from the vector farthest from the mean, the mean itself is not a center
+        min_distances = squared_distances(vectors.mean(0))
+
+    number_of_centers = min(number_of_centers, vectors.shape[0])
+    indexes = np.zeros(number_of_centers, dtype=np.int64)
+    for i in range(number_of_centers):
+        indexes[i] = int(min_distances.argmax())
+        distances = squared_distances(vectors[indexes[i]])
+        min_distances = distances if i == 0 and no_centers else minimum(min_distances, distances)
+
+    if isinstance(min_distances, torch.Tensor):
+        min_distances = min_distances.numpy()
+    return indexes, np.sqrt(min_distances)
+
 
 class  active_learning():
     def  __init__(self, vectors, k, init_centers):
@@ -14,6 +79,8 @@ class  active_learning():
             self.number_of_outliers = int (len(vectors) * 0.05)
             print("number of outliers: " , self.number_of_outliers)
             self.mip_centers = None
+            # pairwise distances of vectors_full, computed at the first feasibility check
+            self.distances = None
             # choose the initial centers
             # if init_centers is a list of indexes, then the centers are the vectors with the given indexes
             # if init_centers is a number, then the centers are chosen randomly
@@ -30,215 +97,106 @@ class  active_learning():
                 # remove the centers from the vectors using center_list
                 self.vectors = np.delete(vectors, center_list, axis=0)
             else :
-                pass
-
-
-
-
-
-
+                # no initial centers, greedy k-center starts from the vector farthest from the mean
+                center_list = []
+                self.centers = vectors[:0]
+            # indexes in vectors_full of the initial centers, of all the centers and of the other vectors
+            self.init_indexes = np.array(center_list, dtype=np.int64)
+            self.center_indexes = self.init_indexes
+            self.indexes = np.delete(np.arange(vectors.shape[0]), self.init_indexes)
 
     def greedy_k_center(self):
-            print("greedy k center" )
-
+            """ Add self.k - 1 centers to the initial centers with greedy_k_center.
 
-            vectors = self .vectors
-
-
-            for i in range(self.k-1):
-
-                dists = np.zeros((vectors.shape[0], len(self.centers)))
-                for k in range(len(vectors)):
-                    for j in range(len(self.centers)):
-                        dists[k, j] = np.linalg.norm(vectors[k]-self.centers[j])
-                mindists = np.min(dists, axis=1)
-                next_center = vectors[np.argmax(mindists)]
-                # numpy append
-
-                self.center = np.vstack((self.centers, next_center))
-
-
-                vectors = np.delete(vectors, np.where(np.all(vectors == next_center, axis=1)), axis=0)
-
-            self.vectors = vectors
-            centers = np.array(self.centers)
-            return centers
+            The new centers are removed from self.vectors and the distance of every
+            remaining vector to its nearest center is kept in self.min_distances.
+            """
+            print("greedy k center" )
+            indexes, min_distances = greedy_k_center(self.vectors, self.k - 1, self.centers)
+            self.centers = np.vstack((self.centers, self.vectors[indexes]))
+            self.center_indexes = np.concatenate((self.center_indexes, self.indexes[indexes]))
+            self.vectors = np.delete(self.vectors, indexes, axis=0)
+            self.indexes = np.delete(self.indexes, indexes)
+            self.min_distances = np.delete(min_distances, indexes)
+            return self.centers
 
-    def robust_k_center(self):
+    def robust_k_center(self, time_limit=MIP_TIME_LIMIT):
 
         # initialize the centers with greedy k-center
         centers_out = self .greedy_k_center()
         # initialize the centers with random points
         #centers_out = self.vectors[np.random.choice(self.vectors.shape[0], self.k, replace=False)]
 
-        self.mip_centers = centers_out
-        vectors = self.vectors
+        # the greedy centers are a solution for the upper bound, kept if no smaller radius is feasible
+        self.mip_centers = np.zeros(self.vectors_full.shape[0], dtype=bool)
+        self.mip_centers[self.center_indexes] = True
 
 
         # find maximal distance tthat a point has to its nearest center, do not consider the centers that are already selected
-        dists = np.zeros((vectors.shape[0], centers_out.shape[0]))
-        #compute distance between each point and each center
-        for i in range(vectors.shape[0]):
-            for j in range(centers_out.shape[0]):
-                dists[i,j] = np.linalg.norm(vectors[i]-centers_out[j])
-        #take minimum for each vector
-        mindists = np.min(dists, axis=1)
-        #take maximum of the minimums
-        ub = np.max(mindists)
+        ub = np.max(self.min_distances)
 
-
-
-
-
-        #lower bound
-        lb = ub/2
+        # the candidate radii are the distances between the points, found block by block
+        self.distances = PairwiseDistances(self.vectors_full)
+        # lower bound, the smallest distance above ub/2
+        ub = self.distances.ceil(ub)
+        lb = self.distances.ceil(ub / 2)
 
         while ub-lb > 0.1:
 
-            if self.gurobi_feasible((lb+ub)/2):
+            if self.feasible((lb+ub)/2, time_limit=time_limit):
                 print("feasible" )
-                #the the upper bound is the maximum distance between two points whose distance is less then lb+up/2
-                #compute all distances between all the points
-                dists = np.zeros((self.vectors.shape[0], self.vectors.shape[0]))
-                for i in range(self.vectors.shape[0]):
-                    for j in range(self.vectors.shape[0]):
-                        dists[i,j] = np.linalg.norm(self.vectors[i]-self.vectors[j])
-                # find distances less than lb+ub/2
-                lessdists = dists[dists <= (lb+ub)/2]
-                ub = np.max(lessdists)
-
-
+                # the upper bound is the largest distance not above (lb+ub)/2
+                ub = self.distances.floor((lb + ub) / 2)
             else:
                 print("not feasible" )
-                dists = np.zeros((self.vectors.shape[0], self.vectors.shape[0]))
-                for i in range(self.vectors.shape[0]):
-                    for j in range(self.vectors.shape[0]):
-                        dists[i, j] = np.linalg.norm(self.vectors[i] - self.vectors[j])
-                # find distances less than lb+ub/2
-                lessdists = dists[dists >= (lb + ub) / 2]
-                lb = np.min(lessdists)
+                # the lower bound is the smallest distance not below (lb+ub)/2
+                lb = self.distances.ceil((lb + ub) / 2)
             print("ub: " , ub)
             print("lb: " , lb)
 
-        centers = self.vectors[self.mip_centers == 1]
-        #indexes of the centers
-        centers_indexes = np.where(self.mip_centers == 1)
+        centers = self.vectors_full[self.mip_centers]
+        #indexes of the new centers, the initial ones are already labelled
+        centers_indexes = np.setdiff1d(np.flatnonzero(self.mip_centers), self.init_indexes)
         return (lb + ub) / 2, centers, centers_indexes
 
-
-    def feasible(self, distance):
-
-        n, d = self.vectors.shape
-        # create decision variables
-
-        #centers = cp.Variable((self.k, d))
-        centers = cp.Variable(n, boolean= True)             #1 if the point is a center, 0 otherwise
-        w = cp.Variable((n ,n ), boolean = True)         #i,j 1 if point j is the center of point i
-        e = cp.Variable((n,n), boolean= True)                 #1 if the point is an outlier, 0 otherwise
-        #z = cp.Variable((n, self.k))
-        #y = cp.Variable(n)
-
-        #create constraints
-        constraints = []
-        # at most self.k centers
-        constraints.append(cp.sum(centers) == self.k)
-        # at most self.number_of_outliers outliers
-        constraints.append(cp.sum(e) <= self.number_of_outliers)
-        # each point can be just in one cluster, the sum of each row of w is 1
-        for i in range(n):
-            constraints.append(cp.sum(w[i,:]) == 1)
-        # w[i,j] <= centers[j] for all i,j
-        for i in range(n):
-            for j in range(n):
-                constraints.append(w[i,j] <= centers[j])
-        # if dist(i,j) > distance then w[i,j] = e[i,j]
-        for i in range(n):
-            for j in range(n):
-                if np.linalg.norm(self.vectors[i]-self.vectors[j]) > distance:
-                    constraints.append(w[i, j] == e[i,j])
-
-
-        # create objective function
-        obj = cp.Minimize(cp.sum(e))
-
-        #create problem
-        mip = cp.Problem(obj, constraints)
-        #solve problem
-        mip.solve()
-
-
-
-        #check if the problem is feasible
-        if mip.status == 'optimal':
-            self.mip_centers = centers.value
-            return True
-        else:
+    def feasible(self, distance, solver='auto', time_limit=MIP_TIME_LIMIT):
+        """ Check whether the centers can cover all the vectors within distance, up to the outliers.
+
+        The initial centers stay centers. With gurobi the program is warm-started
+        from the greedy centers, HiGHS has no warm start, see active_learning.k_center.
+
+        parameters
+        ----------
+        distance: float
+            radius of the centers
+        solver: str
+            auto, gurobi or highs
+        time_limit: float
+            time limit of the solver in seconds, a program without a solution
+            within the limit counts as infeasible. None for no limit
+
+        returns
+        -------
+        bool
+            True if feasible, the centers are then stored in self.mip_centers
+        """
+        if self.distances is None:
+            self.distances = PairwiseDistances(self.vectors_full)
+        rows, cols = self.distances.edges(distance)
+        mip_centers = robust_k_center_mip(rows, cols, self.vectors_full.shape[0], len(self.center_indexes),
+                                          self.number_of_outliers, fixed_centers=self.init_indexes,
+                                          start_centers=self.center_indexes, solver=solver, time_limit=time_limit)
+        if mip_centers is None:
             return False
-
-
+        self.mip_centers = mip_centers
+        return True
 
     def gurobi_feasible(self, distance):
-        m = gp.Model("k-center")
-        n, d = self.vectors.shape
-        # create decision variables
-        centers = m.addVars(n, vtype=gp.GRB.BINARY, name="centers")
-        w = m.addVars(n, n, vtype=gp.GRB.BINARY, name="w")
-        e = m.addVars(n, n, vtype=gp.GRB.BINARY, name="e")
-        # create constraints
-        # at most self.k centers
-        m.addConstr(gp.quicksum(centers[i] for i in range(n)) == self.k)
-        # at most self.number_of_outliers outliers
-        m.addConstr(gp.quicksum(e[i, j] for i in range(n) for j in range(n)) <= self.number_of_outliers)
-        # each point can be just in one cluster, the sum of each row of w is 1
-        for i in range(n):
-            m.addConstr(gp.quicksum(w[i, j] for j in range(n)) == 1)
-        # w[i,j] <= centers[j] for all i,j
-        for i in range(n):
-            for j in range(n):
-                m.addConstr(w[i, j] <= centers[j])
-        # if dist(i,j) > distance then w[i,j] = e[i,j]
-        for i in range(n):
-            for j in range(n):
-                if np.linalg.norm(self.vectors[i] - self.vectors[j]) > distance:
-                    m.addConstr(w[i, j] == e[i, j])
-        # create objective function
-        m.setObjective(gp.quicksum(e[i, j] for i in range(n) for j in range(n)), gp.GRB.MINIMIZE)
-        # solve problem
-        m.optimize()
-        # check if the problem is feasible
-
-        if m.status == gp.GRB.OPTIMAL:
-            #print the centers
-            self.mip_centers = np.zeros(n)
-            for i in range(n):
-                self.mip_centers[i] = centers[i].x
-
-
-            return True
-        else:
-            return False
+        return self.feasible(distance, solver='gurobi')
 
     def ot_clustering(self):
-        loss = SamplesLoss(loss="sinkhorn", p=2, blur=.05)
-        # compute the distance matrix with sampleloss
-        dists = np.zeros((self.vectors.shape[0], self.vectors.shape[0]))
-
-        for i in range(self.vectors.shape[0]):
-            for j in range(self.vectors.shape[0]):
-
-                if i < j:
-                    # if sum of the two torch vectors is 0 then the distance is 0
-                    if torch.sum(self.vectors[i]) == 0 and torch.sum(self.vectors[j]) == 0:
-                        dists[i, j] = 0
-                        dists[j, i] = 0
-                    else:
-                        dists[i, j] = loss(self.vectors[i], self.vectors[j])
-                        dists[j, i] = dists[i, j]
-
-
-
-
-        breakpoint()
+        # compute the distance matrix with batched sinkhorn divergences, empty image pairs have distance 0
+        dists = sinkhorn_distance_matrix(self.vectors)
         fp = kmedoids.fasterpam(dists, self.k)
 
         return fp[2]
@@ -1,74 +1,47 @@
 import pandas as pd
 import numpy as np
-import torch
-from active_learning.base_models.vae import ConvVAE
 import matplotlib.pyplot as plt
-from coreset_pu_train import train_coreset_pu_cnn
+from active_learning.al_trainer import ActiveLearningTrainer
 from coreset_pu_train_vae import train_vae
-from n_networks.neural_net import MyDataset
-from active_learning.base_models.vae import MyDatasetV
-from torch.utils.data import DataLoader
-from n_networks.neural_net import ChatGPT
+from active_learning.uncertainty import UncertaintySampler
 from active_learning.coreset_functions import active_learning
+from active_learning.embedding_store import EmbeddingStore
+from active_learning.diversity import DiversityTracker
 
 
-def rescale(image):
-    if np.max(image) == np.min(image):
-        return image
-    elif np.max(image) == 0:
-        return image
-    else:
-        return (image - np.min(image)) / (np.max(image) - np.min(image))
+# VAE feature vectors shared by all the rounds
+embedding_store = EmbeddingStore('models/vae.pth')
 
-def coreset_loop(df,current_df):
-    #train VAE on the whole dataset
 
+def coreset_loop(df,current_df):
+    # train VAE on the current dataset, the embedding store reloads it since the checkpoint changed
     train_vae(df)
 
-    # load vae
-    vae = ConvVAE()
-    vae.load_state_dict(torch.load('models/vae.pth'))
-
-    data = MyDatasetV(df)
-    dataloader = DataLoader(data, batch_size=1, shuffle=False)
-    # get the feature vector for the whole dataset
-    vectors = np.zeros((df.shape[0], 16))     #TODO change to 32 or 16
-    with torch.no_grad():
-        for i, data in enumerate(dataloader):
-            image = data
-
-            vectors[i] = vae.generate_feature_vector(image)
     # get the coreset
     counter = 0
     means = []
+    # diversity of the coreset, its coverage is measured on the whole dataset
+    tracker = DiversityTracker(embedding_store.embeddings(np.stack(df['image'].to_numpy())))
     while True:
+        # feature vectors of the remaining crops, only new crops are encoded
+        vectors = embedding_store.embeddings(np.stack(df['image'].to_numpy()))
         acle = active_learning(vectors, 10, 10)
 
         dist, centers, indexes = acle.robust_k_center()
         #
         inter_df = df.iloc[indexes]
-        current_df = current_df.append(inter_df)
+        current_df = pd.concat([current_df, inter_df])
         df = df.drop(indexes)
         df = df.reset_index(drop=True)
 
+        # update the distances of the coreset with the new crops only
+        diversity = tracker.add(vectors[indexes])
+        print(diversity)
         if counter ==0 or counter == 1:
             pass
         else:
-            distances = np.zeros((current_df.shape[0], current_df.shape[0]))
-            vectors = torch.from_numpy(rescale(df.iloc[0]['image']))
-            # unsqueeze(0) to add a dimension to the tensor
-            vectors = vectors.unsqueeze(0)
-
-            for i in range(1, df.shape[0]):
-                vectors = torch.cat((vectors, torch.from_numpy(rescale(df.iloc[i]['image'])).unsqueeze(0)), 0)
-            for i in range(current_df.shape[0]):
-                for j in range(current_df.shape[0]):
-                    if i < j:
-                        distances[i, j] = torch.dist(vectors[i], vectors[j])
-
-            # compute mean distance between samples in the coreset
-            mean_dist = np.mean(distances)
-            means.append(mean_dist)
+            # mean distance between samples in the coreset
+            means.append(diversity['mean_distance'])
 
          # if last item in the list is smaller than the previous one, stop
         if len(means) > 1:
@@ -83,47 +56,20 @@ def coreset_loop(df,current_df):
 
 
 
+# uncertainty sampler shared by all the queries, it caches the scores of unchanged models
+sampler = UncertaintySampler('margin')
+
+
 def get_highest_pu_samples(df, current_df):
     # reset index of the dataframe
     df = df.reset_index(drop=True)
-    data = MyDataset(df)
-    dataloader = DataLoader(data, batch_size=1, shuffle=False)
-    # load the model
-    model = ChatGPT()
-    state_dict = torch.load('models/coreset_pu_CNN_pth')
-    model.load_state_dict(state_dict)
-    # get the prediction uncertanty for the whole dataset
-    predictions = []
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-    model.eval()
-    with torch.no_grad():
-        for data in dataloader:
-            images, labels = data
-            images = images.to(torch.float32)
-            images = images.view(images.shape[0], 1, 50, 50)
-            labels = labels.to(torch.float32)
-            images = images.to(device)
-            labels = labels.to(device)
-
-            outputs = model(images)
-            # print("Shape of outputs and labels is: ", outputs.shape, labels.shape)
-            # print("outputs: ", outputs)
-            outputs = outputs.squeeze(1)
-            for i, output in enumerate(outputs):
-                predictions.append(np.array(output))
-
-    # turn torch tensor into numpy array
-
-    for j in range(0, len(predictions)):
-        distance = np.abs(0.5, predictions[j])
-        predictions[j] = 1 - distance
-    # oreder the predictions
-    sort = np.argsort(predictions)
-    # get the 150 samples with the highest prediction uncertanty
-    current_df = current_df.append(df.iloc[sort[-150:]])
-    # delete the last 150 samples from the dataset
-    df = df.drop(df.iloc[sort[-150:]].index)
+    # the model of the trainer, kept in memory across the rounds
+    model = trainer.model
+    # get the 150 samples with the highest prediction uncertanty, scored in large batches
+    indexes = sampler.query(model, np.stack(df['image'].to_numpy()), 150)
+    current_df = pd.concat([current_df, df.iloc[indexes]])
+    # delete the 150 samples from the dataset
+    df = df.drop(indexes)
     df = df.reset_index(drop=True)
 
     return current_df, df
@@ -135,12 +81,14 @@ def get_highest_pu_samples(df, current_df):
 
 # initialize accuracy list
 accuracy_list = []
+# classifier trained incrementally across the rounds
+trainer = ActiveLearningTrainer()
 
 
 # load full dataset
 df = pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_30.pkl')
 for i in range(0, 1):
-    df = df.append(pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl'))
+    df = pd.concat([df, pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl')])
 # update the index column
 df = df.reset_index(drop=True)
 
@@ -156,8 +104,8 @@ current_df, df = coreset_loop(df, current_df)
 
 
 # train the model with the 150 samples
-# in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-acc = train_coreset_pu_cnn(current_df, 0)
+# the trainer keeps the model in memory and fine-tunes it on the new samples
+acc = trainer.fit(current_df)
 accuracy_list.append(acc)
 
 #5000 / 150 = 33 iterations
@@ -170,8 +118,8 @@ for i in range(1, 10):
 
 
     # train the model with the 150 samples
-    # in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-    acc = train_coreset_pu_cnn(current_df, i)
+    # the trainer keeps the model in memory and fine-tunes it on the new samples
+    acc = trainer.fit(current_df)
     accuracy_list.append(acc)
 
 # plot the accuracy list verus number of data points
@@ -0,0 +1,106 @@
+"""
+Incremental diversity statistics of a growing coreset.
+
+The tracker keeps the running sum and minimum of the pairwise distances
+between the selected vectors, and the distance of every reference vector
+(e.g. the whole dataset) to its nearest selected vector. Adding m vectors to
+a coreset of n vectors costs a single torch.cdist of the m new vectors
+against the n + m selected vectors and the reference vectors; the full
+pairwise matrix is never built.
+"""
+import numpy as np
+import torch
+
+
+class DiversityTracker:
+    """ Running diversity of a coreset.
+
+    attributes
+    ----------
+    vectors: torch tensor
+        selected vectors of shape (n, d)
+    pairwise_sum: float
+        sum of the distances between all the pairs of selected vectors
+    pairs: int
+        number of pairs of selected vectors
+    min_distance: float
+        smallest distance between two selected vectors
+    reference_nearest: torch tensor
+        distance of every reference vector to its nearest selected vector
+
+    methods
+    -------
+    add(vectors)
+        add selected vectors and update the statistics
+    mean_distance()
+        mean distance between two selected vectors
+    coverage_radius()
+        largest distance of a reference vector to its nearest selected vector
+    report()
+        all the statistics as a dict
+    """
+    def __init__(self, reference=None):
+        """
+        parameters
+        ----------
+        reference: numpy array or torch tensor
+            vectors of shape (r, d) whose coverage by the coreset is measured, e.g. all the crops, or None
+        """
+        self.vectors = None
+        self.pairwise_sum = 0.0
+        self.pairs = 0
+        self.min_distance = float('inf')
+        self.reference = None if reference is None else torch.as_tensor(np.asarray(reference), dtype=torch.float64)
+        self.reference_nearest = None if reference is None else torch.full((len(reference),), float('inf'),
+                                                                           dtype=torch.float64)
+
+    def __len__(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def add(self, vectors):
+        """ Add selected vectors and update the statistics with one distance computation.
+
+        parameters
+        ----------
+        vectors: numpy array or torch tensor
+            new selected vectors of shape (m, d)
+
+        returns
+        -------
+        dict
+            statistics after the update, see report
+        """
+        new = torch.as_tensor(np.asarray(vectors), dtype=torch.float64).reshape(len(vectors), -1)
+        m = new.shape[0]
+        if m == 0:
+            return self.report()
+        selected = new if self.vectors is None else torch.cat((self.vectors, new))
+        targets = selected if self.reference is None else torch.cat((selected, self.reference))
+        distances = torch.cdist(new, targets)
+        n = selected.shape[0] - m
+
+        # pairs between the new vectors and the previous ones, and pairs among the new vectors
+        pairs = torch.cat((distances[:, :n].reshape(-1), distances[:, n:n + m][torch.triu_indices(m, m, 1).unbind()]))
+        if pairs.numel():
+            self.pairwise_sum += pairs.sum().item()
+            self.pairs += pairs.numel()
+            self.min_distance = min(self.min_distance, pairs.min().item())
+        if self.reference is not None:
+            self.reference_nearest = torch.minimum(self.reference_nearest, distances[:, n + m:].min(0).values)
+        self.vectors = selected
+        return self.report()
+
+    def mean_distance(self):
+        """ Mean distance between two selected vectors, 0 with less than two vectors. """
+        return self.pairwise_sum / self.pairs if self.pairs else 0.0
+
+    def coverage_radius(self):
+        """ Largest distance of a reference vector to its nearest selected vector, None without reference. """
+        if self.reference_nearest is None or len(self) == 0:
+            return None
+        return self.reference_nearest.max().item()
+
+    def report(self):
+        """ Size, mean and min pairwise distance and coverage radius of the coreset. """
+        return {'size': len(self), 'mean_distance': self.mean_distance(),
+                'min_distance': self.min_distance if self.pairs else None, 'coverage_radius': self.coverage_radius()}
@@ -0,0 +1,125 @@
+"""
+Cache of the VAE feature vectors of the crops, used by the coreset selection.
+
+The feature vector of a crop is the mean mu of its latent distribution, not
+a reparameterised sample, so the cached vectors are stable. The vectors are
+keyed by crop and by the hash of the VAE checkpoint: they are computed in
+large batches for the crops that are not cached yet, persisted next to the
+checkpoint, and reused across the rounds of the active learning loop until
+the checkpoint changes.
+"""
+import hashlib
+import os
+
+import numpy as np
+import torch
+
+from active_learning.base_models.vae import ConvVAE, preprocess_images, latent_dim
+from src.crop_store import crop_keys
+
+
+def checkpoint_hash(path):
+    """ Hash of the content of a checkpoint file. """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """ Persistent cache of the VAE feature vectors of the crops.
+
+    attributes
+    ----------
+    checkpoint: str
+        path to the VAE state dict
+    folder: str
+        folder where the feature vectors are persisted, one .npz file per checkpoint hash
+    batch_size: int
+        number of crops encoded at once
+
+    methods
+    -------
+    embeddings(images, ids)
+        feature vectors of the crops, computed only for the crops that are not cached
+    """
+    def __init__(self, checkpoint='models/vae.pth', folder=None, batch_size=1024):
+        """
+        parameters
+        ----------
+        checkpoint: str
+            path to the VAE state dict
+        folder: str
+            folder where the feature vectors are persisted, next to the checkpoint if None
+        batch_size: int
+            number of crops encoded at once
+        """
+        self.checkpoint = checkpoint
+        self.folder = folder or os.path.join(os.path.dirname(checkpoint), 'embeddings')
+        self.batch_size = batch_size
+        self.hash = None
+        self.model = None
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.vectors = np.zeros((0, latent_dim), dtype=np.float32)
+
+    def _path(self):
+        return os.path.join(self.folder, self.hash + '.npz')
+
+    def _refresh(self):
+        """ Load the VAE and the persisted vectors if the checkpoint changed. """
+        current = checkpoint_hash(self.checkpoint)
+        if current == self.hash:
+            return
+        self.hash = current
+        self.model = ConvVAE()
+        self.model.load_state_dict(torch.load(self.checkpoint, map_location=torch.device('cpu')))
+        self.model.eval()
+        if os.path.exists(self._path()):
+            persisted = np.load(self._path())
+            self.keys, self.vectors = persisted['keys'], persisted['vectors']
+        else:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.vectors = np.zeros((0, latent_dim), dtype=np.float32)
+
+    def _encode(self, images):
+        """ Deterministic feature vectors mu of the crops, in batches. """
+        vectors = np.zeros((images.shape[0], latent_dim), dtype=np.float32)
+        for start in range(0, images.shape[0], self.batch_size):
+            batch = preprocess_images(images[start:start + self.batch_size])
+            vectors[start:start + batch.shape[0]] = self.model.embed(batch, self.batch_size)
+        return vectors
+
+    def embeddings(self, images, ids=None):
+        """ Get the feature vectors of the crops.
+
+        parameters
+        ----------
+        images: numpy array
+            crops of shape (n, 50, 50)
+        ids: numpy array
+            integer identifier of every crop, a hash of the pixels if None
+
+        returns
+        -------
+        numpy array
+            float32 feature vectors of shape (n, latent_dim)
+        """
+        self._refresh()
+        keys = crop_keys(images) if ids is None else np.asarray(ids, dtype=np.uint64)
+        # position of every key in the sorted cached keys
+        cached = np.zeros(keys.shape[0], dtype=bool)
+        if self.keys.shape[0] > 0:
+            positions = np.minimum(np.searchsorted(self.keys, keys), self.keys.shape[0] - 1)
+            cached = self.keys[positions] == keys
+
+        if not cached.all():
+            missing_keys, first = np.unique(keys[~cached], return_index=True)
+            missing_vectors = self._encode(np.asarray(images)[np.flatnonzero(~cached)[first]])
+            keys_all = np.concatenate((self.keys, missing_keys))
+            order = np.argsort(keys_all, kind='stable')
+            self.keys = keys_all[order]
+            self.vectors = np.concatenate((self.vectors, missing_vectors))[order]
+            os.makedirs(self.folder, exist_ok=True)
+            np.savez(self._path(), keys=self.keys, vectors=self.vectors)
+        return self.vectors[np.searchsorted(self.keys, keys)]
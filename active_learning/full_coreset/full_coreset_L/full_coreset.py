@@ -1,34 +1,21 @@
 import pandas as pd
 import numpy as np
-import torch
-from active_learning.base_models.vae import ConvVAE
 import matplotlib.pyplot as plt
-from full_coreset_train import train_coreset_cnn
+from active_learning.al_trainer import ActiveLearningTrainer
 from full_coreset_train_vae import train_vae
-from n_networks.neural_net import MyDataset
-from active_learning.base_models.vae import MyDatasetV
-from torch.utils.data import DataLoader
-from n_networks.neural_net import ChatGPT
 from active_learning.coreset_functions import active_learning
+from active_learning.embedding_store import EmbeddingStore
 
-def get_first_coreset(df):
-    #train VAE on the whole dataset
-
-    train_vae(df)
+# VAE feature vectors shared by all the rounds
+embedding_store = EmbeddingStore('models/vae.pth')
 
-    # load vae
-    vae = ConvVAE()
-    vae.load_state_dict(torch.load('models/vae.pth'))
 
-    data = MyDatasetV(df)
-    dataloader = DataLoader(data, batch_size=1, shuffle=False)
-    # get the feature vector for the whole dataset
-    vectors = np.zeros((df.shape[0], 16))     #TODO change to 32 or 16
-    with torch.no_grad():
-        for i, data in enumerate(dataloader):
-            image = data
+def get_first_coreset(df):
+    # train VAE on the current dataset, the embedding store reloads it since the checkpoint changed
+    train_vae(df)
 
-            vectors[i] = vae.generate_feature_vector(image)
+    # feature vectors of the crops, cached per crop and VAE checkpoint
+    vectors = embedding_store.embeddings(np.stack(df['image'].to_numpy()))
     # get the coreset
     acle = active_learning(vectors, 10, 10)
 
@@ -44,28 +31,12 @@ def get_coreset(df, current_df, iteration, c_indexes):
     # reset index of the dataframe
 
 
-    data = MyDataset(df)
-    dataloader = DataLoader(data, batch_size=1, shuffle=False)
-    # load the model
-    model = ChatGPT()
-    state_dict = torch.load('models/full_pu_CNN_' + str(iteration) + '.pth')
-    model.load_state_dict(state_dict)
-
-    # get the feature vector for the whole dataset
-    vectors = np.zeros((df.shape[0], 512))     #TODO change to 32 or 16
-    for i, data in enumerate(dataloader):
-        images, labels = data
-        images = images.to(torch.float32)
-        images = images.view(images.shape[0], 1, 50, 50)
-
-
-        vectors[i] = model.get_feature_vector(images)
-
-
+    # feature vectors of the whole dataset from the model of the trainer
+    vectors = trainer.features(np.stack(df['image'].to_numpy()))
 
     acle = active_learning(vectors, 10 * iteration, c_indexes)
     dist, centers, indexes = acle.robust_k_center()
-    current_df = current_df.append(df.iloc[indexes])
+    current_df = pd.concat([current_df, df.iloc[indexes]])
 
     return current_df, df, indexes
 
@@ -76,12 +47,14 @@ def get_coreset(df, current_df, iteration, c_indexes):
 
 # initialize accuracy list
 accuracy_list = []
+# classifier trained incrementally across the rounds
+trainer = ActiveLearningTrainer()
 
 
 # load full dataset
 df = pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_30.pkl')
 for i in range(0, 1):
-    df = df.append(pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl'))
+    df = pd.concat([df, pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl')])
 # update the index column
 df = df.reset_index(drop=True)
 
@@ -99,8 +72,8 @@ df = df.reset_index(drop=True)
 
 
 # train the model with the 150 samples
-# in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-acc = train_coreset_cnn(current_df, 0)
+# the trainer keeps the model in memory and fine-tunes it on the new samples
+acc = trainer.fit(current_df)
 accuracy_list.append(acc)
 
 #5000 / 150 = 33 iterations
@@ -114,8 +87,8 @@ for i in range(1, 10):
 
 
     # train the model with the 150 samples
-    # in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-    acc = train_coreset_cnn(current_df, i)
+    # the trainer keeps the model in memory and fine-tunes it on the new samples
+    acc = trainer.fit(current_df)
     accuracy_list.append(acc)
 
 # plot the accuracy list verus number of data points
@@ -3,7 +3,7 @@ import numpy as np
 import torch
 
 import matplotlib.pyplot as plt
-from full_coreset_ot_train import train_coreset_cnn
+from active_learning.al_trainer import ActiveLearningTrainer
 
 
 from active_learning.coreset_functions import active_learning
@@ -24,19 +24,13 @@ def get_coreset(df, current_df, iteration):
     # reset index of the dataframe
 
 
-    vectors = torch.from_numpy(rescale(df.iloc[0]['image']))
-    #unsqueeze(0) to add a dimension to the tensor
-    vectors = vectors.unsqueeze(0)
-
-
-
-    for i in range(1, df.shape[0]):
-        vectors = torch.cat((vectors, torch.from_numpy(rescale(df.iloc[i]['image'])).unsqueeze(0)), 0)
+    # stack the rescaled images once
+    vectors = torch.from_numpy(np.stack([rescale(image) for image in df['image']]))
 
     acle = active_learning(vectors, 10*iteration, None)
     indexes = acle.ot_clustering()
 
-    current_df = current_df.append(df.iloc[indexes])
+    current_df = pd.concat([current_df, df.iloc[indexes]])
 
     return current_df, df
 
@@ -49,12 +43,14 @@ def get_coreset(df, current_df, iteration):
 
 # initialize accuracy list
 accuracy_list = []
+# classifier trained incrementally across the rounds
+trainer = ActiveLearningTrainer()
 
 
 # load full dataset
 df = pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_30.pkl')
 for i in range(0, 2):
-    df = df.append(pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl'))
+    df = pd.concat([df, pd.read_pickle('C://users/matteo/pycharmprojects/TBProject/labelled_data/smear_2156_17_3' + str(i) + '.pkl')])
 # update the index column
 df = df.reset_index(drop=True)
 
@@ -76,7 +72,7 @@ for i in range(0, 10):
     df = df.drop(current_df.index[-150:])
     #reset
     df = df.reset_index(drop=True)
-    acc = train_coreset_cnn(current_df, i)
+    acc = trainer.fit(current_df)
     accuracy_list.append(acc)
 
 # plot the accuracy list verus number of data points
@@ -0,0 +1,220 @@
+"""
+Sparse mixed integer program for the robust k-center problem.
+
+Given a radius, the program decides whether k centers can cover all the
+points within the radius, up to a budget of outliers. Only the assignments
+of a point to a center within the radius are possible, so the assignment
+variables are built for the edges of the radius-neighbour graph instead of
+for all n x n pairs, and every point gets a single outlier variable:
+
+    minimize    sum_i o_i
+    subject to  sum_j y_j = k
+                sum_{j: d(i, j) <= r} w_ij + o_i = 1    for every point i
+                w_ij <= y_j                             for every edge (i, j)
+                sum_i o_i <= number_of_outliers
+                y, w, o binary
+
+The program is solved with Gurobi when gurobipy is installed, and with the
+open-source HiGHS solver of scipy otherwise. Gurobi is warm-started from the
+greedy k-center solution, HiGHS does not support starting solutions.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.optimize import milp, LinearConstraint, Bounds
+
+try:
+    import gurobipy as gp
+except ImportError:
+    gp = None
+
+SOLVERS = ['auto', 'gurobi', 'highs']
+
+
+class PairwiseDistances:
+    """ Distances between all pairs of vectors, computed one block of rows at a time.
+
+    The distances are computed in float32 with one matrix product per block
+    of rows and never stored as a whole, so the memory stays linear in the
+    number of vectors. The edges within a radius and the candidate radii of
+    the binary search, the distances just below or above a radius, are found
+    with one pass over the blocks.
+
+    methods
+    -------
+    edges(distance)
+        pairs of vectors within a distance, including each vector with itself
+    floor(distance)
+        largest distance between two vectors that is not above a distance
+    ceil(distance)
+        smallest distance between two vectors that is not below a distance
+    """
+    def __init__(self, vectors, block_size=2048):
+        """
+        parameters
+        ----------
+        vectors: numpy array
+            vectors of shape (n, d)
+        block_size: int
+            number of rows of the distance matrix computed at once
+        """
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.n = self.vectors.shape[0]
+        self.block_size = block_size
+        self.squared_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+    def blocks(self):
+        """ Yield the first row and the float32 distances of every block of rows. """
+        for start in range(0, self.n, self.block_size):
+            stop = min(start + self.block_size, self.n)
+            block = self.vectors[start:stop] @ self.vectors.T
+            block *= -2
+            block += self.squared_norms[start:stop, None]
+            block += self.squared_norms[None, :]
+            # rounding errors of the expansion can make small distances negative
+            np.maximum(block, 0, out=block)
+            np.sqrt(block, out=block)
+            block[np.arange(stop - start), np.arange(start, stop)] = 0
+            yield start, block
+
+    def edges(self, distance):
+        """ Find all the pairs of vectors within a distance, including each vector with itself.
+
+        returns
+        -------
+        rows: numpy array
+            index of the point of every edge
+        cols: numpy array
+            index of the candidate center of every edge
+        """
+        rows, cols = [], []
+        for start, block in self.blocks():
+            block_rows, block_cols = np.nonzero(block <= distance)
+            rows.append(block_rows + start)
+            cols.append(block_cols)
+        return np.concatenate(rows), np.concatenate(cols)
+
+    def floor(self, distance):
+        """ Largest distance between two vectors that is not above distance, 0 at least. """
+        return max(float(block[block <= distance].max(initial=0)) for _, block in self.blocks())
+
+    def ceil(self, distance):
+        """ Smallest distance between two vectors that is not below distance, the largest one if there is none. """
+        above, largest = np.inf, 0.
+        for _, block in self.blocks():
+            above = min(above, float(block[block >= distance].min(initial=np.inf)))
+            largest = max(largest, float(block.max()))
+        return above if np.isfinite(above) else largest
+
+
+def warm_start(rows, cols, n, start_centers):
+    """ Build a solution of the program from a set of centers.
+
+    Every point is assigned to one of the centers within the radius, the
+    points without such a center are outliers.
+
+    returns
+    -------
+    numpy array
+        values of the y, w and o variables
+    """
+    y = np.zeros(n)
+    y[start_centers] = 1
+    w = np.zeros(rows.shape[0])
+    candidates = np.flatnonzero(y[cols] == 1)
+    # keep one edge per point
+    points, first = np.unique(rows[candidates], return_index=True)
+    w[candidates[first]] = 1
+    o = np.ones(n)
+    o[points] = 0
+    return np.concatenate((y, w, o))
+
+
+def robust_k_center_mip(rows, cols, n, k, number_of_outliers, fixed_centers=None, start_centers=None,
+                        solver='auto', time_limit=None):
+    """ Decide whether k centers cover the points within the radius of the edges.
+
+    parameters
+    ----------
+    rows, cols: numpy array
+        edges of the radius-neighbour graph, see PairwiseDistances.edges
+    n: int
+        number of points
+    k: int
+        number of centers
+    number_of_outliers: int
+        maximum number of points that are not covered
+    fixed_centers: numpy array
+        indexes of the points that have to be centers, e.g. the labelled ones
+    start_centers: numpy array
+        indexes of k centers used as starting solution, e.g. from greedy k-center,
+        only used by gurobi, HiGHS does not support starting solutions
+    solver: str
+        one of SOLVERS, auto uses Gurobi when it is installed and HiGHS otherwise
+    time_limit: float
+        time limit of the solver in seconds, None for no limit. If no solution is
+        found within the limit, None is returned as for an infeasible program
+
+    returns
+    -------
+    numpy array or None
+        boolean mask of the centers, None if the program is infeasible
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver}, choose one of {SOLVERS}")
+    if solver == 'auto':
+        solver = 'highs' if gp is None else 'gurobi'
+    if solver == 'gurobi' and gp is None:
+        raise ImportError("The gurobi solver needs the gurobipy package, install it or use the highs solver")
+
+    number_of_edges = rows.shape[0]
+    edges = np.arange(number_of_edges)
+    points = np.arange(n)
+    # variables are ordered as y (n), w (number_of_edges), o (n)
+    w_offset, o_offset = n, n + number_of_edges
+    number_of_variables = 2 * n + number_of_edges
+
+    def matrix(row_index, col_index, values, number_of_rows):
+        return sparse.csr_matrix((values, (row_index, col_index)), shape=(number_of_rows, number_of_variables))
+
+    # sum_j y_j = k
+    number_of_centers = matrix(np.zeros(n), points, np.ones(n), 1)
+    # every point is assigned to one center or is an outlier
+    assignment = matrix(np.concatenate((rows, points)), np.concatenate((w_offset + edges, o_offset + points)),
+                        np.ones(number_of_edges + n), n)
+    # w_ij - y_j <= 0
+    opened = matrix(np.concatenate((edges, edges)), np.concatenate((w_offset + edges, cols)),
+                    np.concatenate((np.ones(number_of_edges), -np.ones(number_of_edges))), number_of_edges)
+    # sum_i o_i <= number_of_outliers
+    outliers = matrix(np.zeros(n), o_offset + points, np.ones(n), 1)
+
+    constraints = sparse.vstack((number_of_centers, assignment, opened, outliers)).tocsr()
+    lower = np.concatenate(([k], np.ones(n), np.full(number_of_edges, -np.inf), [0]))
+    upper = np.concatenate(([k], np.ones(n), np.zeros(number_of_edges), [number_of_outliers]))
+    objective = np.zeros(number_of_variables)
+    objective[o_offset:] = 1
+    variables_lower = np.zeros(number_of_variables)
+    if fixed_centers is not None:
+        variables_lower[np.asarray(fixed_centers, dtype=np.int64)] = 1
+
+    if solver == 'gurobi':
+        m = gp.Model("robust-k-center")
+        if time_limit is not None:
+            m.Params.TimeLimit = time_limit
+        x = m.addMVar(number_of_variables, lb=variables_lower, ub=1, vtype=gp.GRB.BINARY)
+        m.addConstr(constraints @ x >= lower)
+        m.addConstr(constraints @ x <= upper)
+        m.setObjective(objective @ x, gp.GRB.MINIMIZE)
+        if start_centers is not None:
+            x.Start = warm_start(rows, cols, n, start_centers)
+        m.optimize()
+        if m.SolCount == 0:
+            return None
+        return x.X[:n] > 0.5
+
+    options = {} if time_limit is None else {'time_limit': time_limit}
+    result = milp(objective, integrality=np.ones(number_of_variables),
+                  bounds=Bounds(variables_lower, np.ones(number_of_variables)),
+                  constraints=LinearConstraint(constraints, lower, upper), options=options)
+    if result.x is None:
+        return None
+    return result.x[:n] > 0.5
@@ -0,0 +1,303 @@
+"""
+Nearest-neighbour index over feature vectors, e.g. VAE embeddings or flattened crops.
+
+Small indexes are searched exactly: the distances between a block of queries
+and a block of indexed vectors are one matrix product, and the running k
+nearest are merged with argpartition. Once the index holds exact_size
+vectors it becomes an inverted file (IVF): the vectors are clustered with
+mini-batch k-means and every query only visits the n_probe clusters with
+the nearest centroids. The queries are grouped by visited cluster, so the
+work is still one matrix product per cluster.
+
+Vectors can be added at any time, e.g. after every smear or every round of
+active learning. New vectors are assigned to the existing clusters, and the
+index is saved and loaded as a single .npz file.
+"""
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+def squared_distances(a, b, b_norms=None):
+    """ Squared L2 distances between the rows of a and b, as one matrix product. """
+    a_norms = np.einsum('ij,ij->i', a, a)
+    b_norms = np.einsum('ij,ij->i', b, b) if b_norms is None else b_norms
+    return np.maximum(a_norms[:, None] + b_norms[None, :] - 2 * a @ b.T, 0)
+
+
+def merge_nearest(distances, ids, new_distances, new_ids, k):
+    """ Keep the k smallest distances of every row among the current and the new ones. """
+    distances = np.concatenate((distances, new_distances), axis=1)
+    ids = np.concatenate((ids, new_ids), axis=1)
+    if distances.shape[1] > k:
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(distances, nearest, axis=1)
+        ids = np.take_along_axis(ids, nearest, axis=1)
+    return distances, ids
+
+
+class KnnIndex:
+    """ Exact or inverted-file nearest-neighbour index with incremental insertion.
+
+    attributes
+    ----------
+    dim: int
+        dimension of the vectors
+    vectors: numpy array
+        indexed vectors of shape (n, dim)
+    ids: numpy array
+        int64 identifier of every indexed vector
+    centroids: numpy array
+        centroids of the clusters of the inverted file, None while the search is exact
+
+    methods
+    -------
+    add(vectors, ids)
+        add vectors to the index
+    train(n_lists)
+        cluster the indexed vectors, the following searches are approximate
+    search(queries, k)
+        distances and ids of the k nearest indexed vectors of every query
+    save(path)
+        save the index as a .npz file
+    load(path)
+        load an index saved with save
+    """
+    def __init__(self, dim, exact_size=50000, n_lists=None, n_probe=8, block_size=1024, dtype=np.float32, seed=0):
+        """
+        parameters
+        ----------
+        dim: int
+            dimension of the vectors
+        exact_size: int
+            number of indexed vectors from which the index is clustered, None to always search exactly
+        n_lists: int
+            number of clusters of the inverted file, 4 * sqrt(n) if None
+        n_probe: int
+            number of clusters visited by every query
+        block_size: int
+            number of queries whose distances are computed at once
+        dtype: numpy dtype
+            dtype of the indexed vectors and of the distance computations
+        seed: int
+            seed of the clustering
+        """
+        self.dim = dim
+        self.exact_size = exact_size
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.block_size = block_size
+        self.dtype = np.dtype(dtype)
+        self.seed = seed
+        # storage with a capacity that doubles when it is full, so adding vectors one at a time costs
+        # amortized constant time. The first _size rows are the indexed vectors
+        self._size = 0
+        self._vectors = np.zeros((0, dim), dtype=self.dtype)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._norms = np.zeros(0, dtype=self.dtype)
+        self._assignments = np.zeros(0, dtype=np.int64)
+        self.centroids = None
+        # vectors sorted by cluster and start of every cluster, rebuilt after insertions
+        self._lists = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def norms(self):
+        return self._norms[:self._size]
+
+    @property
+    def assignments(self):
+        return self._assignments[:self._size]
+
+    def _reserve(self, size):
+        """ Grow the storage to hold at least size vectors, by doubling its capacity. """
+        capacity = self._vectors.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+
+        def grow(array):
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            return grown
+
+        self._vectors, self._ids = grow(self._vectors), grow(self._ids)
+        self._norms, self._assignments = grow(self._norms), grow(self._assignments)
+
+    def _set(self, vectors, ids, assignments=None):
+        """ Replace the indexed vectors. """
+        self._size = 0
+        self._vectors = np.ascontiguousarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._norms = np.einsum('ij,ij->i', self._vectors, self._vectors)
+        self._assignments = np.zeros(self._vectors.shape[0], dtype=np.int64) if assignments is None \
+            else np.asarray(assignments, dtype=np.int64)
+        self._size = self._vectors.shape[0]
+        self._lists = None
+
+    def _assign(self, vectors):
+        """ Cluster of the nearest centroid of every vector. """
+        return np.concatenate([squared_distances(vectors[start:start + self.block_size], self.centroids).argmin(1)
+                               for start in range(0, vectors.shape[0], self.block_size)] or [np.zeros(0, np.int64)])
+
+    def add(self, vectors, ids=None):
+        """ Add vectors to the index.
+
+        parameters
+        ----------
+        vectors: numpy array
+            vectors of shape (n, dim), or of any shape with dim values per row
+        ids: numpy array
+            integer identifier of every vector, the insertion positions if None
+
+        returns
+        -------
+        KnnIndex
+            the index itself
+        """
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        ids = np.arange(len(self), len(self) + vectors.shape[0]) if ids is None else np.asarray(ids, dtype=np.int64)
+        start, stop = self._size, self._size + vectors.shape[0]
+        self._reserve(stop)
+        self._vectors[start:stop] = vectors
+        self._ids[start:stop] = ids
+        self._norms[start:stop] = np.einsum('ij,ij->i', vectors, vectors)
+        self._size = stop
+        if self.centroids is not None:
+            self._assignments[start:stop] = self._assign(vectors)
+            self._lists = None
+        elif self.exact_size is not None and len(self) >= self.exact_size:
+            self.train()
+        return self
+
+    def train(self, n_lists=None):
+        """ Cluster the indexed vectors with mini-batch k-means, the following searches visit n_probe clusters.
+
+        parameters
+        ----------
+        n_lists: int
+            number of clusters, the n_lists of the index if None
+        """
+        n_lists = n_lists or self.n_lists or int(4 * np.sqrt(len(self)))
+        n_lists = max(1, min(n_lists, len(self)))
+        rng = np.random.default_rng(self.seed)
+        sample = self.vectors[rng.choice(len(self), min(len(self), 256 * n_lists), replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=3, random_state=self.seed).fit(sample)
+        self.centroids = kmeans.cluster_centers_.astype(self.dtype)
+        self._assignments[:self._size] = self._assign(self.vectors)
+        self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))))
+            self._lists = (self.vectors[order], self.norms[order], self.ids[order], starts)
+        return self._lists
+
+    def search(self, queries, k):
+        """ Find the k nearest indexed vectors of every query.
+
+        parameters
+        ----------
+        queries: numpy array
+            query vectors of shape (q, dim), or of any shape with dim values per row
+        k: int
+            number of neighbours
+
+        returns
+        -------
+        distances: numpy array
+            L2 distances of shape (q, k) sorted in increasing order, inf where there are less than k candidates
+        ids: numpy array
+            ids of the neighbours of shape (q, k), -1 where there are less than k candidates
+        """
+        queries = np.asarray(queries, dtype=self.dtype).reshape(-1, self.dim)
+        distances = np.full((queries.shape[0], 0), np.inf, dtype=self.dtype)
+        ids = np.full((queries.shape[0], 0), -1, dtype=np.int64)
+        if self.centroids is None:
+            distances, ids = self._exact_search(queries, k, distances, ids)
+        else:
+            distances, ids = self._ivf_search(queries, k, distances, ids)
+
+        # pad the rows with less than k candidates and sort the neighbours
+        if distances.shape[1] < k:
+            padding = k - distances.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, padding)), constant_values=np.inf)
+            ids = np.pad(ids, ((0, 0), (0, padding)), constant_values=-1)
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.sqrt(np.take_along_axis(distances, order, axis=1)), np.take_along_axis(ids, order, axis=1)
+
+    def _exact_search(self, queries, k, distances, ids):
+        """ Blocked brute-force search over all the indexed vectors. """
+        found_distances, found_ids = [], []
+        for start in range(0, queries.shape[0], self.block_size):
+            block = queries[start:start + self.block_size]
+            block_distances, block_ids = distances[start:start + self.block_size], ids[start:start + self.block_size]
+            # the indexed vectors are also visited in blocks, so memory stays bounded for large indexes
+            step = max(self.block_size, (1 << 24) // max(block.shape[0], 1))
+            for first in range(0, len(self), step):
+                new_distances = squared_distances(block, self.vectors[first:first + step], self.norms[first:first + step])
+                new_ids = np.broadcast_to(self.ids[first:first + step], new_distances.shape)
+                block_distances, block_ids = merge_nearest(block_distances, block_ids, new_distances, new_ids, k)
+            found_distances.append(block_distances)
+            found_ids.append(block_ids)
+        if not found_distances:
+            return distances, ids
+        return np.concatenate(found_distances), np.concatenate(found_ids)
+
+    def _ivf_search(self, queries, k, distances, ids):
+        """ Search of the n_probe clusters with the nearest centroids of every query. """
+        vectors, norms, list_ids, starts = self._inverted_lists()
+        n_probe = min(self.n_probe, self.centroids.shape[0])
+        probes = np.concatenate([np.argpartition(squared_distances(queries[s:s + self.block_size], self.centroids),
+                                                 n_probe - 1, axis=1)[:, :n_probe]
+                                 for s in range(0, queries.shape[0], self.block_size)] or [np.zeros((0, n_probe), int)])
+        # group the (query, cluster) pairs by cluster
+        clusters = probes.ravel()
+        query_indexes = np.repeat(np.arange(queries.shape[0]), n_probe)
+        order = np.argsort(clusters, kind='stable')
+        clusters, query_indexes = clusters[order], query_indexes[order]
+        bounds = np.searchsorted(clusters, np.arange(self.centroids.shape[0] + 1))
+
+        # k nearest of every query, filled cluster by cluster
+        best_distances = np.full((queries.shape[0], k), np.inf, dtype=self.dtype)
+        best_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for cluster in np.flatnonzero(np.diff(bounds)):
+            members = slice(starts[cluster], starts[cluster + 1])
+            if starts[cluster] == starts[cluster + 1]:
+                continue
+            visiting = query_indexes[bounds[cluster]:bounds[cluster + 1]]
+            new_distances = squared_distances(queries[visiting], vectors[members], norms[members])
+            new_ids = np.broadcast_to(list_ids[members], new_distances.shape)
+            best_distances[visiting], best_ids[visiting] = merge_nearest(
+                best_distances[visiting], best_ids[visiting], new_distances, new_ids, k)
+        return best_distances, best_ids
+
+    def save(self, path):
+        """ Save the index as a .npz file. """
+        np.savez(path, vectors=self.vectors, ids=self.ids, assignments=self.assignments,
+                 centroids=np.zeros((0, self.dim), self.dtype) if self.centroids is None else self.centroids,
+                 trained=self.centroids is not None,
+                 parameters=np.array([-1 if self.exact_size is None else self.exact_size, self.n_lists or 0,
+                                      self.n_probe, self.block_size, self.seed]))
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index saved with save. """
+        saved = np.load(path)
+        exact_size, n_lists, n_probe, block_size, seed = saved['parameters'].tolist()
+        index = cls(saved['vectors'].shape[1], None if exact_size < 0 else exact_size, n_lists or None, n_probe,
+                    block_size, saved['vectors'].dtype, seed)
+        index._set(saved['vectors'], saved['ids'], saved['assignments'] if saved['trained'] else None)
+        if saved['trained']:
+            index.centroids = saved['centroids']
+        return index
@@ -0,0 +1,130 @@
+"""
+Batched Sinkhorn distances between cropped images.
+
+Every image of shape (50, 50) is compared as a point cloud of 50 points (its
+rows) with uniform weights, as with a direct call of geomloss SamplesLoss on
+two images. Instead of one call per pair, the pairs are stacked into batches
+of shape (B, 50, 50) and evaluated with a single call of the batched
+interface of SamplesLoss, so the memory is bounded by the batch size and the
+work of every call is spread over the torch threads.
+
+Pairs of two empty (all zero) images have distance 0 and are not evaluated.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from geomloss import SamplesLoss
+
+
+def _as_tensor(images):
+    """ Convert a stack of images to a contiguous float32 tensor. """
+    if not isinstance(images, torch.Tensor):
+        images = torch.from_numpy(np.asarray(images))
+    return images.to(torch.float32).contiguous()
+
+
+@contextmanager
+def _torch_threads(threads):
+    """ Use the given number of torch threads inside the block, and restore the previous number after it. """
+    previous = torch.get_num_threads()
+    if threads is not None:
+        torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def _pair_distances(loss, images_a, images_b, rows, cols, batch_size):
+    """ Sinkhorn distance of the pairs (images_a[rows], images_b[cols]), in batches. """
+    distances = np.zeros(rows.shape[0], dtype=np.float32)
+    # pairs of two empty images keep distance 0
+    empty_a = (images_a.reshape(images_a.shape[0], -1) == 0).all(1).numpy()
+    empty_b = (images_b.reshape(images_b.shape[0], -1) == 0).all(1).numpy()
+    pairs = np.flatnonzero(~(empty_a[rows] & empty_b[cols]))
+    with torch.inference_mode():
+        for start in range(0, pairs.shape[0], batch_size):
+            batch = pairs[start:start + batch_size]
+            x = images_a[torch.from_numpy(rows[batch])]
+            y = images_b[torch.from_numpy(cols[batch])]
+            distances[batch] = loss(x, y).numpy()
+    return distances
+
+
+def sinkhorn_loss(p=2, blur=.05, scaling=.5):
+    """ Sinkhorn divergence used for the distances, see geomloss.SamplesLoss. """
+    return SamplesLoss(loss="sinkhorn", p=p, blur=blur, scaling=scaling, backend="tensorized")
+
+
+def sinkhorn_distance_matrix(images, p=2, blur=.05, scaling=.5, batch_size=512, threads=None):
+    """ Compute the symmetric matrix of the Sinkhorn distances between all the images.
+
+    Only the pairs i < j are evaluated, a block of rows at a time.
+
+    parameters
+    ----------
+    images: numpy array or torch tensor
+        images of shape (n, 50, 50)
+    p, blur, scaling: float
+        parameters of the Sinkhorn divergence, see geomloss.SamplesLoss
+    batch_size: int
+        number of pairs evaluated in one call
+    threads: int
+        number of torch threads while the distances are computed, the current number if None
+
+    returns
+    -------
+    distances: numpy array
+        float32 matrix of shape (n, n)
+    """
+    images = _as_tensor(images)
+    loss = sinkhorn_loss(p, blur, scaling)
+    n = images.shape[0]
+    distances = np.zeros((n, n), dtype=np.float32)
+    # blocks of rows with a bounded number of pairs, so the index arrays stay small
+    rows_per_block = max(1, 64 * batch_size // max(n, 1))
+    with _torch_threads(threads):
+        for start in range(0, n, rows_per_block):
+            block_rows = np.arange(start, min(start + rows_per_block, n))
+            rows, cols = np.nonzero(np.arange(n)[None, :] > block_rows[:, None])
+            rows = block_rows[rows]
+            block_distances = _pair_distances(loss, images, images, rows, cols, batch_size)
+            distances[rows, cols] = block_distances
+            distances[cols, rows] = block_distances
+    return distances
+
+
+def sinkhorn_cross_distances(images_a, images_b, p=2, blur=.05, scaling=.5, batch_size=512, threads=None):
+    """ Compute the Sinkhorn distances between two sets of images.
+
+    parameters
+    ----------
+    images_a: numpy array or torch tensor
+        images of shape (n, 50, 50)
+    images_b: numpy array or torch tensor
+        images of shape (m, 50, 50)
+    p, blur, scaling: float
+        parameters of the Sinkhorn divergence, see geomloss.SamplesLoss
+    batch_size: int
+        number of pairs evaluated in one call
+    threads: int
+        number of torch threads while the distances are computed, the current number if None
+
+    returns
+    -------
+    distances: numpy array
+        float32 matrix of shape (n, m)
+    """
+    images_a, images_b = _as_tensor(images_a), _as_tensor(images_b)
+    loss = sinkhorn_loss(p, blur, scaling)
+    n, m = images_a.shape[0], images_b.shape[0]
+    distances = np.zeros((n, m), dtype=np.float32)
+    rows_per_block = max(1, 64 * batch_size // max(m, 1))
+    with _torch_threads(threads):
+        for start in range(0, n, rows_per_block):
+            stop = min(start + rows_per_block, n)
+            rows, cols = np.divmod(np.arange((stop - start) * m), m)
+            distances[start:stop] = _pair_distances(loss, images_a, images_b, rows + start, cols,
+                                                    batch_size).reshape(stop - start, m)
+    return distances
@@ -1,12 +1,7 @@
 import pandas as pd
 import numpy as np
-import torch
-from n_networks.data_augmentation import DataAug
 import matplotlib.pyplot as plt
-from train_random import train_randomly
-from n_networks.neural_net import MyDataset
-from torch.utils.data import DataLoader
-from n_networks.neural_net import ChatGPT
+from active_learning.al_trainer import ActiveLearningTrainer
 
 
 
@@ -16,7 +11,7 @@ def get_new_dataset(df, current_df):
     # get 150 random samples from the dataset
     m_df = df.sample(n=78)
     # append the 150 samples to the current dataset
-    current_df = current_df.append(m_df)
+    current_df = pd.concat([current_df, m_df])
     # remove the 150 samples from the dataset
     df = df.drop(m_df.index)
     df = df.reset_index(drop=True)
@@ -30,6 +25,8 @@ def get_new_dataset(df, current_df):
 
 # initialize accuracy list
 accuracy_list = []
+# classifier trained incrementally across the rounds
+trainer = ActiveLearningTrainer()
 
 
 # load full dataset
@@ -37,7 +34,7 @@ df = pd.read_pickle('D:/dataframe/all2.pkl')
 # take 1300 1 and 1300 0, drop the rest
 df1 = df[df['label'] == 1].sample(n=1300)
 df0 = df[df['label'] == 0].sample(n=1300)
-df = df1.append(df0)
+df = pd.concat([df1, df0])
 print(df.shape)
 print(df['label'].value_counts())
 
@@ -53,8 +50,8 @@ df = df.reset_index(drop=True)
 
 
 # train the model with the 150 samples
-# in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-acc = train_randomly(current_df, 0)
+# the trainer keeps the model in memory and fine-tunes it on the new samples
+acc = trainer.fit(current_df)
 accuracy_list.append(acc)
 
 #2600 / 78 = 33
@@ -63,8 +60,8 @@ for i in range(1, 32):
     current_df, df = get_new_dataset(df, current_df)
 
     # train the model with the 150 samples
-    # in train_cnn save the model in a pt file named as full_pu_CNN_0.pt and in the following iterations full_pu_CNN_1.pt, full_pu_CNN_2.pt, etc.
-    acc = train_randomly(current_df, i)
+    # the trainer keeps the model in memory and fine-tunes it on the new samples
+    acc = trainer.fit(current_df)
     accuracy_list.append(acc)
     print(accuracy_list)
 # plot the accuracy list verus number of data points
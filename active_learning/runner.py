@@ -0,0 +1,177 @@
+"""
+Run active learning experiments described by a config file.
+
+The labelled dataset is loaded and balanced once, the VAE feature vectors
+are computed once, and every (strategy, seed) pair is run in its own process
+with the same budget schedule: initial_size crops are labelled first, then
+query_size crops every round. After every round the classifier is fine-tuned
+with ActiveLearningTrainer and its validation accuracy is recorded together
+with the number of labelled crops and the time spent selecting and training.
+When the VAE feature vectors are available, the mean and min distance between
+the labelled crops and their coverage radius of the dataset are recorded too.
+
+All the runs are written to a single results table, one row per strategy,
+seed and round, from which the accuracy-vs-labels curves can be plotted.
+
+The script can be run from the command line as follows:
+   python -m active_learning.runner configs/active_learning.yaml
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import torch
+import yaml
+
+from active_learning.al_trainer import ActiveLearningTrainer
+from active_learning.diversity import DiversityTracker
+from active_learning.embedding_store import EmbeddingStore
+from active_learning.strategies import STRATEGIES, StrategyContext, select
+from active_learning.uncertainty import UncertaintySampler
+from src.crop_store import CropStore
+
+# selections that use the VAE feature vectors
+VAE_SELECTIONS = {'coreset', 'robust_coreset'}
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Active learning experiments')
+    parser.add_argument('config', type=str, default='configs/active_learning.yaml',
+                        help='configuration file with the strategies, the budget schedule and the training parameters')
+    return parser
+
+
+def load_crops(config):
+    """ Load the labelled datasets, balanced to the same number of crops per class.
+
+    parameters
+    ----------
+    config: dict
+        'data' section of the config
+
+    returns
+    -------
+    CropStore
+        labelled crops, the ids are their positions
+    """
+    df = pd.concat([pd.read_pickle(path) for path in config['datasets']], ignore_index=True)
+    if config.get('per_class'):
+        df = pd.concat([df[df['label'] == label].sample(n=config['per_class'], random_state=0)
+                        for label in (1, 0)], ignore_index=True)
+    crops = CropStore.from_dataframe(df.reset_index(drop=True))
+    print('Crops: ', len(crops), ' bacilli: ', int(crops.labels.sum()))
+    return crops
+
+
+def vae_embeddings(crops, config):
+    """ VAE feature vectors of the crops if a strategy uses them, None otherwise. """
+    selections = {selection for strategy in config['experiment']['strategies'] for selection in STRATEGIES[strategy]}
+    if not selections & VAE_SELECTIONS:
+        return None
+    checkpoint = config['coreset']['vae_checkpoint']
+    if not os.path.exists(checkpoint):
+        raise FileNotFoundError(f"VAE checkpoint {checkpoint} not found, train it with active_learning/base_models/train_vae.py")
+    # keyed by the pixels of the crops, the ids are positions that depend on the datasets and the sampling
+    return EmbeddingStore(checkpoint).embeddings(crops.images)
+
+
+def run(strategy, seed, crops, embeddings, config):
+    """ Run the rounds of active learning of one strategy and seed.
+
+    parameters
+    ----------
+    strategy: str
+        one of STRATEGIES
+    seed: int
+        seed of the selections and of the training
+    crops: CropStore
+        labelled crops, revealed to the classifier as they are selected
+    embeddings: numpy array
+        VAE feature vectors of the crops, None if the strategy does not use them
+    config: dict
+        content of the config file
+
+    returns
+    -------
+    list of dict
+        one row per round
+    """
+    experiment = config['experiment']
+    if experiment.get('threads'):
+        torch.set_num_threads(experiment['threads'])
+    torch.manual_seed(seed)
+    trainer = ActiveLearningTrainer(seed=seed, **config['training'])
+    context = StrategyContext(np.random.default_rng(seed), trainer,
+                              UncertaintySampler(config['uncertainty']['score']), embeddings)
+
+    # diversity of the labelled crops in the VAE feature space, when the feature vectors are available
+    tracker = None if embeddings is None else DiversityTracker(embeddings)
+    labelled = np.zeros(len(crops), dtype=bool)
+    rows = []
+    for round_number in range(experiment['rounds']):
+        pool = np.flatnonzero(~labelled)
+        if pool.shape[0] == 0:
+            break
+        q = experiment['initial_size'] if round_number == 0 else experiment['query_size']
+
+        start_time = time.perf_counter()
+        selected = select(strategy, round_number == 0, crops.subset(pool), crops.subset(labelled), q, context)
+        labelled[pool[selected]] = True
+        selection_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        accuracy = trainer.fit(crops.subset(labelled).to_dataframe())
+        training_time = time.perf_counter() - start_time
+
+        rows.append({'strategy': strategy, 'seed': seed, 'round': round_number, 'labelled': int(labelled.sum()),
+                     'accuracy': accuracy, 'selection_seconds': selection_time, 'training_seconds': training_time})
+        if tracker is not None:
+            diversity = tracker.add(embeddings[crops.ids[pool[selected]]])
+            rows[-1].update({key: diversity[key] for key in ('mean_distance', 'min_distance', 'coverage_radius')})
+        print(f"{strategy} seed {seed} round {round_number}: {labelled.sum()} labelled, accuracy {accuracy:.2f}")
+    return rows
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    with open(pars_arg.config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    experiment = config['experiment']
+    for strategy in experiment['strategies']:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy}, choose one of {list(STRATEGIES)}")
+
+    crops = load_crops(config['data'])
+    embeddings = vae_embeddings(crops, config)
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=experiment.get('processes', 1)) as executor:
+        futures = [executor.submit(run, strategy, seed, crops, embeddings, config)
+                   for strategy in experiment['strategies'] for seed in experiment['seeds']]
+        for future in as_completed(futures):
+            rows.extend(future.result())
+
+    results = pd.DataFrame(rows).sort_values(['strategy', 'seed', 'round']).reset_index(drop=True)
+    path = config['results']['path']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    results.to_csv(path, index=False)
+    print('Results saved in: ', path)
+
+    # mean accuracy of the last round and mean time per round of every strategy
+    last = results[results['round'] == results.groupby(['strategy', 'seed'])['round'].transform('max')]
+    summary = last.groupby('strategy')[['labelled', 'accuracy']].mean()
+    summary[['selection_seconds', 'training_seconds']] = \
+        results.groupby('strategy')[['selection_seconds', 'training_seconds']].mean()
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Query strategies of the active learning runner.
+
+A selection function picks q crops of the unlabelled pool, given the crops
+that are already labelled, and returns their positions in the pool:
+    - random: random crops
+    - uncertainty: the crops the classifier is most uncertain about
+    - coreset: greedy k-center on the VAE feature vectors, the labelled
+      crops are the initial centers
+    - coreset_cnn: greedy k-center on the features of the classifier
+    - robust_coreset: robust k-center on the VAE feature vectors
+    - ot: medoids of the Sinkhorn distances between the rescaled crops
+
+A strategy chooses the initial labelled crops with one selection and the
+crops of the following rounds with another one, as the original scripts:
+random (full_random), uncertainty (full_pu), coreset_uncertainty
+(coreset_pu, coreset1_pu), coreset (full_coreset_L), robust_coreset and
+coreset_ot (full_coreset_ot).
+"""
+import kmedoids
+import numpy as np
+
+from active_learning.base_models.label_propagation import rescale
+from active_learning.coreset_functions import active_learning, greedy_k_center
+from active_learning.knn_index import KnnIndex
+from active_learning.ot_distances import sinkhorn_distance_matrix
+
+# strategy -> (selection of the initial crops, selection of the following rounds)
+STRATEGIES = {
+    'random': ('random', 'random'),
+    'uncertainty': ('random', 'uncertainty'),
+    'coreset_uncertainty': ('coreset', 'uncertainty'),
+    'coreset': ('coreset', 'coreset_cnn'),
+    'robust_coreset': ('robust_coreset', 'robust_coreset'),
+    'coreset_ot': ('ot', 'ot'),
+}
+
+
+class StrategyContext:
+    """ State shared by the selections of one run.
+
+    attributes
+    ----------
+    rng: numpy Generator
+        random generator of the run
+    trainer: ActiveLearningTrainer
+        classifier trained so far
+    sampler: UncertaintySampler
+        uncertainty scores of the pool
+    embeddings: numpy array
+        VAE feature vector of every crop of the dataset, indexed by the crop ids
+    labelled_index: KnnIndex
+        exact index of the VAE feature vectors of the labelled crops, extended every round
+    """
+    def __init__(self, rng, trainer, sampler, embeddings):
+        self.rng = rng
+        self.trainer = trainer
+        self.sampler = sampler
+        self.embeddings = embeddings
+        self.labelled_index = None if embeddings is None else KnnIndex(embeddings.shape[1], exact_size=None)
+
+
+def random_selection(pool, labelled, q, context):
+    return context.rng.choice(len(pool), q, replace=False)
+
+
+def uncertainty_selection(pool, labelled, q, context):
+    return context.sampler.query(context.trainer.model, pool.images, q, ids=pool.ids)
+
+
+def coreset_selection(pool, labelled, q, context):
+    # only the crops labelled since the previous round are added to the index
+    new = labelled.ids[~np.isin(labelled.ids, context.labelled_index.ids)]
+    context.labelled_index.add(context.embeddings[new], new)
+    indexes, _ = greedy_k_center(context.embeddings[pool.ids], q, context.labelled_index)
+    return indexes
+
+
+def cnn_coreset_selection(pool, labelled, q, context):
+    indexes, _ = greedy_k_center(context.trainer.features(pool.images), q, context.trainer.features(labelled.images))
+    return indexes
+
+
+def robust_coreset_selection(pool, labelled, q, context):
+    # the labelled crops come first and are fixed centers, q new centers are added
+    vectors = np.concatenate((context.embeddings[labelled.ids], context.embeddings[pool.ids]))
+    acle = active_learning(vectors, q + 1, list(range(len(labelled))) if len(labelled) else None)
+    _, _, indexes = acle.robust_k_center()
+    return indexes - len(labelled)
+
+
+def ot_selection(pool, labelled, q, context):
+    distances = sinkhorn_distance_matrix(rescale(pool.images))
+    return np.asarray(kmedoids.fasterpam(distances, q).medoids)
+
+
+SELECTIONS = {
+    'random': random_selection,
+    'uncertainty': uncertainty_selection,
+    'coreset': coreset_selection,
+    'coreset_cnn': cnn_coreset_selection,
+    'robust_coreset': robust_coreset_selection,
+    'ot': ot_selection,
+}
+
+
+def select(strategy, first_round, pool, labelled, q, context):
+    """ Select the crops to label with a strategy.
+
+    parameters
+    ----------
+    strategy: str
+        one of STRATEGIES
+    first_round: bool
+        whether the initial crops are selected
+    pool: CropStore
+        unlabelled crops
+    labelled: CropStore
+        crops labelled so far
+    q: int
+        number of crops to select
+    context: StrategyContext
+        state of the run
+
+    returns
+    -------
+    numpy array
+        positions of the selected crops in the pool
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy}, choose one of {list(STRATEGIES)}")
+    selection = STRATEGIES[strategy][0 if first_round else 1]
+    return np.asarray(SELECTIONS[selection](pool, labelled, min(q, len(pool)), context), dtype=np.int64)
@@ -0,0 +1,191 @@
+"""
+Uncertainty sampling for the active learning query selection.
+
+The pool of unlabelled crops is scored in large batches with one of the
+following scores, higher is more uncertain:
+    - margin: 1 - |p(bacillus) - p(non-bacillus)|
+    - entropy: binary entropy of the predicted probability
+    - mc_dropout: mutual information between the prediction and the weights
+      (BALD), estimated with dropout on the output of fc1 for mc_samples
+      stochastic passes that are evaluated as one batch
+
+The q most uncertain crops are selected with np.argpartition. The scores are
+cached per model, identified by a hash of its weights, and per crop, so a
+pool that is queried again with an unchanged model is not rescored.
+"""
+import copy
+import hashlib
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from n_networks.neural_net import ChatGPT, normalize_crops
+from src.crop_store import crop_keys
+
+SCORES = ['margin', 'entropy', 'mc_dropout']
+
+
+def model_hash(model):
+    """ Hash of the weights of a model. """
+    digest = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def binary_entropy(p):
+    p = np.clip(p, 1e-7, 1 - 1e-7)
+    return -(p * np.log(p) + (1 - p) * np.log(1 - p))
+
+
+class UncertaintySampler:
+    """ Score a pool of crops with a classifier and select the most uncertain ones.
+
+    attributes
+    ----------
+    score: str
+        one of SCORES
+    batch_size: int
+        number of crops evaluated at once
+    mc_samples: int
+        number of stochastic passes of mc_dropout
+    dropout: float
+        dropout probability of mc_dropout
+    device: torch.device
+        device the crops are evaluated on
+
+    methods
+    -------
+    load_model(path)
+        load a ChatGPT state dict, only when the file changed since the last call
+    scores(model, images, ids)
+        uncertainty of every crop
+    query(model, images, q, ids)
+        indexes of the q most uncertain crops
+    """
+    def __init__(self, score='margin', batch_size=1024, mc_samples=10, dropout=0.5, device=None):
+        if score not in SCORES:
+            raise ValueError(f"Unknown score {score}, choose one of {SCORES}")
+        self.score = score
+        self.batch_size = batch_size
+        self.mc_samples = mc_samples
+        self.dropout = dropout
+        self.device = device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        # model hash -> {crop key: score}
+        self.cache = {}
+        self._loaded = None
+
+    def load_model(self, path, model_class=ChatGPT):
+        """ Load a state dict from disk, the model is reused while the file does not change.
+
+        parameters
+        ----------
+        path: str
+            path to the .pth state dict
+        model_class: type
+            class of the model
+
+        returns
+        -------
+        torch.nn.Module
+            model in eval mode
+        """
+        key = (path, os.stat(path).st_mtime_ns, model_class)
+        if self._loaded is None or self._loaded[0] != key:
+            model = model_class()
+            model.load_state_dict(torch.load(path, map_location=torch.device('cpu')))
+            self._loaded = (key, model.eval())
+        return self._loaded[1]
+
+    def _probabilities(self, model, images):
+        """ Probability of every crop, of shape (n,) or (mc_samples, n) for mc_dropout.
+
+        The model of the caller is left as it is: a copy is scored if it is on another
+        device, and its training mode is restored afterwards.
+        """
+        if next(model.parameters()).device != self.device:
+            model = copy.deepcopy(model).to(self.device)
+        training = model.training
+        model.eval()
+        hook = None
+        if self.score == 'mc_dropout':
+            # repeat the output of fc1 once per pass and drop it out, so all the passes are one batch.
+            # fc1 runs once per forward, BacilliNet applies relu3 twice, and dropout before the relu
+            # equals dropout after it
+            def mc_dropout(module, inputs, output):
+                return F.dropout(output.repeat(self.mc_samples, 1), self.dropout, training=True)
+            hook = model.fc1.register_forward_hook(mc_dropout)
+        outputs = []
+        try:
+            with torch.inference_mode():
+                for start in range(0, images.shape[0], self.batch_size):
+                    batch = torch.from_numpy(normalize_crops(images[start:start + self.batch_size])).to(self.device)
+                    output = model(batch).reshape(-1, batch.shape[0]) if hook else model(batch).reshape(1, -1)
+                    outputs.append(output.cpu())
+        finally:
+            if hook:
+                hook.remove()
+            model.train(training)
+        probabilities = torch.cat(outputs, dim=1).numpy()
+        return probabilities if hook else probabilities[0]
+
+    def _score(self, probabilities):
+        if self.score == 'margin':
+            return 1 - np.abs(2 * probabilities - 1)
+        if self.score == 'entropy':
+            return binary_entropy(probabilities)
+        return binary_entropy(probabilities.mean(0)) - binary_entropy(probabilities).mean(0)
+
+    def scores(self, model, images, ids=None):
+        """ Uncertainty of every crop, higher is more uncertain.
+
+        parameters
+        ----------
+        model: torch.nn.Module
+            classifier returning the bacillus probability of every crop
+        images: numpy array
+            crops of shape (n, 50, 50)
+        ids: list
+            identifier of every crop used for the cache, a hash of the pixels if None
+
+        returns
+        -------
+        numpy array
+            scores of shape (n,)
+        """
+        keys = (crop_keys(images) if ids is None else np.asarray(ids)).tolist()
+        cache = self.cache.setdefault((model_hash(model), self.score), {})
+        missing = np.array([i for i, key in enumerate(keys) if key not in cache], dtype=np.int64)
+        if missing.shape[0] > 0:
+            new_scores = self._score(self._probabilities(model, np.asarray(images)[missing]))
+            cache.update(zip([keys[i] for i in missing], new_scores))
+        return np.array([cache[key] for key in keys], dtype=np.float32)
+
+    def query(self, model, images, q, ids=None):
+        """ Select the q most uncertain crops.
+
+        parameters
+        ----------
+        model: torch.nn.Module
+            classifier returning the bacillus probability of every crop
+        images: numpy array
+            crops of shape (n, 50, 50)
+        q: int
+            number of crops to select
+        ids: list
+            identifier of every crop used for the cache, a hash of the pixels if None
+
+        returns
+        -------
+        numpy array
+            positions of the selected crops in images, most uncertain first
+        """
+        scores = self.scores(model, images, ids)
+        q = min(q, scores.shape[0])
+        if q == 0:
+            return np.zeros(0, dtype=np.int64)
+        selected = np.argpartition(-scores, q - 1)[:q]
+        return selected[np.argsort(-scores[selected])]
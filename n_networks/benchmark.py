@@ -0,0 +1,87 @@
+"""
+Benchmark the inference backends on synthetic crops.
+
+For every available backend and batch size the median latency of one call
+and the resulting throughput in crops per second are printed.
+
+The script can be run from the command line as follows:
+   python -m n_networks.benchmark src/saved_models
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from n_networks.neural_net import normalize_crops
+from n_networks.runtime import BACKENDS, load_runtime
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Benchmark inference backends')
+    parser.add_argument('model_dir', type=str, default='src/saved_models',
+                        help='folder with the state dicts and the exported artifacts')
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, help='backends to compare')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 16, 64, 256])
+    parser.add_argument('--repeats', type=int, default=20, help='timed calls per batch size')
+    parser.add_argument('--threads', type=int, default=None, help='number of CPU threads for torch')
+    return parser
+
+
+def benchmark(runtime, images, repeats):
+    """ Time a runtime on a batch of crops.
+
+    parameters
+    ----------
+    runtime: callable
+        runtime returned by load_runtime
+    images: numpy array
+        normalised crops of shape (batch, 1, 50, 50)
+    repeats: int
+        number of timed calls
+
+    returns
+    -------
+    latency: float
+        median latency of one call in milliseconds
+    throughput: float
+        crops per second
+    """
+    # warm up
+    runtime(images)
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        runtime(images)
+        timings.append(time.perf_counter() - start_time)
+    latency = float(np.median(timings))
+    return latency * 1000, images.shape[0] / latency
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    if pars_arg.threads:
+        torch.set_num_threads(pars_arg.threads)
+
+    rng = np.random.default_rng(0)
+    crops = rng.integers(0, 16000, size=(max(pars_arg.batch_sizes), 50, 50)).astype(np.uint16)
+    images = normalize_crops(crops)
+
+    print(f"{'backend':<12} {'batch':>6} {'latency [ms]':>13} {'crops/s':>10}")
+    for backend in pars_arg.backends:
+        try:
+            runtime = load_runtime(backend, pars_arg.model_dir)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print(f"{backend:<12} skipped: {e}")
+            continue
+        for batch_size in pars_arg.batch_sizes:
+            latency, throughput = benchmark(runtime, images[:batch_size], pars_arg.repeats)
+            print(f"{backend:<12} {batch_size:>6} {latency:>13.2f} {throughput:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
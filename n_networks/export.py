@@ -0,0 +1,104 @@
+"""
+Export the bacilli classifiers to TorchScript and ONNX.
+
+For every architecture (ChatGPT, a single BacilliNet and the averaged
+BacilliNet ensemble) a .pt and a .onnx artifact are written, which can then
+be selected with the backend option of the inference config.
+
+The script can be run from the command line as follows:
+   python -m n_networks.export src/saved_models
+"""
+import argparse
+import os
+
+import torch
+
+from n_networks.neural_net import ChatGPT, BacilliNet
+from n_networks.runtime import load_ensemble
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Export bacilli classifiers')
+    parser.add_argument('model_dir', type=str, default='src/saved_models',
+                        help='folder with model.pth and model_1.pth ... model_5.pth')
+    parser.add_argument('--out_dir', type=str, default=None,
+                        help='folder for the artifacts, defaults to model_dir')
+    parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'],
+                        help='torchscript and/or onnx')
+    return parser
+
+
+def load_models(model_dir):
+    """ Load the models that are exported.
+
+    parameters
+    ----------
+    model_dir: str
+        folder with the saved state dicts
+
+    returns
+    -------
+    models: dict
+        artifact name -> module in eval mode
+    """
+    chatgpt = ChatGPT()
+    chatgpt.load_state_dict(torch.load(os.path.join(model_dir, 'model.pth'), map_location=torch.device('cpu')))
+    bacillinet = BacilliNet()
+    bacillinet.load_state_dict(torch.load(os.path.join(model_dir, 'model_1.pth'), map_location=torch.device('cpu')))
+    return {'chatgpt': chatgpt.eval(), 'bacillinet': bacillinet.eval(), 'ensemble': load_ensemble(model_dir)}
+
+
+def export_torchscript(model, path):
+    """ Trace the model and save it as TorchScript.
+
+    parameters
+    ----------
+    model: torch.nn.Module
+        model to export
+    path: str
+        output .pt file
+    """
+    example = torch.zeros(1, 1, 50, 50)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    traced = torch.jit.freeze(traced)
+    traced.save(path)
+
+
+def export_onnx(model, path):
+    """ Export the model to ONNX, with a dynamic batch dimension.
+
+    parameters
+    ----------
+    model: torch.nn.Module
+        model to export
+    path: str
+        output .onnx file
+    """
+    example = torch.zeros(1, 1, 50, 50)
+    torch.onnx.export(model, example, path, input_names=['crops'], output_names=['probability'],
+                      dynamic_axes={'crops': {0: 'batch'}, 'probability': {0: 'batch'}}, opset_version=17)
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    out_dir = pars_arg.out_dir or pars_arg.model_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, model in load_models(pars_arg.model_dir).items():
+        if 'torchscript' in pars_arg.formats:
+            path = os.path.join(out_dir, name + '.pt')
+            export_torchscript(model, path)
+            print("TorchScript model saved in: " + path)
+        if 'onnx' in pars_arg.formats:
+            path = os.path.join(out_dir, name + '.onnx')
+            export_onnx(model, path)
+            print("ONNX model saved in: " + path)
+
+
+if __name__ == '__main__':
+    main()
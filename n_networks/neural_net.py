@@ -40,7 +40,7 @@ class BacilliNet(nn.Module):
         out = self.maxpool2(out)
 
         # Fully connected layers
-        out = out.view(-1, 64 * 12 * 12)
+        out = out.reshape(-1, 64 * 12 * 12)
 
         out = self.fc1(out)
         out = self.relu3(out)
@@ -54,6 +54,70 @@ class BacilliNet(nn.Module):
         return out
 
 
+class FusedBacilliNet(nn.Module):
+    """Several trained BacilliNet members packed into a single module.
+
+    The convolutions of the members are concatenated along the channel axis
+    (the second one as a grouped convolution, one group per member) and the
+    fully connected layers are stacked and evaluated with batched matrix
+    products, so a single forward call returns the outputs of every member.
+    """
+    def __init__(self, members):
+        super(FusedBacilliNet, self).__init__()
+        self.n_members = len(members)
+
+        # 1st convolutional layer, all members read the same input channel
+        self.conv1 = nn.Conv2d(in_channels=1, out_channels=32 * self.n_members, kernel_size=3, stride=1, padding=1)
+        self.relu1 = nn.ReLU()
+        self.maxpool1 = nn.MaxPool2d(kernel_size=2)
+
+        # 2nd convolutional layer, one group per member
+        self.conv2 = nn.Conv2d(in_channels=32 * self.n_members, out_channels=64 * self.n_members, kernel_size=3,
+                               stride=1, padding=1, groups=self.n_members)
+        self.relu2 = nn.ReLU()
+        self.maxpool2 = nn.MaxPool2d(kernel_size=2)
+
+        # Fully connected layers, stored as (members, in_features, out_features) for bmm
+        with torch.no_grad():
+            self.conv1.weight.copy_(torch.cat([m.conv1.weight for m in members], dim=0))
+            self.conv1.bias.copy_(torch.cat([m.conv1.bias for m in members], dim=0))
+            self.conv2.weight.copy_(torch.cat([m.conv2.weight for m in members], dim=0))
+            self.conv2.bias.copy_(torch.cat([m.conv2.bias for m in members], dim=0))
+            for name in ['fc1', 'fc2', 'fc3']:
+                weight = torch.stack([getattr(m, name).weight.t() for m in members]).contiguous()
+                bias = torch.stack([getattr(m, name).bias for m in members]).unsqueeze(1)
+                self.register_parameter(name + '_weight', nn.Parameter(weight))
+                self.register_parameter(name + '_bias', nn.Parameter(bias))
+        self.relu3 = nn.ReLU()
+        self.sigmoid = nn.Sigmoid()
+
+    def forward(self, x):
+        """ Return the output of every member, shape (members, batch, 1). """
+        # 1st convolutional layer
+        out = self.conv1(x)
+        out = self.relu1(out)
+        out = self.maxpool1(out)
+
+        # 2nd convolutional layer
+        out = self.conv2(out)
+        out = self.relu2(out)
+        out = self.maxpool2(out)
+
+        # (batch, members * 64, 12, 12) -> (members, batch, 64 * 12 * 12)
+        out = out.reshape(out.shape[0], self.n_members, 64 * 12 * 12).transpose(0, 1)
+
+        # Fully connected layers
+        out = torch.baddbmm(self.fc1_bias, out, self.fc1_weight)
+        out = self.relu3(out)
+        out = torch.baddbmm(self.fc2_bias, out, self.fc2_weight)
+        out = self.relu3(out)
+
+        out = torch.baddbmm(self.fc3_bias, out, self.fc3_weight)
+        out = self.sigmoid(out)
+
+        return out
+
+
 class ChatGPT(nn.Module):
     def __init__(self):
         super(ChatGPT, self).__init__()
@@ -87,7 +151,7 @@ class ChatGPT(nn.Module):
         out = self.maxpool2(out)
 
         # Fully connected layers
-        out = out.view(-1, 64 * 12 * 12)
+        out = out.reshape(-1, 64 * 12 * 12)
 
         out = self.fc1(out)
         out = self.relu3(out)
@@ -131,7 +195,7 @@ class ChatGPT(nn.Module):
         out = self.maxpool2(out)
 
         # Fully connected layers
-        out = out.view(-1, 64 * 12 * 12)
+        out = out.reshape(-1, 64 * 12 * 12)
 
         out = self.fc1(out)
         out = self.relu3(out)
@@ -159,4 +223,37 @@ class MyDataset(Dataset):
         if np.max(img) - np.min(img) != 0:
             img = (img - np.min(img)) / (np.max(img) - np.min(img)) - 0.5
 
-        return torch.tensor(img, dtype=torch.float32)
\ No newline at end of file
+        return torch.tensor(img, dtype=torch.float32)
+
+
+class EnsembleMean(nn.Module):
+    """Average the outputs of a FusedBacilliNet into one probability per crop."""
+    def __init__(self, fused):
+        super(EnsembleMean, self).__init__()
+        self.fused = fused
+
+    def forward(self, x):
+        return torch.mean(self.fused(x), dim=0)
+
+
+def normalize_crops(images):
+    """Rescale a batch of crops the same way MyDataset does, in one vectorized pass.
+
+    parameters
+    ----------
+    images: numpy array
+        crops of shape (n, 50, 50)
+
+    returns
+    -------
+    numpy array
+        float32 batch of shape (n, 1, 50, 50)
+    """
+    # scaled in float64 like MyDataset, then cast to float32, so the values are identical
+    images = np.asarray(images, dtype=np.float64)
+    minimum = images.min(axis=(1, 2), keepdims=True)
+    value_range = images.max(axis=(1, 2), keepdims=True) - minimum
+    # constant crops are left untouched, like in MyDataset
+    scaled = (images - minimum) / np.where(value_range != 0, value_range, 1) - 0.5
+    images = np.where(value_range != 0, scaled, images)
+    return np.ascontiguousarray(images[:, np.newaxis], dtype=np.float32)
@@ -0,0 +1,234 @@
+"""
+Quantise the bacilli classifiers to INT8 for CPU inference.
+
+Two modes are supported:
+    - dynamic: the weights of the linear layers are stored as INT8 and the
+      activations are quantised on the fly, no calibration data is needed
+    - static: convolutions and linear layers are quantised with activation
+      ranges calibrated on saved crops
+
+ChatGPT, a single BacilliNet and the BacilliNet ensemble are quantised. The
+quantised kernels do not cover the batched matrix products of the fused
+ensemble, so the INT8 ensemble keeps its five members as separate modules.
+Every INT8 model is saved as TorchScript next to the float models
+(e.g. ensemble_int8_dynamic.pt) and can be used for inference with the
+quantization option of the inference config. The accuracy on a held-out
+labelled set and the speedup with respect to the float model are printed.
+
+The script can be run from the command line as follows:
+   python -m n_networks.quantize src/saved_models --test labelled_data/test.pkl
+   python -m n_networks.quantize src/saved_models --mode static --calibration labelled_data/smear.pkl
+"""
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from n_networks.neural_net import ChatGPT, BacilliNet, normalize_crops
+
+QUANTIZATION_MODES = ['dynamic', 'static']
+
+
+class AveragedEnsemble(nn.Module):
+    """Average the outputs of separate ensemble members."""
+    def __init__(self, members):
+        super(AveragedEnsemble, self).__init__()
+        self.members = nn.ModuleList(members)
+
+    def forward(self, x):
+        return torch.mean(torch.stack([member(x) for member in self.members]), dim=0)
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Quantise bacilli classifiers')
+    parser.add_argument('model_dir', type=str, default='src/saved_models',
+                        help='folder with model.pth and model_1.pth ... model_5.pth')
+    parser.add_argument('--mode', type=str, default='dynamic', help='dynamic or static')
+    parser.add_argument('--calibration', nargs='+', default=[],
+                        help='.pkl datasets with saved crops, used to calibrate static quantisation')
+    parser.add_argument('--test', nargs='+', default=[],
+                        help='held-out labelled .pkl datasets used to report the accuracy')
+    parser.add_argument('--calibration_size', type=int, default=2000, help='maximum number of calibration crops')
+    return parser
+
+
+def load_crops(paths):
+    """ Load the crops and labels of saved datasets.
+
+    parameters
+    ----------
+    paths: list
+        paths to .pkl dataframes with an 'image' and optionally a 'label' column
+
+    returns
+    -------
+    images: numpy array
+        normalised crops of shape (n, 1, 50, 50)
+    labels: numpy array or None
+        labels of the crops, None if the datasets are not labelled
+    """
+    data = pd.concat([pd.read_pickle(path) for path in paths], ignore_index=True)
+    images = normalize_crops(np.stack(data['image'].to_numpy()))
+    labels = data['label'].to_numpy(dtype=np.float32) if 'label' in data.columns else None
+    return images, labels
+
+
+def load_float_models(model_dir):
+    """ Load the float models that are quantised.
+
+    parameters
+    ----------
+    model_dir: str
+        folder with the saved state dicts
+
+    returns
+    -------
+    models: dict
+        name -> (model, list of modules to quantise)
+    """
+    def load(model, name):
+        model.load_state_dict(torch.load(os.path.join(model_dir, name), map_location=torch.device('cpu')))
+        return model.eval()
+
+    chatgpt = load(ChatGPT(), 'model.pth')
+    bacillinet = load(BacilliNet(), 'model_1.pth')
+    members = [load(BacilliNet(), 'model_' + str(i) + '.pth') for i in range(1, 6)]
+    return {'chatgpt': chatgpt, 'bacillinet': bacillinet, 'ensemble': AveragedEnsemble(members).eval()}
+
+
+def quantize_module(model, mode, calibration_images=None):
+    """ Quantise a single classifier.
+
+    parameters
+    ----------
+    model: torch.nn.Module
+        float model in eval mode
+    mode: str
+        dynamic or static
+    calibration_images: numpy array
+        normalised crops used to calibrate the activation ranges (static only)
+
+    returns
+    -------
+    torch.nn.Module
+        INT8 model
+    """
+    model = copy.deepcopy(model)
+    if mode == 'dynamic':
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if calibration_images is None:
+        raise ValueError("Static quantisation needs calibration crops, pass them with --calibration")
+    example = torch.from_numpy(calibration_images[:1])
+    prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), (example,))
+    with torch.inference_mode():
+        for batch in np.array_split(calibration_images, max(1, calibration_images.shape[0] // 256)):
+            prepared(torch.from_numpy(batch))
+    return convert_fx(prepared)
+
+
+def quantize(model, mode, calibration_images=None):
+    """ Quantise a classifier, the members of an ensemble are quantised one by one.
+
+    parameters
+    ----------
+    model: torch.nn.Module
+        float model in eval mode
+    mode: str
+        dynamic or static
+    calibration_images: numpy array
+        normalised crops used to calibrate the activation ranges (static only)
+
+    returns
+    -------
+    torch.nn.Module
+        INT8 model
+    """
+    if isinstance(model, AveragedEnsemble):
+        members = [quantize_module(member, mode, calibration_images) for member in model.members]
+        return AveragedEnsemble(members).eval()
+    return quantize_module(model, mode, calibration_images)
+
+
+def predict(model, images, batch_size=256):
+    """ Predict the bacilli probability of every crop.
+
+    returns
+    -------
+    numpy array
+        probabilities of shape (n,)
+    """
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, images.shape[0], batch_size):
+            outputs.append(model(torch.from_numpy(images[start:start + batch_size])).reshape(-1))
+    return torch.cat(outputs).numpy()
+
+
+def latency(model, images, repeats=10):
+    """ Median latency of one call on a batch of crops, in milliseconds. """
+    example = torch.from_numpy(images)
+    timings = []
+    with torch.inference_mode():
+        model(example)
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            model(example)
+            timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings)) * 1000
+
+
+def save_torchscript(model, path):
+    """ Trace the quantised model and save it as TorchScript. """
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, torch.zeros(1, 1, 50, 50))
+    traced.save(path)
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    if pars_arg.mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantisation mode {pars_arg.mode}, choose one of {QUANTIZATION_MODES}")
+
+    calibration_images = None
+    if pars_arg.calibration:
+        calibration_images, _ = load_crops(pars_arg.calibration)
+        rng = np.random.default_rng(42)
+        if calibration_images.shape[0] > pars_arg.calibration_size:
+            calibration_images = calibration_images[rng.choice(calibration_images.shape[0],
+                                                               pars_arg.calibration_size, replace=False)]
+        print("Calibration crops: ", calibration_images.shape[0])
+    test_images, test_labels = load_crops(pars_arg.test) if pars_arg.test else (None, None)
+    benchmark_images = normalize_crops(np.random.default_rng(0).integers(0, 16000, size=(256, 50, 50)))
+
+    for name, model in load_float_models(pars_arg.model_dir).items():
+        quantized = quantize(model, pars_arg.mode, calibration_images)
+        path = os.path.join(pars_arg.model_dir, name + '_int8_' + pars_arg.mode + '.pt')
+        save_torchscript(quantized, path)
+        print("--------------------------------------")
+        print("INT8 model saved in: " + path)
+
+        float_latency = latency(model, benchmark_images)
+        int8_latency = latency(quantized, benchmark_images)
+        print(f"Latency for 256 crops: float {float_latency:.1f} ms, int8 {int8_latency:.1f} ms, "
+              f"speedup {float_latency / int8_latency:.2f}x")
+
+        if test_labels is not None:
+            float_accuracy = 100 * np.mean((predict(model, test_images) > 0.5) == test_labels)
+            int8_accuracy = 100 * np.mean((predict(quantized, test_images) > 0.5) == test_labels)
+            print(f"Accuracy: float {float_accuracy:.2f} %, int8 {int8_accuracy:.2f} %, "
+                  f"delta {int8_accuracy - float_accuracy:+.2f} %")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Runtimes used to evaluate the bacilli classifiers on CPU.
+
+Every runtime is called with a float32 batch of normalised crops of shape
+(batch, 1, 50, 50), see normalize_crops, and returns the bacilli probability
+of every crop as a numpy array of shape (batch,).
+
+The available backends are:
+    - eager: the PyTorch modules built from the saved state dicts
+    - torchscript: the TorchScript artifacts written by n_networks/export.py
+    - onnxruntime: the ONNX artifacts written by n_networks/export.py
+
+The INT8 ensembles written by n_networks/quantize.py are TorchScript
+artifacts and can be used with the eager and torchscript backends.
+"""
+import functools
+import os
+
+import torch
+
+from n_networks.neural_net import BacilliNet, FusedBacilliNet, EnsembleMean
+
+BACKENDS = ['eager', 'torchscript', 'onnxruntime']
+QUANTIZATIONS = ['none', 'dynamic', 'static']
+
+
+class EagerRuntime:
+    """ Run a PyTorch module in eager mode.
+
+    parameters
+    ----------
+    model: torch.nn.Module
+        module returning one probability per crop
+    """
+    def __init__(self, model):
+        self.model = model.eval()
+
+    def __call__(self, images):
+        with torch.inference_mode():
+            return self.model(torch.from_numpy(images)).reshape(-1).numpy()
+
+
+class TorchScriptRuntime(EagerRuntime):
+    """ Run a TorchScript artifact.
+
+    parameters
+    ----------
+    path: str
+        path to the .pt file
+    """
+    def __init__(self, path):
+        super(TorchScriptRuntime, self).__init__(torch.jit.load(path, map_location='cpu'))
+
+
+class OnnxRuntime:
+    """ Run an ONNX artifact with onnxruntime on the CPU.
+
+    parameters
+    ----------
+    path: str
+        path to the .onnx file
+    """
+    def __init__(self, path):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnxruntime backend needs the onnxruntime package, "
+                              "install it or use the eager or torchscript backend")
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images):
+        return self.session.run(None, {self.input_name: images})[0].reshape(-1)
+
+
+def load_ensemble(model_dir):
+    """ Load the five BacilliNet members and pack them into one averaging module.
+
+    parameters
+    ----------
+    model_dir: str
+        folder with the model_1.pth ... model_5.pth state dicts
+
+    returns
+    -------
+    EnsembleMean
+        module returning the mean probability of the members
+    """
+    members = []
+    for i in range(1, 6):
+        member = BacilliNet()
+        member.load_state_dict(torch.load(os.path.join(model_dir, 'model_' + str(i) + '.pth'),
+                                          map_location=torch.device('cpu')))
+        members.append(member.eval())
+    return EnsembleMean(FusedBacilliNet(members)).eval()
+
+
+@functools.lru_cache(maxsize=None)
+def load_runtime(backend, model_dir, quantization='none'):
+    """ Load the ensemble for the requested backend, once per process.
+
+    parameters
+    ----------
+    backend: str
+        one of BACKENDS
+    model_dir: str
+        folder with the saved state dicts and the exported artifacts
+    quantization: str
+        one of QUANTIZATIONS, load the INT8 ensemble instead of the float one
+
+    returns
+    -------
+    runtime
+        callable mapping a batch of normalised crops to probabilities
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}, choose one of {BACKENDS}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization}, choose one of {QUANTIZATIONS}")
+    if quantization != 'none':
+        if backend == 'onnxruntime':
+            raise ValueError("Quantised ensembles are TorchScript artifacts, use the eager or torchscript backend")
+        return TorchScriptRuntime(os.path.join(model_dir, 'ensemble_int8_' + quantization + '.pt'))
+    if backend == 'eager':
+        return EagerRuntime(load_ensemble(model_dir))
+    if backend == 'torchscript':
+        return TorchScriptRuntime(os.path.join(model_dir, 'ensemble.pt'))
+    return OnnxRuntime(os.path.join(model_dir, 'ensemble.onnx'))
@@ -1,81 +1,169 @@
+"""
+SVM that recognizes bacilli from the shape features of their connected components.
+
+Every object is described by the same fixed-size float32 vector, see
+feature_matrix in src/shape_features.py: area, width, height, axes and
+elongation of the ellipse with the same moments, and the seven Hu moments.
+The features are standardized and classified by a linear SVM.
+
+The model is saved together with the names of the features it was trained
+on, so a model trained on an older feature layout is refused at loading
+instead of silently predicting on columns in the wrong order.
+
+The labelled datasets saved by the pipeline contain a 'features' column with
+the feature vector of every crop. The script can be run from the command
+line as follows:
+   python -m n_networks.stats_svm labelled_data/*.pkl --output svm_results/svm.pkl
+"""
+import argparse
+import functools
+import os
+
+import joblib
 import numpy as np
 import pandas as pd
 from sklearn import svm
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
-import joblib
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 
+from src.shape_features import FEATURE_NAMES, SHAPE_FEATURES_DTYPE, feature_matrix
 
-class StatsSvm:
+SVM_PATH = os.path.join('svm_results', 'svm.pkl')
+
+
+def arguments_parser():
     """
-    train the svm to recognize bacilli based on the stats
+    Parse arguments from the command line
     """
-    def __init__(self, dataset, statistics):
-        self.dataset = dataset
-        self.stats = statistics
-        self.number_of_entries = self.dataset.shape[0]
-
-    def create_dataframe(self):
-        # df = pd.DataFrame(self.dataset)
-        df = self.dataset
-        # delete the 'image' column
-        df = df.drop(['image'], axis=1)
-        # add a column to the dataset for each column in stats
-        df['area'] = self.stats[0:self.number_of_entries, 4]
-        df['hight'] = self.stats[0:self.number_of_entries, 2]
-        df['width'] = self.stats[0:self.number_of_entries, 3]
-        return df
-
-    def train_svm(self):
-        df = self.create_dataframe()
-        # create a dataframe with the labels
-        labels = df['label']
-        # drop the labels from the dataset
-        df = df.drop('label', axis=1)
-        # split the dataset into train and test
-        X_train, X_test, y_train, y_test = train_test_split(df, labels, test_size=0.2, random_state=0)
-        # initialize the svm
-        self.clf = svm.SVC(kernel='linear', C=1)
-        # train the svm
-        self.clf.fit(X_train, y_train)
-        # test the svm
-        self.clf.score(X_test, y_test)
-        # save the svm
-        joblib.dump(self.clf, 'svm_results/svm.pkl')
-        # visaualize the svm
-
-    def visualize_svm(self):
-        # load the svm
-        self.clf = joblib.load('svm_results/svm.pkl')
-        # create a dataframe
-        df = self.create_dataframe()
-        # create a dataframe with the labels
-        labels = df['label']
-        # drop the labels from the dataset
-        df = df.drop('label', axis=1)
-        # split the dataset into train and test
-        X_train, X_test, y_train, y_test = train_test_split(df, labels, test_size=0.2, random_state=0)
-        # test the svm
-        y_pred = self.clf.predict(X_test)
-        # print the accuracy
-        print("Accuracy:", accuracy_score(y_test, y_pred))
-
-
-# load .pkl file from labelled_data folder
-print("Loading stats")
-stats = pd.read_pickle('labelled_data/stats_tile_673_smear_2156_17_3.pkl')
-# turn stats dataframe into a numpy array
-stats = stats.to_numpy()
-# remove background stats, remove first row
-stats = np.delete(stats, 0, 0)
-print("Stats loaded into numpy array!")
-
-data = pd.read_pickle('../labelled_data/tile_673_smear_2156_17_3.pkl')
-print("Dataset loaded")
-
-procedure = StatsSvm(data, stats)
-
-# train the svm
-procedure.train_svm()
-
-procedure.visualize_svm()
+    parser = argparse.ArgumentParser('Train the shape feature SVM')
+    parser.add_argument('datasets', nargs='+', help='labelled datasets with a features column')
+    parser.add_argument('--output', type=str, default=SVM_PATH, help='path of the saved model')
+    parser.add_argument('--C', type=float, default=1.0, help='regularization parameter of the SVM')
+    parser.add_argument('--test_size', type=float, default=0.2, help='fraction of the crops used for testing')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the train / test split')
+    return parser
+
+
+def dataset_features(dataframe):
+    """ Feature vectors and labels of a labelled dataset.
+
+    parameters
+    ----------
+    dataframe: pandas dataframe
+        labelled dataset with a 'features' and a 'label' column
+
+    returns
+    -------
+    features: numpy array
+        float32 array of shape (number of crops, len(FEATURE_NAMES))
+    labels: numpy array
+        label of every crop
+    """
+    if 'features' not in dataframe.columns:
+        raise ValueError("The dataset has no 'features' column, label it again with the current pipeline")
+    features = np.stack(dataframe['features'].to_numpy()).astype(np.float32) if dataframe.shape[0] else \
+        np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32)
+    if features.shape[1] != len(FEATURE_NAMES):
+        raise ValueError(f"The dataset has {features.shape[1]} features, expected {len(FEATURE_NAMES)}")
+    return features, dataframe['label'].to_numpy()
+
+
+class StatsSvm:
+    """ Linear SVM on the standardized shape features of the objects.
+
+    Attributes:
+    ----------
+    model: sklearn pipeline
+        scaler and SVM
+    feature_names: tuple
+        names of the columns the model was trained on
+
+    Methods:
+    -------
+    fit(features, labels)
+        Train the SVM.
+    predict(features)
+        Predict the class of many objects, e.g. of a whole smear, in one call.
+    save(path)
+        Save the model with its feature names.
+    load(path)
+        Load a model saved with save.
+    """
+    def __init__(self, C=1.0, model=None, feature_names=FEATURE_NAMES):
+        """
+        parameters:
+        ----------
+        C: float
+            regularization parameter of the SVM, not used if model is given
+        model: sklearn pipeline
+            trained model, a new one is created if None
+        feature_names: tuple
+            names of the columns of the features
+        """
+        self.model = model if model is not None else make_pipeline(StandardScaler(), svm.SVC(kernel='linear', C=C))
+        self.feature_names = tuple(feature_names)
+
+    def fit(self, features, labels):
+        """ Train the SVM on feature vectors of shape (n, len(feature_names)). """
+        self.model.fit(features, labels)
+        return self
+
+    def predict(self, features):
+        """ Predict the class of the objects.
+
+        parameters
+        ----------
+        features: numpy array
+            structured array with dtype SHAPE_FEATURES_DTYPE, or feature vectors from feature_matrix
+
+        returns
+        -------
+        predictions: numpy array
+            float predictions, 1 for bacilli
+        """
+        if features.dtype == SHAPE_FEATURES_DTYPE:
+            features = feature_matrix(features)
+        if features.shape[0] == 0:
+            return np.zeros(0)
+        return self.model.predict(features).astype(float)
+
+    def save(self, path=SVM_PATH):
+        """ Save the model with its feature names. """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump({'model': self.model, 'feature_names': self.feature_names}, path)
+
+    @classmethod
+    def load(cls, path=SVM_PATH):
+        """ Load a model saved with save, it must use the current feature layout. """
+        saved = joblib.load(path)
+        if not isinstance(saved, dict) or tuple(saved.get('feature_names', ())) != FEATURE_NAMES:
+            raise ValueError(f"The SVM in {path} was not trained on the current shape features, "
+                             f"train it again with python -m n_networks.stats_svm")
+        return cls(model=saved['model'], feature_names=saved['feature_names'])
+
+
+@functools.lru_cache(maxsize=None)
+def load_svm(path=SVM_PATH):
+    """ Load a saved SVM once, it is then shared by all the tiles and smears. """
+    return StatsSvm.load(path)
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    df = pd.concat([pd.read_pickle(path) for path in pars_arg.datasets], ignore_index=True)
+    features, labels = dataset_features(df)
+    print('Crops: ', labels.shape[0], ' bacilli: ', int(np.count_nonzero(labels == 1)))
+
+    X_train, X_test, y_train, y_test = train_test_split(features, labels, test_size=pars_arg.test_size,
+                                                        random_state=pars_arg.seed, stratify=labels)
+    classifier = StatsSvm(pars_arg.C).fit(X_train, y_train)
+    print("Accuracy:", accuracy_score(y_test, classifier.predict(X_test)))
+    classifier.save(pars_arg.output)
+    print("SVM saved in: ", pars_arg.output)
+
+
+if __name__ == '__main__':
+    main()
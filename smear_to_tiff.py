@@ -1,22 +1,161 @@
-from aicsimageio.readers import CziReader
-import matplotlib.pyplot as plt
+"""
+Export the tiles of a smear as 16-bit TIFF.
+
+The tiles are streamed from the h5 cache of the Loader (created from the czi
+file if it does not exist yet), optionally contrast-adjusted with CLAHE,
+and written by a pool of workers, either:
+    - tiles: one 16-bit TIFF file per tile, tile_<index>.tiff
+    - ome: a single BigTIFF OME-TIFF with one internally tiled page per tile
+At the end the throughput and the size of the output are printed.
+
+The workers are threads: CLAHE and the TIFF encoding and writing release the
+GIL and run in parallel, while the reads of the h5 cache are serialized by
+the global lock of h5py, so reading is not parallel.
+
+The script can be run from the command line as follows:
+   python smear_to_tiff.py TB_sample/extern_Synlab_2156_17_3_MTB.czi --format ome --clahe
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2 as cv
+import h5py
+import numpy as np
+import tifffile
+
+from src.loader import Loader
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Export a smear as TIFF')
+    parser.add_argument('czi_path', type=str, help='path to the czi file of the smear')
+    parser.add_argument('--output', type=str, default=None,
+                        help='output folder for tiles, output file for ome, named after the smear if None')
+    parser.add_argument('--format', choices=['tiles', 'ome'], default='tiles',
+                        help='one TIFF per tile or a single BigTIFF OME-TIFF')
+    parser.add_argument('--clahe', action='store_true', help='adjust the contrast of every tile with CLAHE')
+    parser.add_argument('--clip_limit', type=float, default=20.0, help='clip limit of CLAHE')
+    parser.add_argument('--grid', type=int, default=8, help='number of CLAHE regions per side')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of parallel workers')
+    parser.add_argument('--tile_size', type=int, default=512, help='size of the internal TIFF tiles for ome')
+    parser.add_argument('--compression', type=str, default=None, help='TIFF compression, e.g. zlib, None for raw')
+    return parser
+
+
+class TileProcessor:
+    """ Read a tile from the h5 cache and adjust its contrast, from any worker thread.
+
+    The reads are serialized by h5py, only the contrast adjustment runs in parallel.
+    CLAHE objects are not shared between threads, every worker creates its own.
+    """
+    def __init__(self, tiles, clahe=False, clip_limit=20.0, grid=8):
+        self.tiles = tiles
+        self.clahe = clahe
+        self.clip_limit = clip_limit
+        self.grid = grid
+        self.local = threading.local()
+
+    def __call__(self, index):
+        tile = np.asarray(self.tiles[index], dtype=np.uint16)
+        if self.clahe:
+            if not hasattr(self.local, 'clahe'):
+                self.local.clahe = cv.createCLAHE(clipLimit=self.clip_limit, tileGridSize=(self.grid, self.grid))
+            tile = self.local.clahe.apply(tile)
+        return tile
+
+
+def export_tiles(process, number_of_tiles, folder, workers, compression=None):
+    """ Write every tile to its own 16-bit TIFF file, in parallel.
+
+    returns
+    -------
+    list
+        paths of the written files
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    def write(index):
+        path = os.path.join(folder, f'tile_{index}.tiff')
+        tifffile.imwrite(path, process(index), photometric='minisblack', compression=compression)
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(write, range(number_of_tiles)))
+
+
+def export_ome(process, number_of_tiles, shape, path, workers, tile_size=512, compression=None):
+    """ Write all the tiles to a single BigTIFF OME-TIFF, one internally tiled page per tile.
+
+    The tiles are processed in parallel, in order, at most 2 * workers ahead of the writer.
+
+    returns
+    -------
+    list
+        path of the written file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tile_size = (min(tile_size, shape[0]) // 16 * 16 or 16, min(tile_size, shape[1]) // 16 * 16 or 16)
+
+    def pages():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = [executor.submit(process, index) for index in range(min(2 * workers, number_of_tiles))]
+            for index in range(number_of_tiles):
+                page = pending.pop(0).result()
+                if index + len(pending) + 1 < number_of_tiles:
+                    pending.append(executor.submit(process, index + len(pending) + 1))
+                yield page
+
+    def segments():
+        # the writer expects the internal tiles of every page in row-major order, padded at the borders
+        for page in pages():
+            padded = np.zeros((-(-shape[0] // tile_size[0]) * tile_size[0], -(-shape[1] // tile_size[1]) * tile_size[1]),
+                              dtype=np.uint16)
+            padded[:shape[0], :shape[1]] = page
+            for row in range(0, padded.shape[0], tile_size[0]):
+                for col in range(0, padded.shape[1], tile_size[1]):
+                    yield padded[row:row + tile_size[0], col:col + tile_size[1]]
+
+    with tifffile.TiffWriter(path, bigtiff=True, ome=True) as tif:
+        tif.write(segments(), shape=(number_of_tiles,) + tuple(shape), dtype=np.uint16, tile=tile_size,
+                  photometric='minisblack', compression=compression, metadata={'axes': 'TYX'})
+    return [path]
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    loader = Loader(pars_arg.czi_path, 'None')
+    h5_path = os.path.join('h5_data', loader.dataset_name + '.h5')
+    if not os.path.isfile(h5_path):
+        # the loader caches the tiles of the smear in h5_data/
+        loader.load()
 
-# read smear
-reader = CziReader("TB_sample/extern_Synlab_2156_17_3_MTB.czi")
+    start_time = time.perf_counter()
+    with h5py.File(h5_path, 'r') as f:
+        tiles = f[loader.dataset_name]
+        process = TileProcessor(tiles, pars_arg.clahe, pars_arg.clip_limit, pars_arg.grid)
+        workers = max(1, pars_arg.workers or 1)
+        if pars_arg.format == 'tiles':
+            output = pars_arg.output or loader.dataset_name + '_tiff'
+            paths = export_tiles(process, tiles.shape[0], output, workers, pars_arg.compression)
+        else:
+            output = pars_arg.output or loader.dataset_name + '.ome.tif'
+            paths = export_ome(process, tiles.shape[0], tiles.shape[1:], output, workers, pars_arg.tile_size,
+                               pars_arg.compression)
+        number_of_tiles, pixel_bytes = tiles.shape[0], tiles.shape[0] * tiles.shape[1] * tiles.shape[2] * 2
+    elapsed = time.perf_counter() - start_time
 
-# load as numpy array
-smear = reader.get_image_data("MYX", C=0)
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Exported {number_of_tiles} tiles to {output} in {elapsed:.1f} s: "
+          f"{number_of_tiles / elapsed:.1f} tiles/s, {pixel_bytes / elapsed / 2 ** 20:.1f} MB/s, "
+          f"output size {size / 2 ** 20:.1f} MB")
 
-# for adjusting the contrast
-clahe = cv.createCLAHE(clipLimit=20.0, tileGridSize=(8,8))
 
-# save all images of the smear in tiff format
-for idx, img in enumerate(smear):
-    # adjust contrast and save image
-    # cl1 = clahe.apply(img)
-    # plt.imsave(f'Smear_2156_17_3/tile_{idx}.tiff', cl1)
-    # save image without adjusting contrast
-    plt.imsave(f'Smear_2156_17_3/tile_{idx}.tiff', img)
-    # save image with different colormap
-    plt.imsave(f'Smear_2156_17_3/tile_{idx}.tiff', img, cmap='Blues')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Contrast change of crops with a lookup table.
+
+The crops are rescaled to 0-255 and truncated to uint8, then the contrast
+change 128 + factor * (c - 128) is applied through a 256-entry lookup table,
+rounded and clipped as PIL's Image.point does. The table of every level is
+computed once, and whole stacks of crops of shape (n, H, W) are transformed
+with a single np.take instead of one PIL image per crop.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def contrast_lut(level):
+    """ Lookup table of a contrast change.
+
+    parameters
+    ----------
+    level: float
+        level of contrast change, between -255 and 255
+
+    returns
+    -------
+    lut: numpy array
+        uint8 array of 256 values, the new value of every pixel value
+    """
+    factor = (259 * (level + 255)) / (255 * (259 - level))
+    lut = np.clip(np.round(128 + factor * (np.arange(256) - 128)), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def rescale_images(images):
+    """ Rescale every image of a stack to range 0-255 and truncate it to uint8.
+
+    parameters
+    ----------
+    images: numpy array
+        image of shape (H, W) or stack of images of shape (n, H, W)
+
+    returns
+    -------
+    images: numpy array
+        uint8 rescaled images, the images that are constant or not positive become 0
+    """
+    images = np.asarray(images, dtype=np.float64)
+    axes = (-2, -1)
+    minimum = images.min(axis=axes, keepdims=True)
+    value_range = images.max(axis=axes, keepdims=True) - minimum
+    valid = (value_range > 0) & (images.max(axis=axes, keepdims=True) > 0)
+    # same order of operations as the original per-image rescale, so the truncation matches
+    scaled = np.where(valid, (images - minimum) / np.where(valid, value_range, 1) * 255, 0)
+    return scaled.astype(np.uint8)
+
+
+def change_contrast(images, level):
+    """ Change the contrast of an image or of a stack of images.
+
+    parameters
+    ----------
+    images: numpy array
+        image of shape (H, W) or stack of images of shape (n, H, W)
+    level: float
+        level of contrast change
+
+    returns
+    -------
+    images: numpy array
+        uint8 images with changed contrast, of the same shape
+    """
+    return np.take(contrast_lut(level), rescale_images(images))
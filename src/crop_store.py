@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# label of the crops that are not labelled
+UNLABELLED = -1
+
+
+def crop_keys(images):
+    """ Key of every crop, a 64 bit hash of its pixels that does not depend on its position.
+
+    parameters
+    ----------
+    images: numpy array
+        cropped images of shape (n, 50, 50)
+
+    returns
+    -------
+    keys: numpy array
+        uint64 key of every crop
+    """
+    images = np.ascontiguousarray(images)
+    digests = b''.join(hashlib.blake2b(image.tobytes(), digest_size=8).digest() for image in images)
+    return np.frombuffer(digests, dtype=np.uint64).copy()
+
+
+class CropStore:
+    """ Columnar store of cropped images, with one array per column instead of one
+    dataframe row per crop.
+
+    Attributes:
+    ----------
+    images: numpy array
+        cropped images of shape (n, 50, 50)
+    labels: numpy array
+        labels of the crops, 1 for bacilli, 0 for non-bacilli, UNLABELLED otherwise
+    ids: numpy array
+        identifier of every crop, e.g. the index of the dataframe it comes from
+
+    Methods:
+    -------
+    from_dataframe(dataframe)
+        Build a store from a dataframe with an 'image' and optionally a 'label' column.
+    to_dataframe()
+        Convert the store to a dataframe with 'image' and 'label' columns, indexed by the ids.
+    subset(indexes)
+        Get the crops with the given positions.
+    save(path)
+        Save the store as a folder of .npy files.
+    load(path, mmap)
+        Load a store saved with save, memory-mapped by default.
+    """
+    def __init__(self, images, labels=None, ids=None):
+        """
+        parameters:
+        ----------
+        images: numpy array
+            cropped images of shape (n, 50, 50)
+        labels: numpy array
+            labels of the crops, all UNLABELLED if None
+        ids: numpy array
+            identifier of every crop, 0 ... n - 1 if None
+        """
+        self.images = images
+        n = images.shape[0]
+        self.labels = np.full(n, UNLABELLED, dtype=np.float32) if labels is None else np.asarray(labels, np.float32)
+        self.ids = np.arange(n) if ids is None else np.asarray(ids)
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    @classmethod
+    def from_dataframe(cls, dataframe):
+        """ Build a store from a dataframe with an 'image' and optionally a 'label' column.
+
+        parameters
+        ----------
+        dataframe: pandas dataframe
+            one crop per row, e.g. a saved labelled dataset
+
+        returns
+        -------
+        CropStore
+            store with the crops of the dataframe, the ids are the index of the dataframe
+        """
+        images = np.stack(dataframe['image'].to_numpy()) if dataframe.shape[0] else np.zeros((0, 50, 50))
+        labels = dataframe['label'].to_numpy(dtype=np.float32) if 'label' in dataframe.columns else None
+        return cls(images, labels, dataframe.index.to_numpy())
+
+    def to_dataframe(self):
+        """ Convert the store to a dataframe with 'image' and 'label' columns, indexed by the ids. """
+        return pd.DataFrame({'image': list(self.images), 'label': self.labels}, index=self.ids)
+
+    def subset(self, indexes):
+        """ Get the crops with the given positions, or boolean mask, in the store. """
+        return CropStore(self.images[indexes], self.labels[indexes], self.ids[indexes])
+
+    def save(self, path):
+        """ Save the store as a folder with images.npy, labels.npy and ids.npy. """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'images.npy'), self.images)
+        np.save(os.path.join(path, 'labels.npy'), self.labels)
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Load a store saved with save, the images are memory-mapped unless mmap is False. """
+        images = np.load(os.path.join(path, 'images.npy'), mmap_mode='r' if mmap else None)
+        return cls(images, np.load(os.path.join(path, 'labels.npy')), np.load(os.path.join(path, 'ids.npy')))
@@ -0,0 +1,133 @@
+"""
+Queue that classifies the crops of many tiles in full batches.
+
+Most tiles only yield a handful of suspected bacilli, so calling the
+classifier once per tile leads to tiny batches. The queue collects the crops
+of consecutive tiles and sends them through the classifier as soon as a full
+batch is pending. The queue has no thread of its own: the age of the oldest
+pending crop is checked when crops are added and whenever poll is called,
+e.g. before the long work of the next tile, and the queue is flushed if it is
+older than max_latency. This is a best-effort bound, a crop can wait longer
+if nothing calls the queue. The predictions are then scattered back to the
+tile, and to the position inside the tile, they came from.
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+
+class InferenceQueue:
+    """ Accumulate items of many tiles and classify them in batches.
+
+    attributes
+    ----------
+    classify: callable
+        function mapping an array of items to one prediction per item
+    batch_size: int
+        number of items sent to the classifier at once
+    max_latency: float
+        time in seconds after which the pending items are flushed, checked
+        by put and poll only, so it is a best-effort bound
+    predictions: dict
+        tile -> numpy array with the predictions of the items of the tile
+
+    methods
+    -------
+    put(tile, items)
+        add the items of a tile and classify all full batches
+    poll()
+        flush the pending items if the oldest one is older than max_latency
+    flush()
+        classify all pending items, even if they do not fill a batch
+    close()
+        flush the queue and return the predictions of every tile
+    """
+    def __init__(self, classify, batch_size=256, max_latency=1.0):
+        """
+        parameters
+        ----------
+        classify: callable
+            function mapping an array of items to one prediction per item
+        batch_size: int
+            number of items sent to the classifier at once
+        max_latency: float
+            time in seconds after which the pending items are flushed by put or poll
+        """
+        self.classify = classify
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.predictions = {}
+        # pending segments: (tile, offset of the first pending item, items, arrival time)
+        self.pending = deque()
+        self.number_pending = 0
+
+    def put(self, tile, items):
+        """ Add the items of a tile and classify all full batches.
+
+        parameters
+        ----------
+        tile: int
+            index of the tile the items belong to
+        items: numpy array
+            items of the tile, e.g. the cropped images
+        """
+        self.predictions[tile] = np.zeros(len(items))
+        if len(items) == 0:
+            return
+        self.pending.append((tile, 0, items, time.perf_counter()))
+        self.number_pending += len(items)
+
+        while self.number_pending >= self.batch_size:
+            self._classify_pending(self.batch_size)
+        self.poll()
+
+    def poll(self):
+        """ Flush the pending items if the oldest one has waited longer than max_latency.
+        """
+        if self.pending and time.perf_counter() - self.pending[0][3] > self.max_latency:
+            self.flush()
+
+    def flush(self):
+        """ Classify all pending items, even if they do not fill a batch.
+        """
+        if self.number_pending > 0:
+            self._classify_pending(self.number_pending)
+
+    def close(self):
+        """ Flush the queue and return the predictions of every tile.
+
+        returns
+        -------
+        predictions: dict
+            tile -> numpy array with the predictions of the items of the tile
+        """
+        self.flush()
+        return self.predictions
+
+    def _classify_pending(self, number):
+        """ Classify the first number pending items and scatter the predictions.
+
+        parameters
+        ----------
+        number: int
+            number of items to classify
+        """
+        segments = []
+        taken = 0
+        while taken < number:
+            tile, offset, items, arrival = self.pending[0]
+            count = min(number - taken, len(items) - offset)
+            segments.append((tile, offset, count, items[offset:offset + count]))
+            taken += count
+            if offset + count == len(items):
+                self.pending.popleft()
+            else:
+                self.pending[0] = (tile, offset + count, items, arrival)
+        self.number_pending -= number
+
+        predictions = self.classify(np.concatenate([segment[3] for segment in segments]))
+        start = 0
+        for tile, offset, count, _ in segments:
+            self.predictions[tile][offset:offset + count] = predictions[start:start + count]
+            start += count
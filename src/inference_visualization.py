@@ -1,13 +1,114 @@
-import cv2
 import numpy as np
-import torch
-from torch.utils.data import DataLoader, Dataset
-from n_networks.neural_net import ChatGPT, BacilliNet
-import pandas as pd
-import joblib
+from n_networks.neural_net import normalize_crops
+from n_networks.runtime import load_runtime
+from n_networks.stats_svm import load_svm
 from src.utils import clean_stats
+from src.shape_features import tile_shape_features
 import os
 
+# folder with the saved state dicts and the exported artifacts
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'saved_models')
+
+# one record per object: its tile, the corners of its box in (row, column)
+# coordinates of the tile, as drawn in napari, and whether it is a bacillus
+BOX_DTYPE = np.dtype([('tile', np.int32), ('row0', np.int32), ('col0', np.int32),
+                      ('row1', np.int32), ('col1', np.int32), ('bacillus', np.bool_)])
+
+
+def box_records(stats, predictions, tile=0):
+    """ Get the box records of the objects, in one vectorized pass over the stats.
+
+    parameters
+    ----------
+    stats: numpy array
+        cleaned stats of the connected components, the first row is skipped
+        like for the cropped images
+    predictions: numpy array
+        array of predictions, 0 for non-bacilli
+    tile: int
+        index of the tile in the smear
+
+    returns
+    -------
+    records: numpy structured array
+        one record per prediction, with dtype BOX_DTYPE
+    """
+    objects = stats[1:predictions.shape[0] + 1]
+    records = np.empty(predictions.shape[0], dtype=BOX_DTYPE)
+    records['tile'] = tile
+    records['row0'] = objects[:, 1] - 5
+    records['col0'] = objects[:, 0] - 5
+    records['row1'] = records['row0'] + objects[:, 3] + 10
+    records['col1'] = records['col0'] + objects[:, 2] + 10
+    records['bacillus'] = predictions != 0
+    return records
+
+
+def boxes_to_napari(records):
+    """ Convert box records to rectangles for napari.
+
+    parameters
+    ----------
+    records: numpy structured array
+        box records, with dtype BOX_DTYPE
+
+    returns
+    -------
+    boxes: numpy array
+        rectangles of shape (n, 2, 2)
+    """
+    top_left = np.stack((records['row0'], records['col0']), axis=1)
+    bottom_right = np.stack((records['row1'], records['col1']), axis=1)
+    return np.stack((top_left, bottom_right), axis=1)
+
+
+def save_boxes(records, dataset_name, folder='results'):
+    """ Save the box records of a smear in the results folder.
+
+    parameters
+    ----------
+    records: numpy structured array
+        box records of all the tiles, with dtype BOX_DTYPE
+    dataset_name: str
+        name of the smear or tile
+    folder: str
+        results folder
+
+    returns
+    -------
+    path: str
+        path of the saved .npy file
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, dataset_name + '_boxes.npy')
+    np.save(path, records)
+    return path
+
+
+def cnn_classifier(backend='eager', quantization='none'):
+    """ Get a function that classifies a batch of cropped images with the CNN ensemble.
+
+    parameters
+    ----------
+    backend: str
+        runtime used for the CNN ensemble: eager, torchscript or onnxruntime
+    quantization: str
+        none for the float ensemble, dynamic or static for the INT8 checkpoints
+
+    returns
+    -------
+    classify: callable
+        function mapping cropped images of shape (n, 50, 50) to predictions, 1 for bacilli
+    """
+    # runtimes are cached, so the models are only loaded once
+    runtime = load_runtime(backend, MODEL_DIR, quantization)
+
+    def classify(cropped_images):
+        probabilities = runtime(normalize_crops(cropped_images))
+        return (probabilities > 0.5).astype(float)
+
+    return classify
+
 
 class Inference:
     """ Class to predict the class of the bacilli in the image.
@@ -20,25 +121,32 @@ class Inference:
         list of the stats of the bacilli
     final_image: numpy array
         masked image
+    features: numpy structured array
+        shape features of every object
+    predictions: numpy array
+        predictions of the last prediction method that was called
 
     Methods:
     -------
-    get_dataset()
-        Get the dataset to do inference with the CNN.
     get_boxes(predictions)
         Get the boxes to draw in napari, green for bacilli, red for non-bacilli.
+    get_box_records(predictions, tile)
+        Get the boxes as records that can be saved and shown in napari.
     network_prediction()
         Predict the class of the images, using pretrained neural network.
     stats_prediction()
         Predict the class of the images, using the stats.
     ellipse_brute_prediction()
-        Predict the class of the images, using the contours and finding enclosing ellipse.
+        Predict the class of the images, using the axes of the ellipse with the same moments as every object.
     svm_prediction()
-        Predict the class of the images, using a on the stats pretrained SVM.
+        Predict the class of the images, using a on the shape features pretrained SVM.
     get_hu_moments()
         Get elongation Hu-moment for every object in the image.
+
+    The shape features of the objects are computed once, when the class is
+    initialized, and shared by all the predictions.
     """
-    def __init__(self, cropped_images, stats, final_image):
+    def __init__(self, cropped_images, stats, final_image, backend='eager', quantization='none'):
         """
         parameters:
         ----------
@@ -48,27 +156,20 @@ class Inference:
             list of the stats of the bacilli
         final_image: numpy array
             masked image
+        backend: str
+            runtime used for the CNN ensemble: eager, torchscript or onnxruntime
+        quantization: str
+            none for the float ensemble, dynamic or static for the INT8 checkpoints
         """
         self.final_image = final_image
         self.cropped_images = cropped_images
         self.stats = stats
         # clean stats
         self.stats = clean_stats(self.stats)
-        # load the model
-        self.PATH = os.path.join(os.path.dirname(__file__), 'saved_models', 'model.pth')
-        # initialize the model
-        self.model = ChatGPT()
-        # set parameters
-        self.model.load_state_dict(torch.load(self.PATH))
-        self.models = []
-        for i in range(1, 6):
-            path = os.path.join(os.path.dirname(__file__), 'saved_models', 'model_' + str(i) + '.pth')
-            model_i = BacilliNet()
-            model_i.load_state_dict(torch.load(path, map_location=torch.device('cpu')))
-            self.models.append(model_i)        # get the dataset, with dataset loader
-        dataset = self.get_dataset()
-        inference_dataset = MyDataset(dataset)
-        self.inference_dataset_loader = DataLoader(inference_dataset, batch_size=1, shuffle=False)
+        # shape features of every object, shared by all the predictions
+        self.features = tile_shape_features(final_image)
+        # CNN ensemble
+        self.classify = cnn_classifier(backend, quantization)
 
     def network_prediction(self):
         """ Predict the class of the images, using the neural network,
@@ -81,35 +182,19 @@ class Inference:
         green_boxes: list
             list of the boxes to draw in napari, green for bacilli
         """
-        # initialize prediction array
-        predictions = np.array([])
-
-        # 
-        _, _, coordinates = self.ellipse_brute_prediction()
-
-        # iterate over the dataset and predict the class
-        self.model.eval()
-        with torch.no_grad():
-            for i, data in enumerate(self.inference_dataset_loader):
-                image = data
-                image = image.to(torch.float32)
-                image = image.view(1, 1, 50, 50)
-                outputs = []
-                for i in range(0, 5):
-                    outputs.append(self.models[i](image))
-                output = torch.mean(torch.stack(outputs), dim=0)
-                output = output.squeeze(1)
-                if output > 0.5:
-                    predictions = np.append(predictions, 1)
-                else:
-                    predictions = np.append(predictions, 0)
+        # axes of the ellipses, used for the geometric scatter plot
+        coordinates = np.stack((self.features['major_axis'], self.features['minor_axis']), axis=1)
+
+        # predict the whole tile in a single batched call
+        predictions = self.classify(self.cropped_images)
+        self.predictions = predictions
         # use get_boxes to get the boxes
         red_boxes, green_boxes = self.get_boxes(predictions)
         return red_boxes, green_boxes, coordinates, predictions
 
     def ellipse_brute_prediction(self):
-        """ Find the contours of the bacilli in the image.
-        And find the enclosing ellipse for every bacilli.
+        """ Predict the class of the objects in the image, based on the ellipse
+        with the same second order moments as every object.
 
         returns
         -------
@@ -117,34 +202,21 @@ class Inference:
             list of the boxes to draw in napari, red for non-bacilli
         green_boxes: list
             list of the boxes to draw in napari, green for bacilli
+        axes_coordinates: numpy array
+            major and minor axis of every object
 
         """
-        predictions = np.array([])
-        axes_coordinates = np.empty((0, 2))
-        for i in range(1, self.stats.shape[0]):   #TODO change in module branch
-            fake_contours = np.zeros((5, 1, 2), dtype=np.int32)
-            contours, _ = cv2.findContours(self.final_image[self.stats[i][1]:self.stats[i][1]+self.stats[i][3],
-                            self.stats[i][0]:self.stats[i][0]+self.stats[i][2]], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cnt = max(contours, key=cv2.contourArea)
-            if len(cnt) < 5: 
-                fake_contours[0:len(cnt), :, :] = cnt
-                cnt = fake_contours
-            ellipse = cv2.fitEllipse(cnt)
-            (x, y), (ma, MA), angle = ellipse
-            axes_coordinates = np.append(axes_coordinates, [[MA, ma]], axis=0)
-            if MA/ma > 1.5:
-                predictions = np.append(predictions, 1)
-            else:
-                predictions = np.append(predictions, 0)
-
-            if self.stats[i][4] > 200:
-                predictions[i-1] = 0
+        axes_coordinates = np.stack((self.features['major_axis'], self.features['minor_axis']), axis=1)
+        predictions = (self.features['elongation'] > 1.5).astype(float)
+        # objects that are too large are not bacilli
+        predictions[self.features['area'] > 200] = 0
+        self.predictions = predictions
 
         red_boxes, green_boxes = self.get_boxes(predictions)
         return red_boxes, green_boxes, axes_coordinates
 
     def svm_prediction(self):
-        """ Predict the class of the images, using a svm that was trained on the stats.
+        """ Predict the class of the images, using a svm that was trained on the shape features.
 
         returns
         -------
@@ -153,16 +225,21 @@ class Inference:
         green_boxes: list
             list of the boxes to draw in napari, green for bacilli
         """
-        # drop coordinates from stats
-        self.stats = self.stats[:, 2:]
-        # create a stats dataframe
-        df = pd.DataFrame(self.stats)
-        # load the svm model
-        loaded_model = joblib.load('svm_results/svm.pkl')
-        # predict the class
-        predictions = loaded_model.predict(df)
+        # the model is loaded once and predicts all the objects of the tile in one call
+        predictions = load_svm().predict(self.features)
+        self.predictions = predictions
         return self.get_boxes(predictions)
 
+    def get_hu_moments(self):
+        """ Get the Hu moments of every object in the image.
+
+        returns
+        -------
+        hu_moments: numpy array
+            seven Hu moments for every object
+        """
+        return self.features['hu']
+
     def get_boxes(self, predictions):
         """ Get the boxes to draw in napari, based on the predictions.
 
@@ -173,73 +250,28 @@ class Inference:
 
         returns
         -------
-        red_boxes: list
-            list of the boxes to draw in napari, red for non-bacilli
-        green_boxes: list
-            list of the boxes to draw in napari, green for bacilli
+        red_boxes: numpy array
+            boxes of shape (n, 2, 2) to draw in napari, red for non-bacilli
+        green_boxes: numpy array
+            boxes of shape (n, 2, 2) to draw in napari, green for bacilli
         """
+        records = self.get_box_records(predictions)
+        boxes = boxes_to_napari(records)
+        return boxes[~records['bacillus']], boxes[records['bacillus']]
 
-        red_boxes = np.array([[0, 0], [0, 0]])
-        red_boxes = np.stack((red_boxes, red_boxes), axis=0)
-        green_boxes = np.array([[0, 0], [0, 0]])
-        green_boxes = np.stack((green_boxes, green_boxes), axis=0)
-        # create a rectangle array
-        for i in range(0, predictions.shape[0]):
-            y = self.stats[i+1][0] - 5
-            x = self.stats[i+1][1] - 5
-            w = self.stats[i+1][3]
-            h = self.stats[i+1][2]
-            if predictions[i] == 0:
-                red_boxes = np.concatenate((red_boxes, [np.array([[x, y], [x + w + 10, y + h + 10]])]), axis=0)
-
-            else:
-                green_boxes = np.concatenate((green_boxes, [np.array([[x, y], [x + w + 10, y + h + 10]])]), axis=0)
-        # remove first two by two matrix that where added to initialize the array
-        red_boxes = np.delete(red_boxes, 0, axis=0)
-        red_boxes = np.delete(red_boxes, 0, axis=0)
-        green_boxes = np.delete(green_boxes, 0, axis=0)
-        green_boxes = np.delete(green_boxes, 0, axis=0)
-        return red_boxes, green_boxes
-
-    def get_dataset(self):
-        """Create a dataset from the cropped images, to be used in the neural network.
+    def get_box_records(self, predictions, tile=0):
+        """ Get the box records of the objects, see box_records.
+
+        parameters
+        ----------
+        predictions: numpy array
+            array of predictions
+        tile: int
+            index of the tile in the smear
 
         returns
         -------
-        dataframe: pandas dataframe
-            dataframe with the cropped images
+        records: numpy structured array
+            one record per prediction, with dtype BOX_DTYPE
         """
-        dataframe = pd.DataFrame()
-        for i in range(0, self.cropped_images.shape[0]):
-            d = {'image': [self.cropped_images[i]]}
-            df2 = pd.DataFrame(d)
-            dataframe = pd.concat([dataframe, df2], ignore_index=True)
-        return dataframe
-
-
-class MyDataset(Dataset):
-    """ Dataset class for the neural network.
-
-    parameters
-    ----------
-    data: pandas dataframe
-        dataframe with the cropped images
-
-    returns
-    -------
-    torch tensor:
-        tensor with the cropped images
-    """
-    def __init__(self, data):
-        self.data = data
-
-    def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, index):
-        img = self.data.iloc[index]['image']
-        # change image values to be in 0,1 range instead of 0, 16000
-        if np.max(img) - np.min(img) != 0:
-            img = (img - np.min(img)) / (np.max(img) - np.min(img)) - 0.5
-            # img = img / 16000
-        return torch.tensor(img, dtype=torch.float32)
+        return box_records(self.stats, predictions, tile)
@@ -2,55 +2,12 @@ from tkinter import *
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
-from PIL import Image
 
+from src.contrast import change_contrast
 
-def rescale_image(image):
-    """ Rescale image to range 0-255
 
-    parameters
-    ----------
-    image:
-        image to be rescaled
-
-    returns
-    -------
-    image:
-        rescaled image
-    """
-    image = image - np.min(image)
-    image = image / np.max(image)
-    image = image * 255
-    return image
-
-
-def change_contrast(image, level):
-    """ Change the contrast of an image.
-
-    parameters
-    ----------
-    image:
-        image to be changed
-    level:
-        level of contrast change
-
-    returns
-    -------
-    image:
-        image with changed contrast
-    """
-    # rescale image
-    image = np.uint8(rescale_image(image))
-    # create image object
-    image = Image.fromarray(image)
-    # define contrast level
-    factor = (259 * (level + 255)) / (255 * (259 - level))
-
-    # function that applies the contrast change
-    def contrast(c):
-        return 128 + factor * (c - 128)
-
-    return image.point(contrast)
+# contrast levels of the previews shown next to the original crop
+PREVIEW_LEVELS = (100, 50, -100)
 
 
 class InteractiveLabeling:
@@ -88,6 +45,8 @@ class InteractiveLabeling:
         self.labels = np.array([])
         self.window = Tk()
         self.max_images = images.shape[0]
+        # contrast previews of all the crops, computed at once with a lookup table per level
+        self.previews = {level: change_contrast(images, level) for level in PREVIEW_LEVELS}
 
     def run(self):
         """ Run the interactive labeling window
@@ -158,12 +117,9 @@ class InteractiveLabeling:
         self.fig, (ax1, ax2) = plt.subplots(2, 2, figsize=(13, 10))
         # plot images
         ax1[0].imshow(self.images[i], cmap='gray')
-        im2 = change_contrast(self.images[i], 100)
-        ax2[0].imshow(im2, cmap='gray')
-        im3 = change_contrast(self.images[i], 50)
-        ax1[1].imshow(im3, cmap='gray')
-        im4 = change_contrast(self.images[i], -100)
-        ax2[1].imshow(im4, cmap='gray')
+        ax2[0].imshow(self.previews[100][i], cmap='gray')
+        ax1[1].imshow(self.previews[50][i], cmap='gray')
+        ax2[1].imshow(self.previews[-100][i], cmap='gray')
         # draw figure
         canvas = FigureCanvasTkAgg(self.fig, master=self.window)
         canvas.get_tk_widget().grid(row=6, column=3)
@@ -0,0 +1,226 @@
+"""
+Labelling session over all the crops of a smear.
+
+A single window and a single matplotlib canvas are used for the whole
+session: the four images (original crop and three contrast previews) are
+created once and only their data is replaced when the next crop is shown.
+The contrast previews of the upcoming crops are rendered in a background
+thread, so a click or a key press only swaps arrays.
+
+Every label is saved to disk as soon as it is given, keyed by the pixels of
+the crop, so a session that is closed or crashes resumes at the first crop
+that is not labelled yet.
+
+Keyboard shortcuts:
+    b, 1, right arrow   bacillus
+    n, 0, left arrow    not a bacillus
+    u, backspace        undo the last label
+    q, escape           quit, the labels given so far are kept
+"""
+import os
+import threading
+from tkinter import *
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from src.contrast import change_contrast
+from src.crop_store import UNLABELLED, crop_keys
+from src.interactivelabelling import PREVIEW_LEVELS
+
+KEYS = {'b': 1, '1': 1, 'Right': 1, 'n': 0, '0': 0, 'Left': 0}
+UNDO_KEYS = ('u', 'BackSpace')
+QUIT_KEYS = ('q', 'Escape')
+
+
+class LabellingSession:
+    """ Label the crops of a crop store in one window, with prefetching and autosave.
+
+    attributes
+    ----------
+    store: CropStore
+        crops to be labelled
+    path: str
+        .npz file where the labels are saved after every click
+    labels: numpy array
+        label of every crop, 1 for bacilli, 0 for not bacilli, UNLABELLED otherwise
+    prefetch: int
+        number of upcoming crops whose previews are rendered in advance
+
+    methods
+    -------
+    run()
+        open the window and label the crops that are not labelled yet
+    label(value)
+        label the current crop and show the next one
+    undo()
+        remove the last label and show its crop again
+    """
+    def __init__(self, store, path, prefetch=64):
+        """
+        parameters
+        ----------
+        store: CropStore
+            crops to be labelled
+        path: str
+            .npz file of the labels, the labels it contains are reused to resume a session
+        prefetch: int
+            number of upcoming crops whose previews are rendered in advance
+        """
+        self.store = store
+        self.path = path
+        self.prefetch = prefetch
+        self.keys = crop_keys(store.images)
+        self.labels = np.full(len(store), UNLABELLED, dtype=np.float32)
+        self.history = []
+        self._resume()
+        self.current = self._next_unlabelled(0)
+
+        # previews rendered by the background thread, by crop position
+        self._previews = {}
+        self._rendered = self.current
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def _resume(self):
+        """ Reuse the saved labels of the crops that are in the store. """
+        if not os.path.exists(self.path):
+            return
+        saved = np.load(self.path)
+        order = np.argsort(saved['keys'])
+        keys, labels = saved['keys'][order], saved['labels'][order]
+        if keys.shape[0] == 0:
+            return
+        positions = np.minimum(np.searchsorted(keys, self.keys), keys.shape[0] - 1)
+        found = keys[positions] == self.keys
+        self.labels[found] = labels[positions[found]]
+        print("Resumed session, labelled crops: ", int(np.count_nonzero(self.labels != UNLABELLED)))
+
+    def _save(self):
+        """ Save the labels, the previous file is replaced only once the new one is written. """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = self.path + '.tmp.npz'
+        np.savez(temporary, keys=self.keys, labels=self.labels)
+        os.replace(temporary, self.path)
+
+    def _next_unlabelled(self, start):
+        unlabelled = np.flatnonzero(self.labels[start:] == UNLABELLED)
+        return start + int(unlabelled[0]) if unlabelled.shape[0] else len(self.store)
+
+    def _render(self, start, stop):
+        """ Original crops and contrast previews of the crops start ... stop - 1. """
+        images = np.asarray(self.store.images[start:stop])
+        previews = [change_contrast(images, level) for level in PREVIEW_LEVELS]
+        return {start + j: (images[j],) + tuple(preview[j] for preview in previews) for j in range(stop - start)}
+
+    def _prefetch_loop(self):
+        """ Render the previews of the upcoming crops until the session is closed. """
+        while True:
+            with self._condition:
+                while not self._stopped and self._rendered >= min(self.current + self.prefetch, len(self.store)):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                start = max(self._rendered, self.current)
+                stop = min(self.current + self.prefetch, len(self.store))
+            rendered = self._render(start, stop)
+            with self._condition:
+                # drop the previews of the crops that were already labelled
+                self._previews = {i: p for i, p in self._previews.items() if i >= self.current - 1}
+                self._previews.update(rendered)
+                self._rendered = stop
+                self._condition.notify_all()
+
+    def _images(self, i):
+        with self._condition:
+            images = self._previews.get(i)
+        return images if images is not None else self._render(i, i + 1)[i]
+
+    def _show(self):
+        """ Show the current crop by replacing the data of the images of the canvas. """
+        if self.current >= len(self.store):
+            self.window.destroy()
+            return
+        for axis_image, image in zip(self.axis_images, self._images(self.current)):
+            axis_image.set_data(image)
+            axis_image.set_clim(image.min(), image.max())
+        self.progress.configure(text=f"{self.current + 1} / {len(self.store)}")
+        self.canvas.draw_idle()
+
+    def label(self, value):
+        """ Label the current crop, save the labels and show the next crop that is not labelled. """
+        if self.current >= len(self.store):
+            return
+        self.labels[self.current] = value
+        self.history.append(self.current)
+        self._save()
+        with self._condition:
+            self.current = self._next_unlabelled(self.current + 1)
+            self._condition.notify_all()
+        self._show()
+
+    def undo(self):
+        """ Remove the last label of the session and show its crop again. """
+        if not self.history:
+            return
+        with self._condition:
+            self.current = self.history.pop()
+            self._condition.notify_all()
+        self.labels[self.current] = UNLABELLED
+        self._save()
+        self._show()
+
+    def _key_pressed(self, event):
+        if event.keysym in KEYS:
+            self.label(KEYS[event.keysym])
+        elif event.keysym in UNDO_KEYS:
+            self.undo()
+        elif event.keysym in QUIT_KEYS:
+            self.window.destroy()
+
+    def run(self):
+        """ Open the window and label the crops that are not labelled yet.
+
+        returns
+        -------
+        labels: numpy array
+            label of every crop of the store, UNLABELLED for the crops that were skipped by quitting
+        """
+        if self.current >= len(self.store):
+            return self.labels
+
+        # create window
+        self.window = Tk()
+        self.window.title("Interactive Labeling")
+        self.window.geometry('1200x1000')
+        self.window.configure(background='white')
+        # create buttons
+        Button(self.window, text="Bacilli (b)", command=lambda: self.label(1)).grid(column=3, row=0)
+        Button(self.window, text="Not a Bacilli (n)", command=lambda: self.label(0)).grid(column=3, row=1)
+        Button(self.window, text="Undo (u)", command=self.undo).grid(column=3, row=2)
+        Button(self.window, text="Finish (q)", command=self.window.destroy).grid(column=3, row=3)
+        self.progress = Label(self.window, background='white')
+        self.progress.grid(column=3, row=4)
+        self.window.bind('<Key>', self._key_pressed)
+
+        # one figure for the whole session, only the data of the images changes
+        fig, axes = plt.subplots(2, 2, figsize=(13, 10))
+        placeholder = np.zeros(self.store.images.shape[1:])
+        self.axis_images = [axis.imshow(placeholder, cmap='gray') for axis in (axes[0, 0], axes[1, 0], axes[0, 1],
+                                                                               axes[1, 1])]
+        self.canvas = FigureCanvasTkAgg(fig, master=self.window)
+        self.canvas.get_tk_widget().grid(row=6, column=3)
+
+        prefetcher = threading.Thread(target=self._prefetch_loop, daemon=True)
+        prefetcher.start()
+        try:
+            self._show()
+            self.window.mainloop()
+        finally:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            prefetcher.join()
+            plt.close(fig)
+        return self.labels
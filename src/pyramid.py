@@ -0,0 +1,242 @@
+"""
+Multiscale pyramid of a whole smear, for lazy viewing in napari.
+
+The tiles of the smear (MYX, as cached in h5_data/ by the Loader) are
+stitched into a single mosaic with the stage positions stored in the CZI
+file, one tile at a time, and written to an HDF5 file as chunked levels
+that are 2x smaller each:
+
+    image/0, image/1, ...      mosaic, mean of 2x2 pixels per level
+    labels/0, labels/1, ...    box outlines, 1 for non-bacilli and 2 for bacilli,
+                               max of 2x2 pixels per level so they stay visible
+    boxes                      boxes of the detections in mosaic coordinates, (n, 2, 2)
+    bacillus                   whether every box is a bacillus
+
+napari reads only the chunks of the level that is on screen, so a whole
+slide with its detections can be browsed without loading every tile.
+
+The script can be run from the command line as follows:
+   python -m src.pyramid TB_sample/extern_Synlab_2156_17_3_MTB.czi --view
+"""
+import argparse
+import os
+
+import h5py
+import numpy as np
+from aicsimageio.readers import CziReader
+
+from src.inference_visualization import BOX_DTYPE, boxes_to_napari
+from src.loader import Loader
+
+# values of the label layer
+NOT_BACILLUS, BACILLUS = 1, 2
+
+
+def arguments_parser():
+    """
+    Parse arguments from the command line
+    """
+    parser = argparse.ArgumentParser('Build the multiscale pyramid of a smear')
+    parser.add_argument('czi_path', type=str, help='path to the czi file of the smear')
+    parser.add_argument('--boxes', type=str, default=None,
+                        help='box records saved by the pipeline, results/<smear>_boxes.npy if it exists when None')
+    parser.add_argument('--output', type=str, default=None, help='pyramid file, results/<smear>_pyramid.h5 if None')
+    parser.add_argument('--chunk', type=int, default=512, help='size of the square chunks of every level')
+    parser.add_argument('--view', action='store_true', help='open the pyramid in napari once it is built')
+    return parser
+
+
+def tile_positions(czi_path):
+    """ Top left (row, column) of every tile in the mosaic, from the stage positions of the czi file.
+
+    parameters
+    ----------
+    czi_path: str
+        path to the czi file
+
+    returns
+    -------
+    positions: numpy array
+        int64 array of shape (number of tiles, 2), the smallest row and column are 0
+    """
+    positions = np.asarray(CziReader(czi_path).get_mosaic_tile_positions(C=0), dtype=np.int64)
+    return positions - positions.min(axis=0)
+
+
+def draw_outlines(labels, records):
+    """ Draw the outlines of boxes on a label array, bacilli over non-bacilli.
+
+    Boxes that cross the border of the array are cut: only the spans of their
+    edges inside the array are drawn, and an edge that lies outside is not drawn.
+
+    parameters
+    ----------
+    labels: numpy array
+        uint8 label array, modified in place
+    records: numpy structured array
+        box records with dtype BOX_DTYPE, in the coordinates of labels
+    """
+    height, width = labels.shape
+    for value in (NOT_BACILLUS, BACILLUS):
+        selected = records[records['bacillus'] == (value == BACILLUS)]
+        for r0, c0, r1, c1 in zip(selected['row0'], selected['col0'], selected['row1'], selected['col1']):
+            # spans of the edges, clipped to the array
+            rows = slice(max(r0, 0), min(r1, height - 1) + 1)
+            cols = slice(max(c0, 0), min(c1, width - 1) + 1)
+            for row in (r0, r1):
+                if 0 <= row < height:
+                    labels[row, cols] = value
+            for col in (c0, c1):
+                if 0 <= col < width:
+                    labels[rows, col] = value
+
+
+def downsample(level, pool, chunk):
+    """ Write the next, 2x smaller, level of a dataset, one stripe of rows at a time.
+
+    parameters
+    ----------
+    level: h5py dataset
+        current level
+    pool: str
+        mean or max, reduction of every 2x2 block of pixels
+    chunk: int
+        size of the chunks of the new level
+
+    returns
+    -------
+    h5py dataset
+        new level, in the same group as the current one
+    """
+    group = level.parent
+    height, width = (level.shape[0] + 1) // 2, (level.shape[1] + 1) // 2
+    new_level = group.create_dataset(str(int(level.name.split('/')[-1]) + 1), shape=(height, width),
+                                     dtype=level.dtype, chunks=(min(chunk, height), min(chunk, width)),
+                                     compression='lzf')
+    for start in range(0, height, chunk):
+        stripe = level[2 * start:2 * (start + chunk)]
+        # pad odd sizes by repeating the last row or column
+        stripe = np.pad(stripe, ((0, stripe.shape[0] % 2), (0, stripe.shape[1] % 2)), mode='edge')
+        blocks = stripe.reshape(stripe.shape[0] // 2, 2, stripe.shape[1] // 2, 2)
+        if pool == 'mean':
+            reduced = blocks.mean(axis=(1, 3), dtype=np.float64).round()
+        else:
+            reduced = blocks.max(axis=(1, 3))
+        new_level[start:start + reduced.shape[0]] = reduced.astype(level.dtype)
+    return new_level
+
+
+def build_pyramid(tiles, positions, path, records=None, chunk=512):
+    """ Stitch the tiles of a smear and write the multiscale image and label layers.
+
+    parameters
+    ----------
+    tiles: numpy array or h5py dataset
+        tiles of shape (number of tiles, Y, X), read one at a time
+    positions: numpy array
+        top left (row, column) of every tile in the mosaic
+    path: str
+        path of the HDF5 pyramid file
+    records: numpy structured array
+        box records of the smear with dtype BOX_DTYPE, in tile coordinates, or None
+    chunk: int
+        size of the square chunks of every level, the last level fits in one chunk
+
+    returns
+    -------
+    levels: int
+        number of levels of the pyramid
+    """
+    tile_height, tile_width = tiles.shape[1:]
+    shape = (int(positions[:, 0].max()) + tile_height, int(positions[:, 1].max()) + tile_width)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with h5py.File(path, 'w') as f:
+        chunks = (min(chunk, shape[0]), min(chunk, shape[1]))
+        image = f.create_group('image').create_dataset('0', shape=shape, dtype=tiles.dtype, chunks=chunks,
+                                                       compression='lzf')
+        labels = f.create_group('labels').create_dataset('0', shape=shape, dtype=np.uint8, chunks=chunks,
+                                                         compression='lzf')
+        f.attrs['tile_positions'] = positions
+
+        if records is None:
+            records = np.empty(0, dtype=BOX_DTYPE)
+        # sort the records by tile once, the boxes of every tile are then a slice
+        records = records[np.argsort(records['tile'], kind='stable')]
+        bounds = np.searchsorted(records['tile'], np.arange(tiles.shape[0] + 1))
+        for m in range(tiles.shape[0]):
+            row, col = positions[m]
+            image[row:row + tile_height, col:col + tile_width] = tiles[m]
+            tile_records = records[bounds[m]:bounds[m + 1]]
+            if tile_records.shape[0]:
+                region = labels[row:row + tile_height, col:col + tile_width]
+                draw_outlines(region, tile_records)
+                labels[row:row + tile_height, col:col + tile_width] = region
+
+        # boxes in mosaic coordinates, for a shapes layer
+        mosaic_records = records.copy()
+        for corner in ('row0', 'row1'):
+            mosaic_records[corner] += positions[records['tile'], 0].astype(np.int32)
+        for corner in ('col0', 'col1'):
+            mosaic_records[corner] += positions[records['tile'], 1].astype(np.int32)
+        f.create_dataset('boxes', data=boxes_to_napari(mosaic_records).astype(np.int32))
+        f.create_dataset('bacillus', data=mosaic_records['bacillus'])
+
+        levels = 1
+        while max(image.shape) > chunk:
+            image = downsample(image, 'mean', chunk)
+            labels = downsample(labels, 'max', chunk)
+            levels += 1
+        f.attrs['levels'] = levels
+    return levels
+
+
+def view_pyramid(path):
+    """ Open a pyramid in napari, the levels are read lazily with dask.
+
+    parameters
+    ----------
+    path: str
+        path of the HDF5 pyramid file
+    """
+    # only needed for viewing, building a pyramid works without a display
+    import dask.array as da
+    import napari
+
+    with h5py.File(path, 'r') as f:
+        levels = int(f.attrs['levels'])
+        image = [da.from_array(f['image'][str(k)], chunks=f['image'][str(k)].chunks) for k in range(levels)]
+        labels = [da.from_array(f['labels'][str(k)], chunks=f['labels'][str(k)].chunks) for k in range(levels)]
+        viewer = napari.Viewer()
+        viewer.add_image(image, multiscale=True, name='smear', colormap='gray')
+        viewer.add_labels(labels, multiscale=True, name='detections')
+        boxes, bacillus = f['boxes'][:], f['bacillus'][:]
+        if boxes.shape[0]:
+            viewer.add_shapes(boxes[~bacillus], shape_type='rectangle', edge_color='red', face_color='transparent',
+                              name='non-bacilli', visible=False)
+            viewer.add_shapes(boxes[bacillus], shape_type='rectangle', edge_color='green', face_color='transparent',
+                              name='bacilli', visible=False)
+        napari.run()
+
+
+def main():
+    parser = arguments_parser()
+    pars_arg = parser.parse_args()
+    loader = Loader(pars_arg.czi_path, 'None')
+    h5_path = os.path.join('h5_data', loader.dataset_name + '.h5')
+    if not os.path.isfile(h5_path):
+        # the loader caches the tiles of the smear in h5_data/
+        loader.load()
+
+    boxes_path = pars_arg.boxes or os.path.join('results', loader.dataset_name + '_boxes.npy')
+    records = np.load(boxes_path) if os.path.isfile(boxes_path) else None
+    output = pars_arg.output or os.path.join('results', loader.dataset_name + '_pyramid.h5')
+    with h5py.File(h5_path, 'r') as f:
+        levels = build_pyramid(f[loader.dataset_name], tile_positions(pars_arg.czi_path), output, records,
+                               pars_arg.chunk)
+    print(f"Pyramid with {levels} levels saved in: {output}")
+    if pars_arg.view:
+        view_pyramid(output)
+
+
+if __name__ == '__main__':
+    main()
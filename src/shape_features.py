@@ -0,0 +1,139 @@
+"""
+Shape features of the connected components of a binarized tile.
+
+All features are computed at once for every label of the label image, from
+image moments that are aggregated per label with np.bincount, instead of
+finding the contour of every component and fitting an ellipse to it.
+
+The features of a component are:
+    - area, width and height, as in the stats of cv.connectedComponentsWithStats
+    - major_axis and minor_axis: full lengths of the axes of the ellipse with
+      the same second order moments as the component
+    - elongation: major_axis / minor_axis
+    - orientation: angle of the major axis with the x axis, in degrees
+    - hu: the seven Hu moments
+
+feature_matrix flattens them into one float32 row per component, in the
+order of FEATURE_NAMES, for the classifiers.
+"""
+import cv2 as cv
+import numpy as np
+from src.utils import clean_stats_mask
+
+SHAPE_FEATURES_DTYPE = np.dtype([('area', np.float32), ('width', np.float32), ('height', np.float32),
+                                 ('major_axis', np.float32), ('minor_axis', np.float32),
+                                 ('elongation', np.float32), ('orientation', np.float32),
+                                 ('hu', np.float32, (7,))])
+
+# columns of feature_matrix, the orientation is left out since it does not depend on the shape
+FEATURE_NAMES = ('area', 'width', 'height', 'major_axis', 'minor_axis', 'elongation') + \
+                tuple(f'hu{i}' for i in range(7))
+
+
+def shape_features(labels_im, stats):
+    """ Compute the shape features of every label of a label image.
+
+    parameters
+    ----------
+    labels_im: numpy array
+        label image from cv.connectedComponentsWithStats
+    stats: numpy array
+        stats from cv.connectedComponentsWithStats, one row per label
+
+    returns
+    -------
+    features: numpy structured array
+        features of every label, with dtype SHAPE_FEATURES_DTYPE
+    """
+    num_labels = stats.shape[0]
+    # coordinates and labels of the foreground pixels
+    foreground = np.flatnonzero(labels_im)
+    labels = labels_im.ravel()[foreground]
+    y, x = np.divmod(foreground, labels_im.shape[1])
+
+    def aggregate(weights=None):
+        return np.bincount(labels, weights=weights, minlength=num_labels)
+
+    m00 = aggregate().astype(np.float64)
+    area = np.maximum(m00, 1)
+    # centroids, then central moments up to the third order
+    dx = x - (aggregate(x) / area)[labels]
+    dy = y - (aggregate(y) / area)[labels]
+    mu20, mu02, mu11 = aggregate(dx * dx), aggregate(dy * dy), aggregate(dx * dy)
+    mu30, mu03 = aggregate(dx ** 3), aggregate(dy ** 3)
+    mu21, mu12 = aggregate(dx * dx * dy), aggregate(dx * dy * dy)
+
+    # eigenvalues of the covariance matrix, every pixel is a unit square with variance 1/12
+    common = np.sqrt(4 * mu11 ** 2 + (mu20 - mu02) ** 2)
+    lambda1 = (mu20 + mu02 + common) / (2 * area) + 1 / 12
+    lambda2 = np.maximum((mu20 + mu02 - common) / (2 * area), 0) + 1 / 12
+
+    # normalized central moments
+    def eta(mu, order):
+        return mu / area ** (1 + order / 2)
+
+    n20, n02, n11 = eta(mu20, 2), eta(mu02, 2), eta(mu11, 2)
+    n30, n03, n21, n12 = eta(mu30, 3), eta(mu03, 3), eta(mu21, 3), eta(mu12, 3)
+    a, b = n30 + n12, n21 + n03
+    hu = np.stack([
+        n20 + n02,
+        (n20 - n02) ** 2 + 4 * n11 ** 2,
+        (n30 - 3 * n12) ** 2 + (3 * n21 - n03) ** 2,
+        a ** 2 + b ** 2,
+        (n30 - 3 * n12) * a * (a ** 2 - 3 * b ** 2) + (3 * n21 - n03) * b * (3 * a ** 2 - b ** 2),
+        (n20 - n02) * (a ** 2 - b ** 2) + 4 * n11 * a * b,
+        (3 * n21 - n03) * a * (a ** 2 - 3 * b ** 2) - (n30 - 3 * n12) * b * (3 * a ** 2 - b ** 2),
+    ], axis=1)
+
+    features = np.zeros(num_labels, dtype=SHAPE_FEATURES_DTYPE)
+    features['area'] = stats[:, 4]
+    features['width'] = stats[:, 2]
+    features['height'] = stats[:, 3]
+    features['major_axis'] = 4 * np.sqrt(lambda1)
+    features['minor_axis'] = 4 * np.sqrt(lambda2)
+    features['elongation'] = features['major_axis'] / features['minor_axis']
+    features['orientation'] = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+    features['hu'] = hu
+    return features
+
+
+def tile_shape_features(final_image):
+    """ Compute the shape features of the objects of a binarized tile.
+
+    The objects are the same, and in the same order, as the cropped images
+    and the boxes: the cleaned connected components without the first one.
+
+    parameters
+    ----------
+    final_image: numpy array
+        binarized and cleaned tile
+
+    returns
+    -------
+    features: numpy structured array
+        features of every object, with dtype SHAPE_FEATURES_DTYPE
+    """
+    num_labels, labels_im, stats, centroids = cv.connectedComponentsWithStats(np.uint8(final_image), connectivity=8)
+    features = shape_features(labels_im, stats)
+    return features[clean_stats_mask(stats)][1:]
+
+
+def feature_matrix(features):
+    """ Flatten shape features into one fixed-size float32 row per component.
+
+    parameters
+    ----------
+    features: numpy structured array
+        features with dtype SHAPE_FEATURES_DTYPE
+
+    returns
+    -------
+    matrix: numpy array
+        float32 array of shape (number of components, len(FEATURE_NAMES))
+    """
+    features = np.asarray(features, dtype=SHAPE_FEATURES_DTYPE).reshape(-1)
+    matrix = np.empty((features.shape[0], len(FEATURE_NAMES)), dtype=np.float32)
+    for i, name in enumerate(FEATURE_NAMES[:6]):
+        matrix[:, i] = features[name]
+    matrix[:, 6:] = features['hu']
+    return matrix
@@ -17,10 +17,57 @@ from src.utils import *
 from src.thresholding import Thresholding
 from src.postprocessing import Postprocessing
 from src.cropping import Cropping
-from src.interactivelabelling import InteractiveLabeling
+from src.labelling_session import LabellingSession
+from src.crop_store import CropStore, UNLABELLED
 import pandas as pd
 import os
-from src.inference_visualization import Inference
+from src.inference_visualization import Inference, cnn_classifier, box_records, save_boxes, BOX_DTYPE
+from src.inference_queue import InferenceQueue
+from src.shape_features import tile_shape_features, feature_matrix
+from n_networks.stats_svm import load_svm
+
+def label_smear(labelling_crops, save_config, dataset_name):
+    """ Label the crops of all the tiles of a smear in one session and save one dataset per tile.
+
+    The labels are saved after every click in labelled_data/<dataset_name>_session.npz,
+    so an interrupted session resumes where it stopped. Only the labelled crops are
+    added to the datasets.
+
+    parameters
+    ----------
+    labelling_crops: list
+        tuples (tile index, cropped images, stats, shape features) of the tiles to be labelled
+    save_config: dict
+        'saving' section of the config
+    dataset_name: str
+        name of the smear
+    """
+    tiles = np.concatenate([np.full(crops.shape[0], tile) for tile, crops, _, _ in labelling_crops])
+    store = CropStore(np.concatenate([crops for _, crops, _, _ in labelling_crops]))
+    session = LabellingSession(store, os.path.join('labelled_data', dataset_name + '_session.npz'))
+    labels = session.run()
+
+    for tile, cropped_images, stats, features in labelling_crops:
+        tile_labels = labels[tiles == tile]
+        labelled = tile_labels != UNLABELLED
+        if not labelled.any():
+            continue
+        if save_config['save']:
+            # save dataframe with pandas library
+            # the feature vectors are used to train the SVM, see n_networks/stats_svm.py
+            dataframe = pd.DataFrame({'image': list(cropped_images[labelled]), 'label': tile_labels[labelled],
+                                      'stats': list(stats[:cropped_images.shape[0]][labelled]),
+                                      'features': list(feature_matrix(features[:cropped_images.shape[0]])[labelled])})
+            labelled_data_path = os.path.join('labelled_data', dataset_name + str(tile) + '.pkl')
+            dataframe.to_pickle(labelled_data_path)
+            print("Dataset saved in: " + labelled_data_path)
+        if save_config['save_stats']:
+            # create dataframe with stats for each sample then save it as a .pkl file
+            stats_dataframe = pd.DataFrame(stats)
+            stats_dataframe_path = os.path.join('labelled_data', 'stats_' + dataset_name + str(tile) + '.pkl')
+            stats_dataframe.to_pickle(stats_dataframe_path)
+            print("Stats saved in: " + stats_dataframe_path)
+
 
 def smear_pipeline(config, smear, loader):
     """This function is the main pipeline for the applying the
@@ -44,8 +91,26 @@ def smear_pipeline(config, smear, loader):
     """
     total_number_bacilli = 0
     number_of_predicted_bacilli = 0
+
+    # the CNN classifies the crops of many tiles at once, in full batches
+    inference_config = config['inference']
+    inference_queue = None
+    if inference_config['do_inference'] and inference_config['prediction'] == 'CNN':
+        classify = cnn_classifier(inference_config['backend'], inference_config['quantization'])
+        inference_queue = InferenceQueue(classify, inference_config['batch_size'], inference_config['max_latency'])
+    # box records of every tile, and the stats needed to build them once the queue is closed
+    records = []
+    tile_stats = {}
+    # the SVM classifies the shape features of the whole smear in a single call, once every tile is processed
+    svm_features = {}
+    # tile index, crops and stats of the tiles to be labelled
+    labelling_crops = []
+
     for i, img in enumerate(smear):  
         print("Tile: ", i)
+        if inference_queue is not None:
+            # flush the crops that waited too long before the work on the next tile
+            inference_queue.poll()
 
         # Preprocess
         preprocess_config = config['preprocessing']
@@ -89,47 +154,51 @@ def smear_pipeline(config, smear, loader):
             labelling_dataset_config = config['labelling_dataset']
             if labelling_dataset_config['create_dataset'] and postprocessing_config['crop']:
                 if stats.shape[0] > 1:
-                    i_l = InteractiveLabeling(cropped_images)
-                    labels = i_l.run()
-
-                    # dataset creation
-                    dataframe = pd.DataFrame()
-                    for l in range(0, cropped_images.shape[0]):
-                        # le stats coincidono con le immagini ?
-                        d = {'image': [cropped_images[l]], 'label': [labels[l]], 'stats': [stats[l]]}
-                        df2 = pd.DataFrame(d)
-                        dataframe = pd.concat([dataframe, df2], ignore_index=True)
-
-                    # save the images
-
-                    if save_config['save']:
-                        # save dataframe with pandas library
-                        labelled_data_path = os.path.join('labelled_data', loader.dataset_name + str(i) + '.pkl')
-                        dataframe.to_pickle(labelled_data_path)
-                        print("Dataset saved in: " + labelled_data_path)
-                    if save_config['save_stats']:
-                        # create dataframe with stats for each sample then save it as a .pkl file
-                        stats_dataframe = pd.DataFrame(stats)
-                        stats_dataframe_path = os.path.join('labelled_data', 'stats_' + loader.dataset_name + str(i) + '.pkl')
-                        stats_dataframe.to_pickle(stats_dataframe_path)
-                        print("Stats saved in: " + stats_dataframe_path)
-
+                    # the crops of all the tiles are labelled in a single session once the smear is processed
+                    labelling_crops.append((i, cropped_images, stats, tile_shape_features(final_image)))
                 else:
                     num_bacilli = 0
 
 
             if inference_config['do_inference']:
                 print("Inference...")
-                # do one of the possible inference
-                inference = Inference(cropped_images, stats, final_image)
-                if inference_config['prediction'] == 'SVM':
-                    red_boxes, green_boxes = inference.svm_prediction()
-                elif inference_config['prediction'] == 'CNN':
-                    red_boxes, green_boxes, coordinates, predictions = inference.network_prediction()
-                    number_of_predicted_bacilli += green_boxes.shape[0]
+                if inference_config['prediction'] == 'CNN':
+                    # predictions are collected once the queue is closed
+                    inference_queue.put(i, cropped_images)
+                    tile_stats[i] = stats
+                elif inference_config['prediction'] == 'SVM':
+                    # predictions are made once the smear is processed
+                    svm_features[i] = tile_shape_features(final_image)
+                    tile_stats[i] = stats
                 elif inference_config['prediction'] == 'STATS':
+                    inference = Inference(cropped_images, stats, final_image, inference_config['backend'],
+                                          inference_config['quantization'])
                     red_boxes, green_boxes, coordinates = inference.ellipse_brute_prediction()
-
+                    records.append(inference.get_box_records(inference.predictions, i))
+
+    if inference_queue is not None:
+        # classify the remaining crops, then count the bacilli of every tile
+        predictions = inference_queue.close()
+        for tile, tile_predictions in predictions.items():
+            number_of_predicted_bacilli += int(np.count_nonzero(tile_predictions))
+            records.append(box_records(tile_stats[tile], tile_predictions, tile))
+
+    if svm_features:
+        # classify the objects of all the tiles at once, then split the predictions by tile
+        predictions = load_svm().predict(np.concatenate(list(svm_features.values())))
+        bounds = np.cumsum([features.shape[0] for features in svm_features.values()])[:-1]
+        # as in the per-tile pipeline, only the CNN predictions are counted
+        for tile, tile_predictions in zip(svm_features, np.split(predictions, bounds)):
+            records.append(box_records(tile_stats[tile], tile_predictions, tile))
+
+    if labelling_crops:
+        label_smear(labelling_crops, config['saving'], loader.dataset_name)
+
+    if inference_config['do_inference'] and config['saving']['save_boxes']:
+        # save the boxes of the whole smear, they can be shown in napari with boxes_to_napari
+        records = np.concatenate(records) if records else np.empty(0, dtype=BOX_DTYPE)
+        boxes_path = save_boxes(records, loader.dataset_name)
+        print("Boxes saved in: " + boxes_path)
 
     print("Total number of supposed bacilli: ", total_number_bacilli)
     return number_of_predicted_bacilli
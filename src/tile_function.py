@@ -22,6 +22,7 @@ from src.postprocessing import Postprocessing
 from src.cropping import Cropping
 from src.interactivelabelling import InteractiveLabeling
 from src.inference_visualization import Inference
+from src.shape_features import tile_shape_features, feature_matrix
 from src.visualization import visualize_all_list_napari, add_bounding_boxes
 from matplotlib.lines import Line2D
 
@@ -53,9 +54,6 @@ def tile_pipeline(config, img, loader):
     whole_img_not_cleaned, final_image, num_bacilli, stats = postprocess.apply()
     stats = clean_stats(stats)
 
-    # bounding boxes
-    image_boxes = add_bounding_boxes(img, stats)
-
     # Defining the configs for the different steps
     labelling_dataset_config = config['labelling_dataset']
     save_config = config['saving']
@@ -76,10 +74,11 @@ def tile_pipeline(config, img, loader):
             i_l = InteractiveLabeling(cropped_images)
             labels = i_l.run()
 
-            # dataset creation
+            # dataset creation, with the feature vectors used to train the SVM
+            features = feature_matrix(tile_shape_features(final_image))
             dataframe = pd.DataFrame()
             for i in range(0, labels.shape[0]):
-                d = {'image': [cropped_images[i]], 'label': [labels[i]], 'stats': [stats[i]]}
+                d = {'image': [cropped_images[i]], 'label': [labels[i]], 'stats': [stats[i]], 'features': [features[i]]}
                 df2 = pd.DataFrame(d)
                 dataframe = pd.concat([dataframe, df2], ignore_index=True)
 
@@ -102,7 +101,8 @@ def tile_pipeline(config, img, loader):
         if inference_config['do_inference']:
             print("Inference...")
             # do one of the possible inference
-            inference = Inference(cropped_images, stats, final_image)
+            inference = Inference(cropped_images, stats, final_image, inference_config['backend'],
+                                  inference_config['quantization'])
             if inference_config['prediction'] == 'SVM':
                 red_boxes, green_boxes = inference.svm_prediction()
             elif inference_config['prediction'] == 'CNN':
@@ -154,6 +154,8 @@ def tile_pipeline(config, img, loader):
     visualization_config = config['visualization']
     show = visualization_config['show']
     if show:
+        # bounding boxes, only drawn when they are shown
+        image_boxes = add_bounding_boxes(img, stats)
         if preprocess_config['algorithm'] == 'rescale':
             images = [img, whole_img_not_cleaned, final_image, image_boxes]
             strings_names = ['original', 'binarized', 'cleaned binarized', 'original w/ boxes']
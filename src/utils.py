@@ -60,6 +60,20 @@ def preprocess(preprocess_config, tile):
         return preprocessing.rescale()
 
 
+def clean_stats_mask(stats):
+    """Find the connected components that are neither too small nor too large.
+
+    parameters:
+    ----------
+    stats: stats from connected components
+
+    returns:
+    -------
+    mask: boolean array, True for the components kept by clean_stats
+    """
+    return (stats[:, 4] >= 20) & (stats[:, 4] <= 625)
+
+
 def clean_stats(stats):
     """Delete connected components that are too small, and
     connected components that are too large.
@@ -72,18 +86,4 @@ def clean_stats(stats):
     -------
     stats1: cleaned stats
     """
-    # make a copy of stats
-    stats1 = stats.copy()
-    #indices to delete
-    indices = []
-    # delete
-    for i in range(0, stats.shape[0]):
-        if stats[i, 4] > 625:
-            # append index
-            indices.append(i)
-
-        if stats[i, 4] < 20:
-            indices.append(i)
-    # delete
-    stats1 = np.delete(stats1, indices, axis=0)
-    return stats1
+    return stats[clean_stats_mask(stats)]
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.contrast import change_contrast, contrast_lut
+
+
+def pil_change_contrast(image, level):
+    """ Contrast change of one image with PIL, as done before the lookup table. """
+    image = image - np.min(image)
+    image = image / np.max(image)
+    image = np.uint8(image * 255)
+    factor = (259 * (level + 255)) / (255 * (259 - level))
+    return np.asarray(Image.fromarray(image).point(lambda c: 128 + factor * (c - 128)))
+
+
+@pytest.mark.parametrize('level', [-255, -100, -1, 0, 50, 100, 200, 254])
+def test_contrast_lut_matches_pil_point(level):
+    values = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    factor = (259 * (level + 255)) / (255 * (259 - level))
+    expected = np.asarray(Image.fromarray(values).point(lambda c: 128 + factor * (c - 128)))
+
+    assert contrast_lut(level).tobytes() == expected.tobytes()
+
+
+def test_change_contrast_of_stack_matches_pil_per_image():
+    images = np.random.default_rng(0).integers(0, 2 ** 16, (5, 50, 50)).astype(np.uint16)
+
+    changed = change_contrast(images, 100)
+
+    assert changed.dtype == np.uint8
+    for image, result in zip(images, changed):
+        assert result.tobytes() == pil_change_contrast(image, 100).tobytes()
@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+
+from active_learning.coreset_functions import greedy_k_center
+from active_learning.knn_index import KnnIndex
+
+
+def loop_greedy_k_center(vectors, number_of_centers, centers):
+    """ Greedy k-center with the distances to every center recomputed at each step. """
+    centers = list(centers)
+    indexes = []
+    for _ in range(number_of_centers):
+        distances = np.array([[np.linalg.norm(vector - center) for center in centers] for vector in vectors])
+        indexes.append(int(np.argmax(distances.min(1))))
+        centers.append(vectors[indexes[-1]])
+    distances = np.array([[np.linalg.norm(vector - center) for center in centers] for vector in vectors])
+    return np.array(indexes), distances.min(1)
+
+
+def test_greedy_k_center_matches_loop():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 8))
+    centers = rng.normal(size=(3, 8))
+
+    indexes, min_distances = greedy_k_center(vectors, 20, centers)
+    expected_indexes, expected_distances = loop_greedy_k_center(vectors, 20, centers)
+
+    np.testing.assert_array_equal(indexes, expected_indexes)
+    np.testing.assert_allclose(min_distances, expected_distances, rtol=1e-9, atol=1e-9)
+
+
+def test_greedy_k_center_accepts_index_and_tensor():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(200, 4))
+    centers = rng.normal(size=(2, 4))
+    expected_indexes, _ = loop_greedy_k_center(vectors, 10, centers)
+
+    index = KnnIndex(4, exact_size=None, dtype=np.float64).add(centers)
+    assert np.array_equal(greedy_k_center(vectors, 10, index)[0], expected_indexes)
+    assert np.array_equal(greedy_k_center(torch.from_numpy(vectors), 10, centers)[0], expected_indexes)
+
+
+def test_greedy_k_center_without_centers_starts_farthest_from_mean():
+    vectors = np.random.default_rng(2).normal(size=(100, 3))
+
+    indexes, min_distances = greedy_k_center(vectors, 5)
+
+    assert indexes[0] == np.argmax(np.linalg.norm(vectors - vectors.mean(0), axis=1))
+    expected_indexes, expected_distances = loop_greedy_k_center(vectors, 4, vectors[indexes[:1]])
+    np.testing.assert_array_equal(indexes[1:], expected_indexes)
+    np.testing.assert_allclose(min_distances, expected_distances, atol=1e-9)
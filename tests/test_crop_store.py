@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from src.crop_store import UNLABELLED, CropStore, crop_keys
+
+
+def test_crop_keys_depend_on_the_pixels_only():
+    crops = np.random.default_rng(0).integers(0, 2 ** 16, (6, 50, 50)).astype(np.uint16)
+    crops[4] = crops[1]
+
+    keys = crop_keys(crops)
+
+    assert keys.dtype == np.uint64
+    assert keys[4] == keys[1] and len(set(keys.tolist())) == 5
+    np.testing.assert_array_equal(crop_keys(crops[::-1]), keys[::-1])
+    np.testing.assert_array_equal(crop_keys(np.asfortranarray(crops)), keys)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    images = np.random.default_rng(1).integers(0, 2 ** 16, (5, 50, 50)).astype(np.uint16)
+    store = CropStore(images, [1, 0, UNLABELLED, 1, 0], ids=[10, 11, 12, 13, 14])
+
+    store.save(str(tmp_path / 'store'))
+    for mmap in [True, False]:
+        loaded = CropStore.load(str(tmp_path / 'store'), mmap=mmap)
+        np.testing.assert_array_equal(loaded.images, images)
+        np.testing.assert_array_equal(loaded.labels, store.labels)
+        np.testing.assert_array_equal(loaded.ids, store.ids)
+        np.testing.assert_array_equal(crop_keys(loaded.images), crop_keys(images))
+
+    subset = loaded.subset(loaded.labels != UNLABELLED)
+    np.testing.assert_array_equal(subset.ids, [10, 11, 13, 14])
+
+
+def test_dataframe_round_trip():
+    images = np.random.default_rng(2).normal(size=(3, 50, 50))
+    dataframe = pd.DataFrame({'image': list(images), 'label': [1, 0, 1]}, index=[7, 8, 9])
+
+    store = CropStore.from_dataframe(dataframe)
+    result = store.to_dataframe()
+
+    np.testing.assert_array_equal(result.index, [7, 8, 9])
+    np.testing.assert_array_equal(result['label'], [1, 0, 1])
+    np.testing.assert_array_equal(np.stack(result['image'].to_numpy()), images)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.inference_queue import InferenceQueue
+
+
+def test_predictions_are_scattered_back_to_their_tile():
+    rng = np.random.default_rng(0)
+    sizes = [0, 3, 10, 1, 0, 7, 25, 2]
+    tiles = {tile: rng.normal(size=(size, 2)) for tile, size in enumerate(sizes)}
+    batches = []
+
+    def classify(items):
+        batches.append(len(items))
+        return items.sum(1)
+
+    queue = InferenceQueue(classify, batch_size=4, max_latency=60)
+    for tile, items in tiles.items():
+        queue.put(tile, items)
+    predictions = queue.close()
+
+    assert sorted(predictions) == list(tiles)
+    for tile, items in tiles.items():
+        np.testing.assert_allclose(predictions[tile], items.sum(1))
+    # every batch is full except the last one
+    assert batches[:-1] == [4] * (len(batches) - 1) and sum(batches) == sum(sizes)
+
+
+def test_poll_flushes_pending_items_older_than_max_latency():
+    queue = InferenceQueue(lambda items: items * 2.0, batch_size=100, max_latency=0)
+    queue.put(0, np.arange(3))
+    queue.put(1, np.arange(2))
+
+    queue.poll()
+
+    assert queue.number_pending == 0
+    np.testing.assert_array_equal(queue.predictions[0], [0, 2, 4])
+    np.testing.assert_array_equal(queue.predictions[1], [0, 2])
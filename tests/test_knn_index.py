@@ -0,0 +1,37 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from active_learning.knn_index import KnnIndex
+
+
+def test_exact_search_matches_brute_force():
+    rng = np.random.default_rng(0)
+    vectors, queries = rng.normal(size=(500, 16)), rng.normal(size=(40, 16))
+    index = KnnIndex(16, exact_size=None, block_size=16, dtype=np.float64)
+    # added one by one and in blocks, with custom ids
+    for vector in vectors[:100]:
+        index.add(vector[np.newaxis])
+    index.add(vectors[100:], ids=np.arange(100, 500))
+
+    distances, ids = index.search(queries, 5)
+
+    brute_force = cdist(queries, vectors)
+    expected_ids = np.argsort(brute_force, axis=1)[:, :5]
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(distances, np.take_along_axis(brute_force, expected_ids, 1), rtol=1e-9)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    index = KnnIndex(8, exact_size=200, n_lists=8, n_probe=8)
+    index.add(rng.normal(size=(300, 8)), ids=np.arange(300) * 3)
+    queries = rng.normal(size=(10, 8))
+    path = str(tmp_path / 'index.npz')
+
+    index.save(path)
+    loaded = KnnIndex.load(path)
+
+    np.testing.assert_array_equal(loaded.vectors, index.vectors)
+    np.testing.assert_array_equal(loaded.ids, index.ids)
+    for result, expected in zip(loaded.search(queries, 3), index.search(queries, 3)):
+        np.testing.assert_array_equal(result, expected)
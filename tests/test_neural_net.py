@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+
+from n_networks.neural_net import BacilliNet, EnsembleMean, FusedBacilliNet, normalize_crops
+
+
+def test_fused_bacillinet_equals_ensemble_of_members():
+    torch.manual_seed(0)
+    members = [BacilliNet().eval() for _ in range(5)]
+    crops = np.random.default_rng(0).integers(0, 2 ** 16, (7, 50, 50)).astype(np.uint16)
+    batch = torch.from_numpy(normalize_crops(crops))
+
+    with torch.no_grad():
+        expected = torch.stack([member(batch) for member in members])
+        fused = FusedBacilliNet(members).eval()
+        outputs = fused(batch)
+        mean = EnsembleMean(fused)(batch)
+
+    assert outputs.shape == (5, 7, 1)
+    torch.testing.assert_close(outputs, expected, rtol=1e-5, atol=1e-6)
+    torch.testing.assert_close(mean, expected.mean(0), rtol=1e-5, atol=1e-6)
+
+
+def test_normalize_crops_matches_per_crop_scaling():
+    crops = np.random.default_rng(1).integers(0, 2 ** 16, (4, 50, 50)).astype(np.float64)
+    crops[3] = 7
+
+    batch = normalize_crops(crops)
+
+    assert batch.shape == (4, 1, 50, 50) and batch.dtype == np.float32
+    for crop, normalized in zip(crops[:3], batch[:3, 0]):
+        expected = (crop - crop.min()) / (crop.max() - crop.min()) - 0.5
+        np.testing.assert_array_equal(normalized, expected.astype(np.float32))
+    np.testing.assert_array_equal(batch[3, 0], crops[3].astype(np.float32))
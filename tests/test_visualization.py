@@ -0,0 +1,31 @@
+import cv2 as cv
+import numpy as np
+
+from src.visualization import add_bounding_boxes, box_outline_mask
+
+
+def test_box_outline_mask_matches_cv_rectangle():
+    rng = np.random.default_rng(0)
+    shape = (120, 90)
+    # background row, boxes inside the image and boxes crossing every border
+    stats = np.array([[0, 0, 90, 120, 0], [2, 3, 4, 5, 0], [80, 110, 8, 6, 0], [40, 50, 1, 1, 0],
+                      [-3, 60, 6, 4, 0], [85, 2, 20, 3, 0]] +
+                     [[x, y, w, h, 0] for x, y, w, h in zip(rng.integers(-10, 95, 30), rng.integers(-10, 125, 30),
+                                                           rng.integers(1, 15, 30), rng.integers(1, 15, 30))])
+    expected = np.zeros(shape, dtype=np.uint8)
+    for x, y, w, h, _ in stats[1:]:
+        cv.rectangle(expected, (int(x) - 5, int(y) - 5), (int(x + w) + 5, int(y + h) + 5), 1, 1)
+
+    np.testing.assert_array_equal(box_outline_mask(shape, stats), expected.astype(bool))
+
+
+def test_add_bounding_boxes_sets_the_outlines_only():
+    image = np.random.default_rng(1).integers(0, 1000, (60, 60)).astype(np.uint16)
+    stats = np.array([[0, 0, 60, 60, 0], [20, 20, 6, 8, 0]])
+
+    boxed = add_bounding_boxes(image, stats)
+
+    mask = box_outline_mask(image.shape, stats)
+    assert np.all(boxed[mask] == 5000)
+    np.testing.assert_array_equal(boxed[~mask], image[~mask])
+    assert image.max() < 1000